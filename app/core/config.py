@@ -26,8 +26,105 @@ class Settings(BaseSettings):
     CHAT_HISTORY_MESSAGES: int = Field(default=20, gt=0, le=200)
     DOCUMENT_CHUNK_CHARS: int = Field(default=2000, ge=200, le=20000)
     DOCUMENT_CHUNK_OVERLAP_CHARS: int = Field(default=200, ge=0, le=5000)
+    # chars — размер chunks в символах; tokens — в токенах модели эмбеддингов
+    # (DOCUMENT_CHUNK_TOKENS и DOCUMENT_CHUNK_OVERLAP_TOKENS).
+    DOCUMENT_CHUNK_UNIT: Literal["chars", "tokens"] = "chars"
+    DOCUMENT_CHUNK_TOKENS: int = Field(default=256, ge=16, le=8192)
+    DOCUMENT_CHUNK_OVERLAP_TOKENS: int = Field(default=32, ge=0, le=2048)
+    # Сколько chunks индексации за раз записывается в БД при reindex.
+    DOCUMENT_INDEX_BATCH_SIZE: int = Field(default=256, gt=0, le=10000)
+    # PDF от стольких страниц извлекается параллельно в пуле процессов.
+    # Пусто — всегда в одном потоке.
+    PDF_PARALLEL_MIN_PAGES: int | None = Field(default=200, gt=0)
+    # Число процессов извлечения PDF. Пусто — по числу доступных CPU.
+    PDF_EXTRACT_WORKERS: int | None = Field(default=None, gt=0, le=256)
+    # Chunks курса, чьи SimHash отличаются не более чем на столько бит, считаются
+    # почти дубликатами и используют один эмбеддинг. Пусто — без дедупликации.
+    DOCUMENT_DEDUP_MAX_DISTANCE: int | None = Field(default=6, ge=0, le=16)
     GRAPH_CONTEXT_MAX_CHARS: int = Field(default=60000, ge=1000, le=500000)
+    # Reindex и генерация графа выполняются воркерами из очереди generation_runs.
+    # Сколько запусков каждого типа выполняется одновременно: столько воркеров
+    # запускает python -m app.services.job_queue (или API-процесс, см. ниже).
+    # 0 — тип не обрабатывается этой группой воркеров.
+    JOB_DOCUMENT_INDEX_CONCURRENCY: int = Field(default=2, ge=0, le=64)
+    JOB_GRAPH_GENERATION_CONCURRENCY: int = Field(default=1, ge=0, le=64)
+    # Пауза воркера между проверками пустой очереди.
+    JOB_POLL_INTERVAL_SECONDS: float = Field(default=1.0, gt=0)
+    # Аренда запуска воркером. Воркер продлевает её каждую треть срока, пока
+    # выполняет запуск; запуск с истёкшей арендой (воркер упал или завис)
+    # возвращается в очередь, а прежний воркер не сохраняет свой результат.
+    JOB_LEASE_SECONDS: float = Field(default=120, ge=3)
+    # Выполнять очередь в потоках API-процесса. Отдельным процессам воркеров
+    # нужен общий с API VECTOR_STORE_DIR: in-memory индекс у каждого процесса свой.
+    JOB_WORKERS_IN_PROCESS: bool = True
     EMBEDDING_MODEL: str = "all-MiniLM-L6-v2"
+    # torch — SentenceTransformer; onnx — экспортированная модель на onnxruntime
+    # (CPU, опционально int8). Экспорт: python -m benchmarks.embedding_backends --export.
+    EMBEDDING_BACKEND: Literal["torch", "onnx"] = "torch"
+    # Каталог с model.onnx, model.int8.onnx и tokenizer.json для backend onnx.
+    EMBEDDING_ONNX_DIR: Path | None = None
+    EMBEDDING_ONNX_QUANTIZED: bool = False
+    # Потоки внутри одной операции модели; 0 — по числу ядер.
+    EMBEDDING_INTRA_OP_THREADS: int = Field(default=0, ge=0)
+    # Загрузка и прогрев модели эмбеддингов в фоне при старте. Пока модель
+    # грузится, /api/readiness отвечает 503 и балансировщик не шлёт трафик.
+    EMBEDDING_WARMUP_ON_STARTUP: bool = True
+    # Каталог для FAISS-индексов курсов. Без него векторы живут только в памяти
+    # процесса и после рестарта восстанавливаются из chunks в БД.
+    VECTOR_STORE_DIR: Path | None = None
+    # Восстанавливать in-memory индекс документов из БД в фоне при старте.
+    # Для VECTOR_STORE_DIR есть CLI: python -m app.services.vector_rehydration.
+    VECTOR_REHYDRATE_ON_STARTUP: bool = True
+    # Сколько chunks читается из БД и кодируется за один шаг восстановления.
+    VECTOR_REHYDRATE_PAGE_SIZE: int = Field(default=500, gt=0)
+    # Как часто workers перечитывают из БД, какая модель эмбеддингов обслуживает
+    # курсы во время миграции (python -m app.services.embedding_migration).
+    EMBEDDING_MIGRATION_STATE_TTL_SECONDS: float = Field(default=5, gt=0)
+    # Бюджет памяти каждого vector store (документы, уроки) в байтах. Сверх него
+    # давно не использованные курсы выгружаются и при запросе загружаются снова
+    # из VECTOR_STORE_DIR или, без него, из chunks в БД. Пусто — без лимита.
+    VECTOR_STORE_MAX_BYTES: int | None = Field(default=None, gt=0)
+    # SQLite-файл кэша эмбеддингов по (модель, sha256 текста chunk). Повторный
+    # reindex и одинаковые документы в разных курсах не кодируются заново.
+    EMBEDDING_CACHE_PATH: Path | None = None
+    # Micro-batching эмбеддингов поисковых запросов: запросы, пришедшие в
+    # пределах окна, кодируются одним вызовом модели.
+    EMBEDDING_BATCH_WINDOW_MS: float = Field(default=5.0, ge=0, le=1000)
+    EMBEDDING_BATCH_MAX_SIZE: int = Field(default=32, ge=1, le=1024)
+    # LRU-кэши поиска: эмбеддинги запросов и результаты retrieval. 0 отключает.
+    QUERY_EMBEDDING_CACHE_SIZE: int = Field(default=2048, ge=0)
+    RETRIEVAL_CACHE_SIZE: int = Field(default=1024, ge=0)
+    RETRIEVAL_CACHE_TTL_SECONDS: float = Field(default=300, gt=0)
+    # Партиции курса с таким числом chunks переходят с точного поиска на HNSW.
+    # 0 отключает приближённый поиск.
+    VECTOR_HNSW_MIN_CHUNKS: int = Field(default=50000, ge=0)
+    VECTOR_HNSW_M: int = Field(default=32, ge=4, le=128)
+    VECTOR_HNSW_EF_CONSTRUCTION: int = Field(default=80, ge=8, le=2048)
+    VECTOR_HNSW_EF_SEARCH: int = Field(default=64, ge=1, le=4096)
+    # Кодек хранения векторов: fp16 экономит память в 2 раза, sq8 — в 4, pq —
+    # в 8 и больше. sq8/pq обучаются, когда в партиции набирается
+    # VECTOR_CODEC_MIN_CHUNKS chunks; до этого векторы хранятся в float32.
+    VECTOR_CODEC: Literal["flat", "fp16", "sq8", "pq"] = "flat"
+    VECTOR_CODEC_MIN_CHUNKS: int = Field(default=10000, ge=256)
+    VECTOR_PQ_SUBQUANTIZERS: int = Field(default=96, ge=1, le=384)
+    # Точный пересчёт float32-расстояний для VECTOR_RESCORE_FACTOR * limit
+    # кандидатов. float32-копия лежит в vectors.npy и отображается через mmap.
+    VECTOR_RESCORE: bool = False
+    VECTOR_RESCORE_FACTOR: int = Field(default=4, ge=1, le=64)
+    # Гибридный retrieval: сколько кандидатов берут векторный поиск и BM25
+    # перед reciprocal rank fusion, и константа k этой формулы.
+    RETRIEVAL_VECTOR_CANDIDATES: int = Field(default=30, ge=1, le=1000)
+    RETRIEVAL_LEXICAL_CANDIDATES: int = Field(default=30, ge=1, le=1000)
+    RETRIEVAL_RRF_K: int = Field(default=60, ge=1, le=1000)
+    # Кэш разрешённых chunk id курса. Сбрасывается при изменении документов
+    # курса в этом процессе; TTL ограничивает задержку для других workers.
+    ACL_CACHE_SIZE: int = Field(default=1024, ge=0)
+    ACL_CACHE_TTL_SECONDS: float = Field(default=30, gt=0)
+    # Индекс уроков, теории, задач и тестов для /search. Его синхронизирует
+    # фоновый поток процесса API: изменения в этом процессе — сразу после
+    # commit, из других workers — не позже чем через TTL.
+    LESSON_INDEX_SYNC_TTL_SECONDS: float = Field(default=30, gt=0)
+    LESSON_INDEX_SYNC_IN_PROCESS: bool = True
 
     SMTP_HOST: str = ""
     SMTP_PORT: int = 25
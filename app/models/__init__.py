@@ -10,6 +10,7 @@ from .course_structure import CourseStructure
 from .course_version import CourseVersion
 from .feedback import Feedback
 from .document import Document, DocumentChunk
+from .embedding_migration_run import EmbeddingMigrationRun
 from .generation_run import GenerationRun
 from .learning_event import LearningEvent
 from .learning_objective import LearningObjective
@@ -37,6 +38,7 @@ __all__ = [
     "Feedback",
     "Document",
     "DocumentChunk",
+    "EmbeddingMigrationRun",
     "GenerationRun",
     "LearningEvent",
     "LearningObjective",
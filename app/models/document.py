@@ -51,6 +51,9 @@ class Document(Base, BaseModelMixin):
     mime_type = Column(String(255), nullable=False)
     size_bytes = Column(BigInteger, nullable=False)
     processing_error = Column(Text, nullable=True)
+    # Chunker settings the indexed chunks were cut with; documents with the
+    # same content and key share their chunks, see PipelineService.
+    chunking_key = Column(String(64), nullable=True)
 
     owner = relationship("User", back_populates="documents")
     course = relationship("Course", back_populates="documents")
@@ -98,5 +101,18 @@ class DocumentChunk(Base, BaseModelMixin):
     section = Column(String(512), nullable=True)
     metadata_json = Column("metadata", JSON_PAYLOAD, nullable=False, default=dict)
     chunk_index = Column(Integer, nullable=False)
+    # SHA-256 of the text; an incremental reindex keeps rows whose text is
+    # unchanged, see app.services.document_processing.chunk_fingerprint.
+    fingerprint = Column(String(64), nullable=True)
+    # 64-bit SimHash of the text, see app.services.near_duplicates.
+    simhash = Column(BigInteger, nullable=True)
+    # Set for near-duplicates of another chunk of the course; such chunks
+    # share the embedding of the canonical chunk instead of having their own.
+    canonical_chunk_id = Column(
+        Integer,
+        ForeignKey("document_chunks.id", ondelete="SET NULL"),
+        nullable=True,
+        index=True,
+    )
 
     document = relationship("Document", back_populates="chunks")
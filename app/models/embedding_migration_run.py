@@ -0,0 +1,47 @@
+from sqlalchemy import CheckConstraint, Column, Index, Integer, JSON, String, Text
+from sqlalchemy.dialects.postgresql import JSONB
+
+from app.database.db import Base
+from app.models.base import BaseModelMixin
+from app.models.domain_enums import GenerationRunStatus
+
+
+JSON_PAYLOAD = JSON().with_variant(JSONB, "postgresql")
+
+
+class EmbeddingMigrationRun(Base, BaseModelMixin):
+    """Re-embedding of all document chunks into the index of another model.
+
+    Courses listed in ``switched_course_ids`` are already served by
+    ``target_model`` while the run is in progress.
+    """
+
+    __tablename__ = "embedding_migration_runs"
+    __table_args__ = (
+        CheckConstraint(
+            "status IN ('queued', 'running', 'succeeded', 'failed')",
+            name="ck_embedding_migration_runs_status",
+        ),
+        CheckConstraint(
+            "courses_done >= 0 AND courses_done <= courses_total",
+            name="ck_embedding_migration_runs_progress",
+        ),
+        CheckConstraint(
+            "latency_ms IS NULL OR latency_ms >= 0",
+            name="ck_embedding_migration_runs_latency_nonnegative",
+        ),
+        Index("ix_embedding_migration_runs_status", "status"),
+    )
+
+    source_model = Column(String(255), nullable=False)
+    target_model = Column(String(255), nullable=False)
+    status = Column(
+        String(32), nullable=False, default=GenerationRunStatus.QUEUED.value
+    )
+    courses_total = Column(Integer, nullable=False, default=0)
+    courses_done = Column(Integer, nullable=False, default=0)
+    chunks_processed = Column(Integer, nullable=False, default=0)
+    switched_course_ids = Column(JSON_PAYLOAD, nullable=False, default=list)
+    output = Column(JSON_PAYLOAD, nullable=True)
+    latency_ms = Column(Integer, nullable=True)
+    error = Column(Text, nullable=True)
@@ -1,6 +1,7 @@
 from sqlalchemy import (
     CheckConstraint,
     Column,
+    DateTime,
     ForeignKey,
     Index,
     Integer,
@@ -40,6 +41,7 @@ class GenerationRun(Base, BaseModelMixin):
             name="ck_generation_runs_cost_nonnegative",
         ),
         Index("ix_generation_runs_owner_status", "owner_id", "status"),
+        Index("ix_generation_runs_queue", "status", "run_type", "id"),
         Index(
             "ix_generation_runs_fingerprint",
             "owner_id",
@@ -69,6 +71,10 @@ class GenerationRun(Base, BaseModelMixin):
     cost_usd = Column(Numeric(12, 6), nullable=True)
     latency_ms = Column(Integer, nullable=True)
     error = Column(Text, nullable=True)
+    # Worker lease of a running run: the claim token of the worker executing it
+    # and the time it must renew the lease by. Null for runs executed inline.
+    lease_owner = Column(String(64), nullable=True)
+    lease_expires_at = Column(DateTime, nullable=True)
 
     owner = relationship("User", back_populates="generation_runs")
     course = relationship("Course", back_populates="generation_runs")
@@ -0,0 +1,34 @@
+from sqlalchemy.orm import Session
+
+from app.models.document import Document
+from app.models.domain_enums import DocumentStatus, GenerationRunStatus
+from app.models.embedding_migration_run import EmbeddingMigrationRun
+
+
+class EmbeddingMigrationRepository:
+    @staticmethod
+    def latest_run(
+        db: Session, statuses: tuple[GenerationRunStatus, ...] | None = None
+    ) -> EmbeddingMigrationRun | None:
+        query = db.query(EmbeddingMigrationRun).filter(
+            EmbeddingMigrationRun.is_deleted.is_(False)
+        )
+        if statuses is not None:
+            query = query.filter(
+                EmbeddingMigrationRun.status.in_([status.value for status in statuses])
+            )
+        return query.order_by(EmbeddingMigrationRun.id.desc()).first()
+
+    @staticmethod
+    def indexed_course_ids(db: Session) -> list[int]:
+        """Courses with at least one indexed document, in id order."""
+        return [
+            row.course_id
+            for row in db.query(Document.course_id)
+            .filter(
+                Document.status == DocumentStatus.INDEXED.value,
+                Document.is_deleted.is_(False),
+            )
+            .distinct()
+            .order_by(Document.course_id)
+        ]
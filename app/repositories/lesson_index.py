@@ -0,0 +1,180 @@
+from sqlalchemy import func
+from sqlalchemy.engine import Row
+from sqlalchemy.orm import Session
+
+from app.models.course import Course
+from app.models.lesson import Lesson
+from app.models.module import Module
+from app.models.task import Task
+from app.models.test import Test
+from app.models.theory import Theory
+
+
+class LessonIndexRepository:
+    @staticmethod
+    def owned_course_ids(
+        db: Session, owner_id: int, course_id: int | None = None
+    ) -> list[int]:
+        query = db.query(Course.id).filter(
+            Course.owner_id == owner_id, Course.is_deleted.is_(False)
+        )
+        if course_id is not None:
+            query = query.filter(Course.id == course_id)
+        return [row.id for row in query.order_by(Course.id).all()]
+
+    @staticmethod
+    def course_owners(db: Session, course_ids: set[int] | None = None) -> dict[int, int]:
+        """Owner of every live course, or of the live ones among ``course_ids``."""
+        query = db.query(Course.id, Course.owner_id).filter(
+            Course.is_deleted.is_(False), Course.owner_id.is_not(None)
+        )
+        if course_ids is not None:
+            if not course_ids:
+                return {}
+            query = query.filter(Course.id.in_(course_ids))
+        return {row.id: row.owner_id for row in query}
+
+    @staticmethod
+    def content_course_ids(
+        db: Session, module_ids: set[int], lesson_ids: set[int]
+    ) -> set[int]:
+        """Courses of modules and of the modules of lessons, deleted ones too."""
+        course_ids = set()
+        if module_ids:
+            course_ids.update(
+                row.course_id
+                for row in db.query(Module.course_id).filter(Module.id.in_(module_ids))
+            )
+        if lesson_ids:
+            course_ids.update(
+                row.course_id
+                for row in db.query(Module.course_id)
+                .join(Lesson, Lesson.module_id == Module.id)
+                .filter(Lesson.id.in_(lesson_ids))
+            )
+        return course_ids
+
+    @staticmethod
+    def module_stamps(
+        db: Session, course_ids: set[int] | None = None
+    ) -> dict[tuple[int, int], dict[int, tuple]]:
+        """Row count and last update per content table for every live module.
+
+        Keyed by the (owner_id, course_id) of the module's live course, of
+        all courses or of ``course_ids``, with one grouped query per table
+        whatever their number. Any insert, update, soft or hard delete of
+        indexed content changes the stamp of its module, including bulk
+        statements that bypass the ORM. A deleted course has no entry.
+        """
+        if course_ids is not None and not course_ids:
+            return {}
+        modules = (
+            db.query(Module.id, Course.owner_id, Course.id.label("course_id"))
+            .join(Course, Course.id == Module.course_id)
+            .filter(
+                Module.is_deleted.is_(False),
+                Course.is_deleted.is_(False),
+                Course.owner_id.is_not(None),
+            )
+        )
+        if course_ids is not None:
+            modules = modules.filter(Course.id.in_(course_ids))
+        keys = {row.id: (row.owner_id, row.course_id) for row in modules}
+        if not keys:
+            return {}
+        stamps: dict[int, list] = {module_id: [] for module_id in keys}
+
+        def scoped(query, module_id):
+            if course_ids is None:
+                return query
+            return query.join(Module, Module.id == module_id).filter(
+                Module.course_id.in_(course_ids)
+            )
+
+        queries = (
+            scoped(
+                db.query(Lesson.module_id, func.count(), func.max(Lesson.updated_at)),
+                Lesson.module_id,
+            )
+            .filter(Lesson.is_deleted.is_(False))
+            .group_by(Lesson.module_id),
+            scoped(
+                db.query(Lesson.module_id, func.count(), func.max(Theory.updated_at))
+                .select_from(Lesson)
+                .join(Theory, Theory.lesson_id == Lesson.id),
+                Lesson.module_id,
+            )
+            .filter(Lesson.is_deleted.is_(False), Theory.is_deleted.is_(False))
+            .group_by(Lesson.module_id),
+            scoped(
+                db.query(Task.module_id, func.count(), func.max(Task.updated_at)),
+                Task.module_id,
+            )
+            .filter(Task.is_deleted.is_(False))
+            .group_by(Task.module_id),
+            scoped(
+                db.query(Test.module_id, func.count(), func.max(Test.updated_at)),
+                Test.module_id,
+            )
+            .filter(Test.is_deleted.is_(False))
+            .group_by(Test.module_id),
+        )
+        for position, query in enumerate(queries):
+            for module_id, count, updated_at in query:
+                # Content of deleted modules and courses is not indexed.
+                if module_id in stamps:
+                    stamps[module_id].append((position, count, str(updated_at)))
+        courses: dict[tuple[int, int], dict[int, tuple]] = {}
+        for module_id, key in keys.items():
+            courses.setdefault(key, {})[module_id] = tuple(stamps[module_id])
+        return courses
+
+    @staticmethod
+    def _content_queries(db: Session):
+        lessons = db.query(
+            Lesson.id, Lesson.module_id, Lesson.title, Lesson.description
+        ).filter(Lesson.is_deleted.is_(False))
+        theories = (
+            db.query(Theory.id, Theory.lesson_id, Lesson.module_id, Theory.content)
+            .join(Lesson, Theory.lesson_id == Lesson.id)
+            .filter(Lesson.is_deleted.is_(False), Theory.is_deleted.is_(False))
+        )
+        tasks = db.query(Task.id, Task.module_id, Task.name, Task.description).filter(
+            Task.is_deleted.is_(False)
+        )
+        tests = db.query(Test.id, Test.module_id, Test.question).filter(
+            Test.is_deleted.is_(False)
+        )
+        return lessons, theories, tasks, tests
+
+    @staticmethod
+    def module_content(
+        db: Session, module_ids: list[int]
+    ) -> tuple[list[Row], list[Row], list[Row], list[Row]]:
+        """Lessons, theories, tasks and tests of ``module_ids`` to embed."""
+        if not module_ids:
+            return [], [], [], []
+        lessons, theories, tasks, tests = LessonIndexRepository._content_queries(db)
+        return (
+            lessons.filter(Lesson.module_id.in_(module_ids)).order_by(Lesson.id).all(),
+            theories.filter(Lesson.module_id.in_(module_ids)).order_by(Theory.id).all(),
+            tasks.filter(Task.module_id.in_(module_ids)).order_by(Task.id).all(),
+            tests.filter(Test.module_id.in_(module_ids)).order_by(Test.id).all(),
+        )
+
+    @staticmethod
+    def item_content(
+        db: Session, item_ids: dict[str, set[int]]
+    ) -> tuple[list[Row], list[Row], list[Row], list[Row]]:
+        """Live lessons, theories, tasks and tests by id, keyed by item type."""
+        lessons, theories, tasks, tests = LessonIndexRepository._content_queries(db)
+        queries = (
+            ("lesson", lessons, Lesson.id),
+            ("theory", theories, Theory.id),
+            ("task", tasks, Task.id),
+            ("test", tests, Test.id),
+        )
+        return tuple(
+            query.filter(column.in_(item_ids[kind])).all() if item_ids.get(kind) else []
+            for kind, query, column in queries
+        )
@@ -1,10 +1,19 @@
-from sqlalchemy import func
-from sqlalchemy.orm import Session
+from collections.abc import Iterator
+from datetime import datetime
+
+from sqlalchemy import func, update
+from sqlalchemy.engine import Row
+from sqlalchemy.orm import Session, defer
 
 from app.models.course import Course
 from app.models.course_graph import CourseGraph
 from app.models.course_generation_settings import CourseGenerationSettings
 from app.models.document import Document, DocumentChunk
+from app.models.domain_enums import (
+    DocumentStatus,
+    GenerationRunStatus,
+    GenerationRunType,
+)
 from app.models.generation_run import GenerationRun
 
 
@@ -65,6 +74,99 @@ class PipelineRepository:
             .first()
         )
 
+    @staticmethod
+    def pending_document_run(db: Session, document_id: int) -> GenerationRun | None:
+        """Queued or running indexing of a document, if there is one."""
+        return (
+            db.query(GenerationRun)
+            .filter(
+                GenerationRun.document_id == document_id,
+                GenerationRun.run_type == GenerationRunType.DOCUMENT_INDEX.value,
+                GenerationRun.status.in_(
+                    (
+                        GenerationRunStatus.QUEUED.value,
+                        GenerationRunStatus.RUNNING.value,
+                    )
+                ),
+                GenerationRun.is_deleted.is_(False),
+            )
+            .order_by(GenerationRun.id.desc())
+            .first()
+        )
+
+    @staticmethod
+    def next_queued_run(db: Session, run_type: str) -> GenerationRun | None:
+        """Oldest queued run of a type, row-locked.
+
+        Runs locked by other workers are skipped rather than waited for, so
+        workers claim different runs. SQLite has no row locks and ignores it.
+        """
+        return (
+            db.query(GenerationRun)
+            .filter(
+                GenerationRun.status == GenerationRunStatus.QUEUED.value,
+                GenerationRun.run_type == run_type,
+                GenerationRun.is_deleted.is_(False),
+            )
+            .order_by(GenerationRun.id)
+            .with_for_update(skip_locked=True)
+            .first()
+        )
+
+    @staticmethod
+    def requeue_expired_runs(db: Session, run_type: str, now: datetime) -> int:
+        """Queue again running runs whose worker stopped renewing the lease."""
+        return (
+            db.query(GenerationRun)
+            .filter(
+                GenerationRun.status == GenerationRunStatus.RUNNING.value,
+                GenerationRun.run_type == run_type,
+                GenerationRun.lease_expires_at < now,
+                GenerationRun.is_deleted.is_(False),
+            )
+            .update(
+                {
+                    GenerationRun.status: GenerationRunStatus.QUEUED.value,
+                    GenerationRun.lease_owner: None,
+                    GenerationRun.lease_expires_at: None,
+                },
+                synchronize_session=False,
+            )
+        )
+
+    @staticmethod
+    def renew_lease(
+        db: Session, run_id: int, lease_owner: str, expires_at: datetime
+    ) -> bool:
+        """Extend the lease of a running run; False once another worker holds it."""
+        renewed = (
+            db.query(GenerationRun)
+            .filter(
+                GenerationRun.id == run_id,
+                GenerationRun.lease_owner == lease_owner,
+                GenerationRun.status == GenerationRunStatus.RUNNING.value,
+            )
+            .update(
+                {GenerationRun.lease_expires_at: expires_at},
+                synchronize_session=False,
+            )
+        )
+        return renewed == 1
+
+    @staticmethod
+    def locked_lease_owner(db: Session, run_id: int) -> str | None:
+        """Current lease owner of a run, row-locked until the transaction ends.
+
+        The lock keeps the lease from being requeued between the check and the
+        commit of the run results.
+        """
+        return (
+            db.query(GenerationRun.lease_owner)
+            .filter(GenerationRun.id == run_id)
+            .with_for_update()
+            .scalar()
+        )
+
     @staticmethod
     def indexed_documents(
         db: Session, course_id: int, owner_id: int
@@ -82,37 +184,150 @@ class PipelineRepository:
         )
 
     @staticmethod
-    def replace_chunks(
-        db: Session, document: Document, chunks: list[dict]
-    ) -> list[DocumentChunk]:
-        (
+    def chunk_artifact(
+        db: Session, document: Document, chunking_key: str
+    ) -> Document | None:
+        """Another indexed document of the owner with the same file, cut the same way.
+
+        Artifacts are never shared between owners: reuse would reveal that
+        another tenant holds the same file.
+        """
+        return (
+            db.query(Document)
+            .filter(
+                Document.id != document.id,
+                Document.owner_id == document.owner_id,
+                Document.content_hash == document.content_hash,
+                Document.mime_type == document.mime_type,
+                Document.size_bytes == document.size_bytes,
+                Document.chunking_key == chunking_key,
+                Document.status == DocumentStatus.INDEXED.value,
+                Document.is_deleted.is_(False),
+            )
+            .order_by(Document.id)
+            .first()
+        )
+
+    @staticmethod
+    def version_chunks(
+        db: Session, document: Document, batch_size: int, *, canonical_only: bool = False
+    ) -> Iterator[Row]:
+        """Chunks of the current version in order, fetched in batches.
+
+        ``canonical_only`` skips near-duplicates, which have no vector of
+        their own.
+        """
+        query = db.query(
+            DocumentChunk.id,
+            DocumentChunk.text,
+            DocumentChunk.page,
+            DocumentChunk.section,
+            DocumentChunk.chunk_index,
+        ).filter(
+            DocumentChunk.document_id == document.id,
+            DocumentChunk.document_version == document.version,
+            DocumentChunk.is_deleted.is_(False),
+        )
+        if canonical_only:
+            query = query.filter(DocumentChunk.canonical_chunk_id.is_(None))
+        return query.order_by(DocumentChunk.chunk_index).yield_per(batch_size)
+
+    @staticmethod
+    def version_chunk_signatures(db: Session, document: Document) -> list[Row]:
+        """``(id, simhash, canonical_chunk_id)`` of the current version by position."""
+        return (
+            db.query(
+                DocumentChunk.id, DocumentChunk.simhash, DocumentChunk.canonical_chunk_id
+            )
+            .filter(
+                DocumentChunk.document_id == document.id,
+                DocumentChunk.document_version == document.version,
+                DocumentChunk.is_deleted.is_(False),
+            )
+            .order_by(DocumentChunk.chunk_index)
+            .all()
+        )
+
+    @staticmethod
+    def version_chunk_links(db: Session, document: Document) -> list[Row]:
+        """``(id, canonical_chunk_id)`` of the chunks of the current version."""
+        return (
+            db.query(DocumentChunk.id, DocumentChunk.canonical_chunk_id)
+            .filter(
+                DocumentChunk.document_id == document.id,
+                DocumentChunk.document_version == document.version,
+                DocumentChunk.is_deleted.is_(False),
+            )
+            .order_by(DocumentChunk.chunk_index)
+            .all()
+        )
+
+    @staticmethod
+    def document_chunk_states(db: Session, document: Document) -> list[DocumentChunk]:
+        """Chunks of the current version without their text, by position."""
+        return (
             db.query(DocumentChunk)
+            .options(defer(DocumentChunk.text))
             .filter(
                 DocumentChunk.document_id == document.id,
                 DocumentChunk.document_version == document.version,
             )
-            .delete(synchronize_session=False)
+            .order_by(DocumentChunk.chunk_index)
+            .all()
         )
+
+    @staticmethod
+    def chunk_texts(db: Session, chunk_ids: list[int]) -> dict[int, str]:
+        if not chunk_ids:
+            return {}
+        return dict(
+            db.query(DocumentChunk.id, DocumentChunk.text)
+            .filter(DocumentChunk.id.in_(chunk_ids))
+            .all()
+        )
+
+    @staticmethod
+    def delete_chunks(db: Session, chunk_ids: list[int]) -> None:
+        if chunk_ids:
+            (
+                db.query(DocumentChunk)
+                .filter(DocumentChunk.id.in_(chunk_ids))
+                .delete(synchronize_session="evaluate")
+            )
+
+    @staticmethod
+    def _chunk_fields(document: Document, chunk: dict) -> dict:
+        """Column values of a chunk produced by ``chunk_blocks``."""
+        return {
+            "page": chunk.get("page"),
+            "section": chunk.get("section"),
+            "metadata_json": {
+                **chunk.get("metadata_json", {}),
+                "document_id": document.id,
+                "document_version": document.version,
+                "page": chunk.get("page"),
+                "section": chunk.get("section"),
+                "source": document.original_filename,
+                "source_type": document.source_type,
+                "owner_id": document.owner_id,
+                "organization_id": None,
+                "course_id": document.course_id,
+            },
+            "chunk_index": chunk["chunk_index"],
+        }
+
+    @staticmethod
+    def add_chunks(
+        db: Session, document: Document, chunks: list[dict]
+    ) -> list[DocumentChunk]:
         models = [
             DocumentChunk(
                 document_id=document.id,
                 document_version=document.version,
                 text=chunk["text"],
-                page=chunk.get("page"),
-                section=chunk.get("section"),
-                metadata_json={
-                    **chunk.get("metadata_json", {}),
-                    "document_id": document.id,
-                    "document_version": document.version,
-                    "page": chunk.get("page"),
-                    "section": chunk.get("section"),
-                    "source": document.original_filename,
-                    "source_type": document.source_type,
-                    "owner_id": document.owner_id,
-                    "organization_id": None,
-                    "course_id": document.course_id,
-                },
-                chunk_index=chunk["chunk_index"],
+                fingerprint=chunk.get("fingerprint"),
+                simhash=chunk.get("simhash"),
+                **PipelineRepository._chunk_fields(document, chunk),
             )
             for chunk in chunks
         ]
@@ -120,6 +335,114 @@ class PipelineRepository:
         db.flush()
         return models
 
+    @staticmethod
+    def update_chunk(
+        document: Document, chunk_model: DocumentChunk, chunk: dict
+    ) -> None:
+        """Move a kept chunk to its position and metadata in the new chunking."""
+        for name, value in PipelineRepository._chunk_fields(document, chunk).items():
+            setattr(chunk_model, name, value)
+
+    @staticmethod
+    def unpark_chunks(db: Session, document: Document, parking: int, count: int) -> None:
+        """Move chunks parked at ``parking + i`` to position ``i`` of ``count``.
+
+        Positions are unique and may be checked row by row, so when the parked
+        range overlaps the final one it is first shifted past it.
+        """
+        position = DocumentChunk.chunk_index
+        scope = (
+            DocumentChunk.document_id == document.id,
+            DocumentChunk.document_version == document.version,
+        )
+        if parking < count:
+            db.execute(
+                update(DocumentChunk)
+                .where(*scope, position >= parking)
+                .values(chunk_index=position + count)
+                .execution_options(synchronize_session="fetch")
+            )
+            parking += count
+        db.execute(
+            update(DocumentChunk)
+            .where(*scope, position >= parking)
+            .values(chunk_index=position - parking)
+            .execution_options(synchronize_session="fetch")
+        )
+
+    @staticmethod
+    def set_canonical_chunk_ids(db: Session, canonical_ids: dict[int, int]) -> None:
+        if canonical_ids:
+            db.execute(
+                update(DocumentChunk),
+                [
+                    {"id": chunk_id, "canonical_chunk_id": canonical_id}
+                    for chunk_id, canonical_id in canonical_ids.items()
+                ],
+            )
+
+    @staticmethod
+    def set_embedding_ids(db: Session, embedding_ids: dict[int, str]) -> None:
+        if embedding_ids:
+            db.execute(
+                update(DocumentChunk),
+                [
+                    {"id": chunk_id, "embedding_id": embedding_id}
+                    for chunk_id, embedding_id in embedding_ids.items()
+                ],
+            )
+
+    @staticmethod
+    def _served_chunks(query):
+        return query.join(Document, DocumentChunk.document_id == Document.id).filter(
+            Document.status == DocumentStatus.INDEXED.value,
+            Document.is_deleted.is_(False),
+            DocumentChunk.is_deleted.is_(False),
+            DocumentChunk.document_version == Document.version,
+        )
+
+    @staticmethod
+    def course_chunk_signatures(
+        db: Session, course_id: int, owner_id: int, exclude_document_id: int
+    ) -> list[Row]:
+        """Canonical chunks of a course that near-duplicates may link to."""
+        return (
+            PipelineRepository._served_chunks(
+                db.query(
+                    DocumentChunk.id,
+                    DocumentChunk.simhash,
+                    DocumentChunk.embedding_id,
+                )
+            )
+            .filter(
+                Document.course_id == course_id,
+                Document.owner_id == owner_id,
+                Document.id != exclude_document_id,
+                DocumentChunk.canonical_chunk_id.is_(None),
+                DocumentChunk.simhash.is_not(None),
+                DocumentChunk.embedding_id.is_not(None),
+            )
+            .order_by(DocumentChunk.id)
+            .all()
+        )
+
+    @staticmethod
+    def dependent_duplicates(
+        db: Session, document_id: int, chunk_ids: list[int]
+    ) -> list[DocumentChunk]:
+        """Served chunks of other documents linked to one of ``chunk_ids``."""
+        if not chunk_ids:
+            return []
+        return (
+            PipelineRepository._served_chunks(db.query(DocumentChunk))
+            .filter(
+                DocumentChunk.document_id != document_id,
+                DocumentChunk.canonical_chunk_id.in_(chunk_ids),
+            )
+            .order_by(DocumentChunk.id)
+            .all()
+        )
+
     @staticmethod
     def latest_successful_graph_run(
         db: Session, owner_id: int, course_id: int, fingerprint: str
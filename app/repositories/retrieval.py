@@ -1,4 +1,6 @@
-from sqlalchemy.orm import Session, joinedload
+from sqlalchemy import and_, or_, tuple_
+from sqlalchemy.engine import Row
+from sqlalchemy.orm import Query, Session
 
 from app.models.course import Course
 from app.models.document import Document, DocumentChunk
@@ -15,25 +17,170 @@ class RetrievalRepository:
         )
 
     @staticmethod
-    def accessible_chunks(
-        db: Session, course_id: int, owner_id: int
-    ) -> list[DocumentChunk]:
+    def _accessible(query: Query, course_id: int, owner_id: int) -> Query:
+        return query.join(Document, DocumentChunk.document_id == Document.id).filter(
+            Document.course_id == course_id,
+            Document.owner_id == owner_id,
+            Document.status == DocumentStatus.INDEXED.value,
+            Document.is_deleted.is_(False),
+            DocumentChunk.is_deleted.is_(False),
+            DocumentChunk.document_version == Document.version,
+        )
+
+    @staticmethod
+    def accessible_chunk_ids(db: Session, course_id: int, owner_id: int) -> list[Row]:
+        """ACL rows of a course: chunk, document, version and canonical chunk."""
+        return RetrievalRepository._accessible(
+            db.query(
+                DocumentChunk.id,
+                DocumentChunk.document_id,
+                DocumentChunk.document_version,
+                DocumentChunk.canonical_chunk_id,
+            ),
+            course_id,
+            owner_id,
+        ).all()
+
+    @staticmethod
+    def _vector_fields(query: Query) -> Query:
+        return query.with_entities(
+            DocumentChunk.id,
+            DocumentChunk.document_id,
+            DocumentChunk.document_version,
+            DocumentChunk.chunk_index,
+            DocumentChunk.embedding_id,
+            DocumentChunk.page,
+            DocumentChunk.section,
+            DocumentChunk.text,
+            Document.owner_id,
+            Document.course_id,
+            Document.original_filename,
+            Document.source_type,
+        )
+
+    @staticmethod
+    def _indexed(query: Query) -> Query:
+        # Near-duplicates share the vector of their canonical chunk.
+        return query.join(Document, DocumentChunk.document_id == Document.id).filter(
+            Document.status == DocumentStatus.INDEXED.value,
+            Document.is_deleted.is_(False),
+            DocumentChunk.is_deleted.is_(False),
+            DocumentChunk.document_version == Document.version,
+            DocumentChunk.canonical_chunk_id.is_(None),
+        )
+
+    @staticmethod
+    def partition_chunks(db: Session, owner_id: int, course_id: int) -> list[Row]:
+        """Vector rows of a course: the fields stored in the vector store."""
         return (
-            db.query(DocumentChunk)
-            .join(Document, DocumentChunk.document_id == Document.id)
-            .options(joinedload(DocumentChunk.document))
-            .filter(
-                Document.course_id == course_id,
-                Document.owner_id == owner_id,
-                Document.status == DocumentStatus.INDEXED.value,
-                Document.is_deleted.is_(False),
-                DocumentChunk.is_deleted.is_(False),
-                DocumentChunk.document_version == Document.version,
+            RetrievalRepository._vector_fields(
+                RetrievalRepository._indexed(db.query(DocumentChunk)).filter(
+                    Document.course_id == course_id, Document.owner_id == owner_id
+                )
             )
+            .order_by(DocumentChunk.document_id, DocumentChunk.chunk_index)
+            .all()
+        )
+
+    @staticmethod
+    def indexed_chunk_page(
+        db: Session,
+        after: tuple[int, int, int] | None,
+        limit: int,
+        course_id: int | None = None,
+    ) -> list[Row]:
+        """Next ``limit`` indexed chunks of all courses in keyset order.
+
+        Rows are ordered by (course_id, document_id, chunk_index) and ``after``
+        is that triple of the last row already read, so every page is an index
+        range scan however deep into the corpus it starts.
+        """
+        query = RetrievalRepository._indexed(db.query(DocumentChunk))
+        if course_id is not None:
+            query = query.filter(Document.course_id == course_id)
+        if after is not None:
+            query = query.filter(
+                tuple_(
+                    Document.course_id,
+                    DocumentChunk.document_id,
+                    DocumentChunk.chunk_index,
+                )
+                > tuple_(*after)
+            )
+        return (
+            RetrievalRepository._vector_fields(query)
             .order_by(
+                Document.course_id, DocumentChunk.document_id, DocumentChunk.chunk_index
+            )
+            .limit(limit)
+            .all()
+        )
+
+    @staticmethod
+    def document_vector_chunks(db: Session, document_ids: list[int]) -> list[Row]:
+        """Vector rows of the indexed versions of ``document_ids``."""
+        if not document_ids:
+            return []
+        return (
+            RetrievalRepository._vector_fields(
+                RetrievalRepository._indexed(db.query(DocumentChunk)).filter(
+                    DocumentChunk.document_id.in_(document_ids)
+                )
+            )
+            .order_by(DocumentChunk.document_id, DocumentChunk.chunk_index)
+            .all()
+        )
+
+    @staticmethod
+    def citation_chunks(
+        db: Session, course_id: int, owner_id: int, chunk_ids: list[int]
+    ) -> list[Row]:
+        if not chunk_ids:
+            return []
+        return (
+            RetrievalRepository._accessible(
+                db.query(
+                    DocumentChunk.id,
+                    DocumentChunk.document_id,
+                    DocumentChunk.document_version,
+                    DocumentChunk.page,
+                    DocumentChunk.section,
+                    DocumentChunk.text,
+                    Document.original_filename,
+                    Document.source_type,
+                ),
+                course_id,
+                owner_id,
+            )
+            .filter(DocumentChunk.id.in_(chunk_ids))
+            .all()
+        )
+
+    @staticmethod
+    def document_chunk_texts(
+        db: Session, document_versions: dict[int, int]
+    ) -> list[Row]:
+        if not document_versions:
+            return []
+        return (
+            db.query(
+                DocumentChunk.id,
                 DocumentChunk.document_id,
                 DocumentChunk.document_version,
-                DocumentChunk.chunk_index,
+                DocumentChunk.text,
+            )
+            .filter(
+                DocumentChunk.is_deleted.is_(False),
+                or_(
+                    *(
+                        and_(
+                            DocumentChunk.document_id == document_id,
+                            DocumentChunk.document_version == version,
+                        )
+                        for document_id, version in document_versions.items()
+                    )
+                ),
             )
+            .order_by(DocumentChunk.document_id, DocumentChunk.chunk_index)
             .all()
         )
@@ -15,7 +15,6 @@ from app.models.task import Task
 from app.models.course_structure import CourseStructure
 from app.models.user import User
 from app.services.generation_service import generate_from_prompt
-from app.services.embedding_service import embed_and_add
 from app.services.auth_service import get_current_user
 
 router = APIRouter()
@@ -195,16 +194,6 @@ def generate_and_save_lesson_content(
 
     db.commit()
 
-    # ✅ Векторизация всего контента
-    embed_and_add(lesson.id, "lesson", lesson.title)
-    embed_and_add(lesson.id, "theory", content_data.get("theory", ""))
-
-    for task in content_data.get("tasks", []):
-        embed_and_add(lesson.id, "task", task.get("description", ""))
-
-    for q in content_data.get("questions", []):
-        embed_and_add(lesson.id, "test", q.get("question", ""))
-
     return {
         "message": "✅ Контент сгенерирован и сохранён (теория, задачи, тесты)",
         "questions": content_data.get("questions", []),
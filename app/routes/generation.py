@@ -8,7 +8,6 @@ from app.models.lesson import Lesson
 from app.models.task import Task
 from app.models.test import Test
 from app.models.theory import Theory
-from app.services.embedding_service import embed_and_add
 from app.database.db import get_db
 import json, logging, traceback
 
@@ -3,6 +3,14 @@ from fastapi.responses import JSONResponse
 from sqlalchemy.orm import Session
 from sqlalchemy import text
 from app.database.db import get_db
+from app.services.acl_cache import course_acl_cache
+from app.services.embedding_service import (
+    document_vector_store,
+    lesson_vector_store,
+    model_loader,
+    query_encoder,
+    versioned_vector_store,
+)
 
 router = APIRouter()
 
@@ -12,11 +20,37 @@ def healthz():
 
 @router.get("/readiness")
 def readiness(db: Session = Depends(get_db)):
+    embedding_model = model_loader.status()
     try:
         db.execute(text("SELECT 1"))
-        return {"ok": True, "db": "up"}
     except Exception:
         return JSONResponse(
             status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
-            content={"ok": False, "db": "down"},
+            content={"ok": False, "db": "down", "embedding_model": embedding_model},
         )
+    # A worker without the model still serves everything but semantic search,
+    # so only an in-flight warm-up keeps it out of rotation.
+    if embedding_model["state"] == model_loader.LOADING:
+        return JSONResponse(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            content={"ok": False, "db": "up", "embedding_model": embedding_model},
+        )
+    return {"ok": True, "db": "up", "embedding_model": embedding_model}
+
+
+@router.get("/metrics")
+def metrics():
+    index_state = versioned_vector_store.state()
+    return {
+        "embedding_batcher": query_encoder.stats(),
+        "search_cache": document_vector_store.search_cache_stats(),
+        "lesson_search_cache": lesson_vector_store.search_cache_stats(),
+        "vector_store": document_vector_store.memory_stats(),
+        "lesson_vector_store": lesson_vector_store.memory_stats(),
+        "embedding_index": {
+            "serving_model": index_state.serving_model,
+            "target_model": index_state.target_model,
+            "switched_courses": len(index_state.switched_course_ids),
+        },
+        "acl_cache": course_acl_cache.stats(),
+    }
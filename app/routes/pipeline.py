@@ -1,25 +1,19 @@
-from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi import APIRouter, Depends, Query, Response, status
 from sqlalchemy.orm import Session
 
 from app.database.db import get_db
+from app.models.domain_enums import GenerationRunStatus
+from app.models.generation_run import GenerationRun
 from app.models.user import User
 from app.schemas.document import DocumentListItem, document_list_item
 from app.schemas.generation_run import GenerationRunOut
 from app.services.auth_service import get_current_user
-from app.services.file_storage import FileStorage, get_file_storage
-from app.services.pipeline_service import PipelineRunFailed, PipelineService
+from app.services.pipeline_service import PipelineService
 
 
 router = APIRouter()
 
 
-def _translate_failure(exc: PipelineRunFailed) -> HTTPException:
-    return HTTPException(
-        status_code=exc.status_code,
-        detail={"message": exc.message, "run_id": exc.run_id},
-    )
-
-
 @router.get("/documents/{document_id}", response_model=DocumentListItem)
 def get_document(
     document_id: int,
@@ -31,41 +25,55 @@ def get_document(
     )
 
 
+def _accepted(response: Response, run: GenerationRun) -> GenerationRun:
+    """202 while the run is pending; poll the run until it is finished."""
+    if run.status not in (
+        GenerationRunStatus.QUEUED.value,
+        GenerationRunStatus.RUNNING.value,
+    ):
+        response.status_code = status.HTTP_200_OK
+    response.headers["Location"] = f"/api/generation-runs/{run.id}"
+    return run
+
+
 @router.post(
-    "/documents/{document_id}/reindex", response_model=GenerationRunOut
+    "/documents/{document_id}/reindex",
+    response_model=GenerationRunOut,
+    status_code=status.HTTP_202_ACCEPTED,
 )
 def reindex_document(
     document_id: int,
+    response: Response,
     db: Session = Depends(get_db),
     current_user: User = Depends(get_current_user),
-    storage: FileStorage = Depends(get_file_storage),
 ):
-    try:
-        return PipelineService.reindex_document(
-            db,
-            document_id=document_id,
-            owner_id=current_user.id,
-            storage=storage,
-        )
-    except PipelineRunFailed as exc:
-        raise _translate_failure(exc)
+    return _accepted(
+        response,
+        PipelineService.enqueue_reindex(
+            db, document_id=document_id, owner_id=current_user.id
+        ),
+    )
 
 
 @router.post(
-    "/courses/{course_id}/generate-graph", response_model=GenerationRunOut
+    "/courses/{course_id}/generate-graph",
+    response_model=GenerationRunOut,
+    status_code=status.HTTP_202_ACCEPTED,
 )
 def generate_graph(
     course_id: int,
+    response: Response,
     force: bool = Query(default=False),
     db: Session = Depends(get_db),
     current_user: User = Depends(get_current_user),
 ):
-    try:
-        return PipelineService.generate_graph(
+    # An earlier run that is still current comes back finished, with 200.
+    return _accepted(
+        response,
+        PipelineService.enqueue_graph_generation(
             db, course_id=course_id, owner_id=current_user.id, force=force
-        )
-    except PipelineRunFailed as exc:
-        raise _translate_failure(exc)
+        ),
+    )
 
 
 @router.get("/generation-runs/{run_id}", response_model=GenerationRunOut)
@@ -1,38 +1,69 @@
 # app/routes/search.py
-from fastapi import APIRouter, Depends, Query
+from fastapi import APIRouter, Depends, HTTPException, Query
 from sqlalchemy.orm import Session
 
 from app.database.db import get_db
-from app.models.course import Course
-from app.models.lesson import Lesson
-from app.models.module import Module
 from app.models.user import User
+from app.repositories.lesson_index import LessonIndexRepository
+from app.services.acl_cache import CourseAclCache, get_acl_cache
 from app.services.auth_service import get_current_user
-from app.services.embedding_service import search
-from app.schemas.retrieval import RetrievalResponse
-from app.services.embedding_service import get_vector_store
+from app.schemas.retrieval import (
+    LessonSearchResponse,
+    LessonSearchResult,
+    RetrievalBatchRequest,
+    RetrievalBatchResponse,
+    RetrievalResponse,
+)
+from app.services.embedding_service import get_lesson_index, get_vector_store
+from app.services.lesson_index import LessonContentIndex
+from app.services.lexical_index import LexicalIndex, get_lexical_index
 from app.services.retrieval_service import RetrievalService
 from app.services.vector_store import VectorStore
 
 router = APIRouter()
 
 
-@router.get("/search", summary="Семантический поиск по контенту курса")
+@router.get(
+    "/search",
+    response_model=LessonSearchResponse,
+    summary="Семантический поиск по контенту курса",
+)
 def semantic_search(
-    q: str = Query(..., description="Поисковый запрос"),
+    q: str = Query(..., min_length=1, max_length=2000, description="Поисковый запрос"),
+    course_id: int | None = Query(default=None, description="Искать только в этом курсе"),
+    limit: int = Query(default=5, ge=1, le=50),
     db: Session = Depends(get_db),
     current_user: User = Depends(get_current_user),
+    lesson_index: LessonContentIndex = Depends(get_lesson_index),
 ):
-    lesson_ids = {
-        row[0]
-        for row in db.query(Lesson.id)
-        .join(Module, Lesson.module_id == Module.id)
-        .join(Course, Module.course_id == Course.id)
-        .filter(Course.owner_id == current_user.id)
-        .all()
-    }
-    results = search(q, allowed_lesson_ids=lesson_ids)
-    return {"results": results}
+    if course_id is not None and not LessonIndexRepository.owned_course_ids(
+        db, current_user.id, course_id
+    ):
+        raise HTTPException(status_code=404, detail="Курс не найден")
+    try:
+        matches = lesson_index.search(
+            q, owner_id=current_user.id, course_id=course_id, limit=limit
+        )
+    except RuntimeError as exc:
+        raise HTTPException(
+            status_code=503, detail="Семантический поиск временно недоступен"
+        ) from exc
+    texts = lesson_index.texts(db, matches)
+    return LessonSearchResponse(
+        results=[
+            LessonSearchResult(
+                type=match.metadata["type"],
+                lesson_id=match.metadata.get("lesson_id"),
+                module_id=match.metadata["module_id"],
+                course_id=match.metadata["course_id"],
+                text=texts[match.embedding_id],
+                score=match.score,
+            )
+            for match in matches
+            # Deleted after the last sync of the lesson index.
+            if match.embedding_id in texts
+        ]
+    )
 
 
 @router.get(
@@ -44,9 +75,17 @@ def retrieve_course_documents(
     course_id: int,
     q: str = Query(..., min_length=1, max_length=2000),
     limit: int = Query(default=5, ge=1, le=20),
+    ef_search: int | None = Query(
+        default=None,
+        ge=1,
+        le=4096,
+        description="Ширина HNSW-поиска для больших курсов: больше — точнее, но медленнее",
+    ),
     db: Session = Depends(get_db),
     current_user: User = Depends(get_current_user),
     vector_store: VectorStore = Depends(get_vector_store),
+    lexical_index: LexicalIndex = Depends(get_lexical_index),
+    acl_cache: CourseAclCache = Depends(get_acl_cache),
 ):
     return RetrievalService.search_course(
         db,
@@ -55,4 +94,34 @@ def retrieve_course_documents(
         query=q,
         limit=limit,
         vector_store=vector_store,
+        ef_search=ef_search,
+        lexical_index=lexical_index,
+        acl_cache=acl_cache,
+    )
+
+
+@router.post(
+    "/courses/{course_id}/retrieval/batch",
+    response_model=RetrievalBatchResponse,
+    summary="Пакетный поиск нескольких запросов по документам курса",
+)
+def retrieve_course_documents_batch(
+    course_id: int,
+    payload: RetrievalBatchRequest,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user),
+    vector_store: VectorStore = Depends(get_vector_store),
+    lexical_index: LexicalIndex = Depends(get_lexical_index),
+    acl_cache: CourseAclCache = Depends(get_acl_cache),
+):
+    return RetrievalService.search_course_batch(
+        db,
+        course_id=course_id,
+        owner_id=current_user.id,
+        queries=payload.queries,
+        limit=payload.limit,
+        vector_store=vector_store,
+        ef_search=payload.ef_search,
+        lexical_index=lexical_index,
+        acl_cache=acl_cache,
     )
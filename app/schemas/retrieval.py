@@ -1,3 +1,5 @@
+from typing import Annotated
+
 from pydantic import BaseModel, Field
 
 
@@ -11,9 +13,37 @@ class RetrievalCitation(BaseModel):
     section: str | None
     text: str
     score: float = Field(ge=0.0, le=1.0)
+    vector_score: float | None = None
+    lexical_score: float | None = None
 
 
 class RetrievalResponse(BaseModel):
     query: str
     course_id: int
     citations: list[RetrievalCitation]
+
+
+class RetrievalBatchRequest(BaseModel):
+    queries: list[Annotated[str, Field(min_length=1, max_length=2000)]] = Field(
+        min_length=1, max_length=32
+    )
+    limit: int = Field(default=5, ge=1, le=20)
+    ef_search: int | None = Field(default=None, ge=1, le=4096)
+
+
+class RetrievalBatchResponse(BaseModel):
+    course_id: int
+    results: list[RetrievalResponse]
+
+
+class LessonSearchResult(BaseModel):
+    type: str
+    lesson_id: int | None
+    module_id: int
+    course_id: int
+    text: str
+    score: float
+
+
+class LessonSearchResponse(BaseModel):
+    results: list[LessonSearchResult]
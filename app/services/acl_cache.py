@@ -0,0 +1,125 @@
+from __future__ import annotations
+
+from dataclasses import dataclass, field
+from itertools import chain
+from threading import Lock
+
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session
+
+from app.core.config import settings
+from app.models.document import Document
+from app.repositories.retrieval import RetrievalRepository
+from app.services.search_cache import LruCache
+from app.services.vector_store import PartitionKey
+
+_PENDING = "course_acl_invalidations"
+
+
+@dataclass(frozen=True)
+class CourseAcl:
+    chunk_ids: frozenset[int]
+    # document_id -> indexed version whose chunks are in ``chunk_ids``
+    document_versions: dict[int, int]
+    # near-duplicate chunk id -> its canonical chunk, both in ``chunk_ids``
+    canonical_chunk_ids: dict[int, int] = field(default_factory=dict)
+    # document_id -> its chunk ids in ``chunk_ids``; a reindex that keeps the
+    # version still changes the set
+    document_chunk_ids: dict[int, frozenset[int]] = field(default_factory=dict)
+
+    @classmethod
+    def from_rows(cls, rows) -> CourseAcl:
+        """Build from ``RetrievalRepository.accessible_chunk_ids`` rows."""
+        chunk_ids = frozenset(row.id for row in rows)
+        document_chunks: dict[int, set[int]] = {}
+        for row in rows:
+            document_chunks.setdefault(row.document_id, set()).add(row.id)
+        return cls(
+            chunk_ids=chunk_ids,
+            document_versions={row.document_id: row.document_version for row in rows},
+            canonical_chunk_ids={
+                row.id: row.canonical_chunk_id
+                for row in rows
+                if row.canonical_chunk_id in chunk_ids
+            },
+            document_chunk_ids={
+                document_id: frozenset(ids) for document_id, ids in document_chunks.items()
+            },
+        )
+
+
+class CourseAclCache:
+    """Allowed chunk ids per (owner_id, course_id).
+
+    A committed transaction that touches a document of the course drops its
+    entry; the TTL bounds how long writes committed by other workers stay
+    invisible. Citation rows are fetched with the ACL applied again, so a
+    stale entry can hide new chunks but never expose revoked ones.
+    """
+
+    def __init__(self, max_entries: int = 1024, ttl_seconds: float | None = 30):
+        self._entries = LruCache(max_entries, ttl_seconds)
+        # Bumped on invalidation so that a load racing with a commit is not
+        # cached with the pre-commit rows.
+        self._generations: dict[PartitionKey, int] = {}
+        self._lock = Lock()
+
+    def get(self, db: Session, course_id: int, owner_id: int) -> CourseAcl:
+        key = (owner_id, course_id)
+        acl = self._entries.get(key)
+        if acl is not None:
+            return acl
+        with self._lock:
+            generation = self._generations.get(key, 0)
+        rows = RetrievalRepository.accessible_chunk_ids(db, course_id, owner_id)
+        acl = CourseAcl.from_rows(rows)
+        with self._lock:
+            if self._generations.get(key, 0) == generation:
+                self._entries.put(key, acl)
+        return acl
+
+    def invalidate(self, owner_id: int, course_id: int) -> None:
+        key = (owner_id, course_id)
+        with self._lock:
+            self._generations[key] = self._generations.get(key, 0) + 1
+            self._entries.discard(key)
+
+    def stats(self) -> dict[str, float | int]:
+        return self._entries.stats()
+
+    def listen(self, session_class: type[Session] = Session) -> None:
+        """Invalidate entries when sessions of ``session_class`` commit."""
+        event.listen(session_class, "after_flush", self._collect)
+        event.listen(session_class, "after_commit", self._apply)
+        event.listen(session_class, "after_rollback", self._discard)
+
+    @staticmethod
+    def _collect(session: Session, flush_context) -> None:
+        pending = session.info.setdefault(_PENDING, set())
+        for instance in chain(session.new, session.dirty, session.deleted):
+            if not isinstance(instance, Document):
+                continue
+            state = inspect(instance)
+            owners = {instance.owner_id, *state.attrs.owner_id.history.deleted}
+            courses = {instance.course_id, *state.attrs.course_id.history.deleted}
+            pending.update(
+                (owner_id, course_id) for owner_id in owners for course_id in courses
+            )
+
+    def _apply(self, session: Session) -> None:
+        for owner_id, course_id in session.info.pop(_PENDING, ()):
+            self.invalidate(owner_id, course_id)
+
+    @staticmethod
+    def _discard(session: Session) -> None:
+        session.info.pop(_PENDING, None)
+
+
+course_acl_cache = CourseAclCache(
+    settings.ACL_CACHE_SIZE, settings.ACL_CACHE_TTL_SECONDS
+)
+course_acl_cache.listen()
+
+
+def get_acl_cache() -> CourseAclCache:
+    return course_acl_cache
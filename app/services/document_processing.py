@@ -1,5 +1,17 @@
+import hashlib
+import math
+import multiprocessing
+import os
+import re
+from collections import deque
+from collections.abc import Callable, Iterable, Iterator
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 from dataclasses import dataclass
 from io import BytesIO
+from itertools import islice
+from pathlib import Path
+from threading import Lock
 
 import fitz
 from docx import Document as DocxDocument
@@ -24,109 +36,354 @@ def _iter_docx_blocks(document):
             yield Table(child, document)
 
 
-def extract_blocks(content: bytes, mime_type: str) -> list[ExtractedBlock]:
-    if mime_type == "application/pdf":
-        blocks = []
-        with fitz.open(stream=content, filetype="pdf") as document:
+# Raw bytes or the path of a stored file, which is read as extraction goes.
+DocumentSource = bytes | Path
+
+DOCX_MIME_TYPE = (
+    "application/vnd.openxmlformats-officedocument.wordprocessingml.document"
+)
+
+
+def _page_blocks(page, page_number: int) -> Iterator[ExtractedBlock]:
+    for raw in page.get_text("blocks"):
+        text = " ".join(str(raw[4]).split())
+        if text:
+            yield ExtractedBlock(text=text, page=page_number)
+
+
+def _pdf_page_range(path: str, start: int, stop: int) -> list[ExtractedBlock]:
+    """Blocks of pages ``start``..``stop - 1``; runs in a pool worker."""
+    with fitz.open(path, filetype="pdf") as document:
+        return [
+            block
+            for page_number in range(start, stop)
+            for block in _page_blocks(document[page_number], page_number + 1)
+        ]
+
+
+# Pool workers are spawned: forking a threaded server process is unsafe.
+_pdf_pools: dict[int, ProcessPoolExecutor] = {}
+_pdf_pools_lock = Lock()
+
+
+def _pdf_pool(workers: int) -> ProcessPoolExecutor:
+    with _pdf_pools_lock:
+        pool = _pdf_pools.get(workers)
+        if pool is None:
+            pool = _pdf_pools[workers] = ProcessPoolExecutor(
+                workers, mp_context=multiprocessing.get_context("spawn")
+            )
+        return pool
+
+
+def _discard_pdf_pool(workers: int, pool: ProcessPoolExecutor) -> None:
+    with _pdf_pools_lock:
+        if _pdf_pools.get(workers) is pool:
+            del _pdf_pools[workers]
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+def default_extract_workers() -> int:
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+def _parallel_pdf_blocks(
+    path: Path, page_count: int, workers: int
+) -> Iterator[ExtractedBlock]:
+    # Several ranges per worker even out pages of uneven cost; at most two
+    # ranges per worker are in flight so that memory stays bounded.
+    step = math.ceil(page_count / (workers * 4))
+    ranges = [
+        (start, min(start + step, page_count)) for start in range(0, page_count, step)
+    ]
+    pool = _pdf_pool(workers)
+    pending: deque[Future] = deque()
+    try:
+        for start, stop in ranges:
+            pending.append(pool.submit(_pdf_page_range, str(path), start, stop))
+            if len(pending) >= workers * 2:
+                yield from pending.popleft().result()
+        while pending:
+            yield from pending.popleft().result()
+    except BrokenProcessPool:
+        _discard_pdf_pool(workers, pool)
+        raise
+    finally:
+        for future in pending:
+            future.cancel()
+
+
+def _pdf_blocks(
+    source: DocumentSource, parallel_min_pages: int | None, workers: int | None
+) -> Iterator[ExtractedBlock]:
+    # Pages are loaded from the file one at a time.
+    document = (
+        fitz.open(stream=source, filetype="pdf")
+        if isinstance(source, bytes)
+        else fitz.open(source, filetype="pdf")
+    )
+    workers = workers or default_extract_workers()
+    with document:
+        page_count = document.page_count
+        parallel = (
+            not isinstance(source, bytes)
+            and parallel_min_pages is not None
+            and workers > 1
+            and page_count >= parallel_min_pages
+        )
+        if not parallel:
             for page_number, page in enumerate(document, start=1):
-                for raw in page.get_text("blocks"):
-                    text = " ".join(str(raw[4]).split())
-                    if text:
-                        blocks.append(ExtractedBlock(text=text, page=page_number))
-        return blocks
-
-    if mime_type == (
-        "application/vnd.openxmlformats-officedocument.wordprocessingml.document"
-    ):
-        blocks = []
-        section = None
-        document = DocxDocument(BytesIO(content))
-        for block in _iter_docx_blocks(document):
-            if isinstance(block, Paragraph):
-                text = " ".join(block.text.split())
-                if not text:
-                    continue
-                if block.style and block.style.name.lower().startswith("heading"):
-                    section = text
-                blocks.append(ExtractedBlock(text=text, section=section))
-                continue
+                yield from _page_blocks(page, page_number)
+    if parallel:
+        # Every worker opens the file itself; blocks are merged in page order.
+        yield from _parallel_pdf_blocks(source, page_count, workers)
 
-            for row in block.rows:
-                cells = [" ".join(cell.text.split()) for cell in row.cells]
-                text = " | ".join(cell for cell in cells if cell)
-                if text:
-                    blocks.append(ExtractedBlock(text=text, section=section))
-        return blocks
-
-    if mime_type == "text/plain":
-        blocks = []
-        section = None
-        for raw_line in content.decode("utf-8-sig").splitlines():
-            text = " ".join(raw_line.split())
+
+def _docx_blocks(source: DocumentSource) -> Iterator[ExtractedBlock]:
+    section = None
+    document = DocxDocument(BytesIO(source) if isinstance(source, bytes) else source)
+    for block in _iter_docx_blocks(document):
+        if isinstance(block, Paragraph):
+            text = " ".join(block.text.split())
             if not text:
                 continue
-            if text.startswith("#"):
-                section = text.lstrip("#").strip() or section
-            blocks.append(ExtractedBlock(text=text, section=section))
-        return blocks
+            if block.style and block.style.name.lower().startswith("heading"):
+                section = text
+            yield ExtractedBlock(text=text, section=section)
+            continue
+
+        for row in block.rows:
+            cells = [" ".join(cell.text.split()) for cell in row.cells]
+            text = " | ".join(cell for cell in cells if cell)
+            if text:
+                yield ExtractedBlock(text=text, section=section)
+
+
+def _text_lines(source: DocumentSource) -> Iterator[str]:
+    if isinstance(source, bytes):
+        yield from source.decode("utf-8-sig").splitlines()
+        return
+    with open(source, encoding="utf-8-sig", newline="") as file:
+        for line in file:
+            # Same line breaks as str.splitlines() on the whole text.
+            yield from line.splitlines()
+
 
-    raise ValueError("Unsupported document type")
+def _text_blocks(source: DocumentSource) -> Iterator[ExtractedBlock]:
+    section = None
+    for raw_line in _text_lines(source):
+        text = " ".join(raw_line.split())
+        if not text:
+            continue
+        if text.startswith("#"):
+            section = text.lstrip("#").strip() or section
+        yield ExtractedBlock(text=text, section=section)
+
+
+_EXTRACTORS = {
+    DOCX_MIME_TYPE: _docx_blocks,
+    "text/plain": _text_blocks,
+}
+
+
+def extract_blocks(
+    source: DocumentSource,
+    mime_type: str,
+    *,
+    parallel_min_pages: int | None = None,
+    workers: int | None = None,
+) -> Iterator[ExtractedBlock]:
+    """Lazily extract text blocks in document order.
+
+    Memory stays bounded by one page (PDF) or line (text) of a file path
+    source; DOCX bodies are parsed whole by python-docx. PDF files with at
+    least ``parallel_min_pages`` pages are split into page ranges across
+    ``workers`` processes (all usable CPUs by default).
+    """
+    if mime_type == "application/pdf":
+        return _pdf_blocks(source, parallel_min_pages, workers)
+    extractor = _EXTRACTORS.get(mime_type)
+    if extractor is None:
+        raise ValueError("Unsupported document type")
+    return extractor(source)
+
+
+# Bumped whenever extraction or chunking cuts the same file differently, so
+# that chunks stored under the previous rules are not reused.
+CHUNKER_VERSION = 1
+
+# Measures a piece of text: ``len`` for characters or a tokenizer's count.
+LengthFunction = Callable[[str], int]
+
+# Sentences end with terminal punctuation followed by whitespace.
+_SENTENCE_BREAK = re.compile(r"(?<=[.!?…;:])\s+")
 
 
 def chunk_blocks(
-    blocks: list[ExtractedBlock], *, max_chars: int, overlap_chars: int
-) -> list[dict]:
-    if overlap_chars >= max_chars:
+    blocks: Iterable[ExtractedBlock],
+    *,
+    max_size: int,
+    overlap: int,
+    length: LengthFunction = len,
+) -> Iterator[dict]:
+    """Lazily group blocks into chunks of at most ``max_size``.
+
+    Sizes are measured with ``length``, in characters by default. Chunks are
+    cut between blocks or sentences, and between words only inside a sentence
+    longer than a chunk. Consecutive chunks of the same page and section
+    repeat up to ``overlap`` of trailing sentences; a change of page or
+    section always starts a new chunk.
+    """
+    if overlap >= max_size:
         raise ValueError("Chunk overlap must be smaller than chunk size")
+    return _chunks(blocks, max_size, overlap, length)
 
-    chunks: list[dict] = []
-    current_text = ""
-    current_page = None
-    current_section = None
-
-    def emit(text: str, page: int | None, section: str | None) -> None:
-        clean = text.strip()
-        if clean:
-            chunks.append(
-                {
-                    "text": clean,
-                    "page": page,
-                    "section": section,
-                    "metadata_json": {"page": page, "section": section},
-                    "chunk_index": len(chunks),
-                }
-            )
+
+def _units(
+    text: str, max_size: int, length: LengthFunction
+) -> Iterator[tuple[str, int]]:
+    """Sentences of an oversized block; words of an oversized sentence."""
+    for sentence in _SENTENCE_BREAK.split(text):
+        size = length(sentence)
+        if size <= max_size:
+            yield sentence, size
+            continue
+        for word in sentence.split():
+            size = length(word)
+            if size <= max_size:
+                yield word, size
+                continue
+            # A single oversized word is cut into proportional slices.
+            step = max(1, len(word) * max_size // size)
+            for start in range(0, len(word), step):
+                piece = word[start : start + step]
+                yield piece, length(piece)
+
+
+def _chunks(
+    blocks: Iterable[ExtractedBlock],
+    max_size: int,
+    overlap: int,
+    length: LengthFunction,
+) -> Iterator[dict]:
+    # Appends pieces to a buffer with a running size, so the work is linear:
+    # every piece is measured once, a chunk is joined once when it is
+    # emitted, and only the overlap is carried into the next buffer. Pieces
+    # are whole blocks unless a block is longer than a chunk.
+    separator_sizes = {"\n": length("\n"), " ": length(" ")}
+    newline_size = separator_sizes["\n"]
+    # Buffered pieces; every text starts with its one-character separator,
+    # which is dropped for the first piece of a chunk.
+    texts: list[str] = []
+    sizes: list[int] = []
+    size = 0
+    # Leading pieces repeated from the previous chunk.
+    carried = 0
+    chunk_index = 0
+    page: int | None = None
+    section: str | None = None
+
+    def chunk() -> dict:
+        nonlocal chunk_index
+        chunk_index += 1
+        return {
+            "text": "".join(texts)[1:],
+            "page": page,
+            "section": section,
+            "metadata_json": {"page": page, "section": section},
+            "chunk_index": chunk_index - 1,
+        }
+
+    def keep(count: int) -> None:
+        nonlocal carried
+        del texts[: len(texts) - count], sizes[: len(sizes) - count]
+        carried = count
+
+    def carry_overlap() -> int:
+        """Keep the trailing pieces that fit the overlap; returns their size."""
+        kept = 0
+        count = 0
+        for index in range(len(texts) - 1, -1, -1):
+            added = sizes[index]
+            if count:
+                added += separator_sizes[texts[index + 1][0]]
+            if kept + added > overlap:
+                break
+            kept += added
+            count += 1
+        if not count and overlap:
+            # The last piece is longer than the overlap: repeat its tail words.
+            words: list[str] = []
+            for word in reversed(texts[-1][1:].split()):
+                added = length(word) + (separator_sizes[" "] if words else 0)
+                if kept + added > overlap:
+                    break
+                words.append(word)
+                kept += added
+            if words:
+                texts[-1] = texts[-1][0] + " ".join(reversed(words))
+                sizes[-1] = kept
+                count = 1
+        keep(count)
+        return kept
 
     for block in blocks:
         text = block.text.strip()
         if not text:
             continue
-        metadata_changed = (
-            current_text
-            and (block.page != current_page or block.section != current_section)
-        )
-        if metadata_changed:
-            emit(current_text, current_page, current_section)
-            current_text = ""
-
-        if not current_text:
-            current_page, current_section = block.page, block.section
-        candidate = f"{current_text}\n{text}".strip()
-        if len(candidate) <= max_chars:
-            current_text = candidate
+        if texts and (block.page != page or block.section != section):
+            if len(texts) > carried:
+                yield chunk()
+            keep(0)
+            size = 0
+        if not texts:
+            page, section = block.page, block.section
+        block_size = length(text)
+        if texts and size + newline_size + block_size <= max_size:
+            # The common case: the block fits into the current chunk.
+            texts.append("\n" + text)
+            sizes.append(block_size)
+            size += newline_size + block_size
             continue
+        units = (
+            ((text, block_size),)
+            if block_size <= max_size
+            else _units(text, max_size, length)
+        )
+        separator = "\n"
+        for unit, unit_size in units:
+            separator_size = separator_sizes[separator]
+            if texts and size + separator_size + unit_size > max_size:
+                if len(texts) > carried:
+                    yield chunk()
+                size = carry_overlap()
+                # The overlap never pushes a chunk over its limit.
+                while texts and size + separator_size + unit_size > max_size:
+                    size -= sizes[0]
+                    if len(texts) > 1:
+                        size -= separator_sizes[texts[1][0]]
+                    del texts[0], sizes[0]
+                    carried = max(0, carried - 1)
+            if texts:
+                size += separator_size
+            texts.append(separator + unit)
+            sizes.append(unit_size)
+            size += unit_size
+            separator = " "
+    if len(texts) > carried:
+        yield chunk()
+
 
-        if current_text:
-            emit(current_text, current_page, current_section)
-            prefix = current_text[-overlap_chars:] if overlap_chars else ""
-            current_text = f"{prefix}\n{text}".strip()
-        else:
-            current_text = text
+def batched(items: Iterable, size: int) -> Iterator[list]:
+    """Consecutive lists of ``size`` items; the last one may be shorter."""
+    iterator = iter(items)
+    while batch := list(islice(iterator, size)):
+        yield batch
 
-        while len(current_text) > max_chars:
-            emit(current_text[:max_chars], current_page, current_section)
-            start = max_chars - overlap_chars
-            current_text = current_text[start:].strip()
 
-    emit(current_text, current_page, current_section)
-    return chunks
+def chunk_fingerprint(text: str) -> str:
+    """Stable content key of a chunk: its embedding depends on the text only."""
+    return hashlib.sha256(text.encode()).hexdigest()
@@ -0,0 +1,189 @@
+from __future__ import annotations
+
+import logging
+from collections.abc import Callable
+from pathlib import Path
+from typing import Any
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+ONNX_MODEL_FILENAME = "model.onnx"
+ONNX_INT8_MODEL_FILENAME = "model.int8.onnx"
+TOKENIZER_FILENAME = "tokenizer.json"
+
+
+def load_torch_model(model_name: str, *, intra_op_threads: int = 0) -> Any:
+    import torch
+    from sentence_transformers import SentenceTransformer
+
+    if intra_op_threads:
+        torch.set_num_threads(intra_op_threads)
+    return SentenceTransformer(model_name)
+
+
+def token_counter(model: Any) -> Callable[[str], int]:
+    """Number of model tokens in a text, without special tokens or truncation."""
+    if isinstance(model, OnnxEmbeddingModel):
+        return model.count_tokens
+    tokenizer = model.tokenizer
+    return lambda text: len(tokenizer.encode(text, add_special_tokens=False))
+
+
+class OnnxEmbeddingModel:
+    """Sentence embeddings from an exported transformer on onnxruntime.
+
+    Reproduces the sentence-transformers pipeline of MiniLM-style models:
+    mean pooling over the attention mask, then L2 normalization. Exposes the
+    same ``encode(texts)`` as ``SentenceTransformer``, so it plugs into
+    ``FaissVectorStore`` and ``MicroBatchEncoder`` as a ``model_provider``.
+    """
+
+    def __init__(
+        self,
+        session: Any,
+        tokenizer: Any,
+        *,
+        batch_size: int = 64,
+        normalize: bool = True,
+    ):
+        self._session = session
+        self._tokenizer = tokenizer
+        self._counting_tokenizer: Any = None
+        self._input_names = {item.name for item in session.get_inputs()}
+        self.batch_size = batch_size
+        self.normalize = normalize
+
+    @classmethod
+    def from_directory(
+        cls,
+        directory: str | Path,
+        *,
+        quantized: bool = False,
+        intra_op_threads: int = 0,
+        max_length: int = 256,
+        batch_size: int = 64,
+    ) -> OnnxEmbeddingModel:
+        import onnxruntime
+        from tokenizers import Tokenizer
+
+        directory = Path(directory)
+        model_path = directory / (
+            ONNX_INT8_MODEL_FILENAME if quantized else ONNX_MODEL_FILENAME
+        )
+        options = onnxruntime.SessionOptions()
+        # 0 lets onnxruntime use one thread per physical core.
+        options.intra_op_num_threads = intra_op_threads
+        options.graph_optimization_level = (
+            onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        )
+        session = onnxruntime.InferenceSession(
+            str(model_path), options, providers=["CPUExecutionProvider"]
+        )
+        tokenizer = Tokenizer.from_file(str(directory / TOKENIZER_FILENAME))
+        tokenizer.enable_truncation(max_length)
+        tokenizer.enable_padding()
+        return cls(session, tokenizer, batch_size=batch_size)
+
+    def encode(self, texts: list[str]) -> np.ndarray:
+        texts = list(texts)
+        if not texts:
+            return np.empty((0, 0), dtype=np.float32)
+        # Similar lengths share a batch, so little compute is spent on padding.
+        order = sorted(range(len(texts)), key=lambda position: len(texts[position]))
+        vectors: list[np.ndarray | None] = [None] * len(texts)
+        for start in range(0, len(order), self.batch_size):
+            positions = order[start : start + self.batch_size]
+            batch = self._encode_batch([texts[position] for position in positions])
+            for position, vector in zip(positions, batch, strict=True):
+                vectors[position] = vector
+        return np.vstack(vectors)
+
+    def count_tokens(self, text: str) -> int:
+        if self._counting_tokenizer is None:
+            # The encoding tokenizer truncates and pads; counting needs neither.
+            tokenizer = type(self._tokenizer).from_str(self._tokenizer.to_str())
+            tokenizer.no_truncation()
+            tokenizer.no_padding()
+            self._counting_tokenizer = tokenizer
+        return len(self._counting_tokenizer.encode(text, add_special_tokens=False).ids)
+
+    def _encode_batch(self, texts: list[str]) -> np.ndarray:
+        encodings = self._tokenizer.encode_batch(texts)
+        feeds = {
+            "input_ids": np.asarray([item.ids for item in encodings], dtype=np.int64),
+            "attention_mask": np.asarray(
+                [item.attention_mask for item in encodings], dtype=np.int64
+            ),
+            "token_type_ids": np.asarray(
+                [item.type_ids for item in encodings], dtype=np.int64
+            ),
+        }
+        mask = feeds["attention_mask"]
+        output = self._session.run(
+            None,
+            {
+                name: value
+                for name, value in feeds.items()
+                if name in self._input_names
+            },
+        )[0]
+        if output.ndim == 3:
+            weights = mask[:, :, None].astype(np.float32)
+            output = (output * weights).sum(axis=1) / np.maximum(
+                weights.sum(axis=1), 1e-9
+            )
+        output = output.astype(np.float32, copy=False)
+        if self.normalize:
+            output /= np.maximum(np.linalg.norm(output, axis=1, keepdims=True), 1e-12)
+        return output
+
+
+def export_onnx(
+    model_name: str, output_dir: str | Path, *, quantize: bool = True, opset: int = 17
+) -> Path:
+    """Export a sentence-transformers model for ``OnnxEmbeddingModel``.
+
+    Writes the float32 graph, its int8 dynamically quantized copy and the
+    tokenizer into ``output_dir``. Needs torch and sentence-transformers, so
+    it runs once on a build machine rather than on every worker.
+    """
+    import torch
+    from sentence_transformers import SentenceTransformer
+
+    output_dir = Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    model = SentenceTransformer(model_name, device="cpu")
+    transformer = model[0].auto_model.eval()
+    tokenizer = model.tokenizer
+    sample = tokenizer(["warm-up"], return_tensors="pt")
+    input_names = [
+        name
+        for name in ("input_ids", "attention_mask", "token_type_ids")
+        if name in sample
+    ]
+    dynamic_axes = {name: {0: "batch", 1: "sequence"} for name in input_names}
+    dynamic_axes["last_hidden_state"] = {0: "batch", 1: "sequence"}
+    model_path = output_dir / ONNX_MODEL_FILENAME
+    with torch.no_grad():
+        torch.onnx.export(
+            transformer,
+            tuple(sample[name] for name in input_names),
+            str(model_path),
+            input_names=input_names,
+            output_names=["last_hidden_state"],
+            dynamic_axes=dynamic_axes,
+            opset_version=opset,
+        )
+    tokenizer.backend_tokenizer.save(str(output_dir / TOKENIZER_FILENAME))
+    if quantize:
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+
+        quantize_dynamic(
+            str(model_path),
+            str(output_dir / ONNX_INT8_MODEL_FILENAME),
+            weight_type=QuantType.QInt8,
+        )
+    logger.info("Exported %s to %s", model_name, output_dir)
+    return output_dir
@@ -0,0 +1,126 @@
+from __future__ import annotations
+
+import queue
+import time
+from collections.abc import Callable
+from concurrent.futures import Future
+from dataclasses import dataclass, field
+from threading import Lock, Thread
+from typing import Any
+
+import numpy as np
+
+
+@dataclass
+class _EncodeRequest:
+    texts: list[str]
+    future: Future = field(default_factory=Future)
+
+
+class MicroBatchEncoder:
+    """Coalesces concurrent ``encode`` calls into batched forward passes.
+
+    Query embeddings arrive one text at a time from request threads. Instead of
+    running many batch-of-one passes in parallel, callers enqueue their texts
+    and block while a single worker thread collects everything that arrives
+    within ``max_wait_ms`` (or until ``max_batch_size`` texts are collected)
+    and encodes it with one ``model.encode`` call.
+    """
+
+    def __init__(
+        self,
+        model_provider: Callable[[], Any],
+        *,
+        max_batch_size: int = 32,
+        max_wait_ms: float = 5.0,
+    ):
+        self._model_provider = model_provider
+        self.max_batch_size = max_batch_size
+        self.max_wait_ms = max_wait_ms
+        self._queue: queue.Queue[_EncodeRequest] = queue.Queue()
+        self._worker: Thread | None = None
+        self._start_lock = Lock()
+        self._stats_lock = Lock()
+        self._batches = 0
+        self._requests = 0
+        self._texts = 0
+        self._largest_batch = 0
+
+    def encode(self, texts: list[str]) -> np.ndarray:
+        request = _EncodeRequest(list(texts))
+        if not request.texts:
+            return np.empty((0, 0), dtype=np.float32)
+        self._ensure_worker()
+        self._queue.put(request)
+        return request.future.result()
+
+    def stats(self) -> dict[str, float | int]:
+        with self._stats_lock:
+            return {
+                "queue_depth": self._queue.qsize(),
+                "batches": self._batches,
+                "requests": self._requests,
+                "texts": self._texts,
+                "average_batch_size": (
+                    self._texts / self._batches if self._batches else 0.0
+                ),
+                "largest_batch_size": self._largest_batch,
+                "max_batch_size": self.max_batch_size,
+                "max_wait_ms": self.max_wait_ms,
+            }
+
+    def _ensure_worker(self) -> None:
+        if self._worker is not None:
+            return
+        with self._start_lock:
+            if self._worker is None:
+                self._worker = Thread(
+                    target=self._run, name="embedding-batcher", daemon=True
+                )
+                self._worker.start()
+
+    def _collect(self) -> list[_EncodeRequest]:
+        batch = [self._queue.get()]
+        size = len(batch[0].texts)
+        deadline = time.monotonic() + self.max_wait_ms / 1000
+        while size < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                request = (
+                    self._queue.get(timeout=remaining)
+                    if remaining > 0
+                    else self._queue.get_nowait()
+                )
+            except queue.Empty:
+                break
+            batch.append(request)
+            size += len(request.texts)
+        return batch
+
+    def _run(self) -> None:
+        while True:
+            self._encode_batch(self._collect())
+
+    def _encode_batch(self, batch: list[_EncodeRequest]) -> None:
+        texts = [text for request in batch for text in request.texts]
+        with self._stats_lock:
+            self._batches += 1
+            self._requests += len(batch)
+            self._texts += len(texts)
+            self._largest_batch = max(self._largest_batch, len(texts))
+        try:
+            model = self._model_provider()
+            if model is None:
+                raise RuntimeError("Embedding model is unavailable")
+            vectors = np.asarray(model.encode(texts), dtype=np.float32)
+            if vectors.ndim != 2 or len(vectors) != len(texts):
+                raise RuntimeError("Embedding model returned an invalid vector batch")
+        except Exception as exc:
+            for request in batch:
+                request.future.set_exception(exc)
+            return
+
+        offset = 0
+        for request in batch:
+            request.future.set_result(vectors[offset : offset + len(request.texts)])
+            offset += len(request.texts)
@@ -0,0 +1,94 @@
+from __future__ import annotations
+
+import hashlib
+import sqlite3
+from pathlib import Path
+from threading import Lock
+from typing import Protocol
+
+import numpy as np
+
+
+def text_digest(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class EmbeddingCache(Protocol):
+    def get_many(self, texts: list[str]) -> list[np.ndarray | None]: ...
+
+    def put_many(self, texts: list[str], vectors: np.ndarray) -> None: ...
+
+
+class SqliteEmbeddingCache:
+    """Content-addressed embedding cache in a local SQLite file.
+
+    Entries are keyed by the embedding model name and the SHA-256 of the chunk
+    text, so identical chunks are encoded once no matter which document,
+    course or reindex attempt they come from. WAL mode lets several workers
+    share one file.
+    """
+
+    batch_size = 500
+
+    def __init__(self, path: str | Path, model_name: str):
+        self.path = Path(path)
+        self.model_name = model_name
+        self.hits = 0
+        self.misses = 0
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = Lock()
+        self._connection = sqlite3.connect(
+            self.path, check_same_thread=False, isolation_level=None
+        )
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            "model TEXT NOT NULL, "
+            "text_hash TEXT NOT NULL, "
+            "dimension INTEGER NOT NULL, "
+            "vector BLOB NOT NULL, "
+            "PRIMARY KEY (model, text_hash)"
+            ") WITHOUT ROWID"
+        )
+
+    def get_many(self, texts: list[str]) -> list[np.ndarray | None]:
+        digests = [text_digest(text) for text in texts]
+        found: dict[str, np.ndarray] = {}
+        unique = list(dict.fromkeys(digests))
+        with self._lock:
+            for start in range(0, len(unique), self.batch_size):
+                batch = unique[start : start + self.batch_size]
+                placeholders = ",".join("?" * len(batch))
+                rows = self._connection.execute(
+                    "SELECT text_hash, dimension, vector FROM embeddings "
+                    f"WHERE model = ? AND text_hash IN ({placeholders})",
+                    [self.model_name, *batch],
+                )
+                for digest, dimension, blob in rows:
+                    vector = np.frombuffer(blob, dtype=np.float32)
+                    if len(vector) == dimension:
+                        found[digest] = vector
+        result = [found.get(digest) for digest in digests]
+        hits = sum(vector is not None for vector in result)
+        self.hits += hits
+        self.misses += len(result) - hits
+        return result
+
+    def put_many(self, texts: list[str], vectors: np.ndarray) -> None:
+        vectors = np.asarray(vectors, dtype=np.float32)
+        rows = [
+            (self.model_name, text_digest(text), len(vector), vector.tobytes())
+            for text, vector in zip(texts, vectors, strict=True)
+        ]
+        with self._lock:
+            self._connection.execute("BEGIN")
+            try:
+                self._connection.executemany(
+                    "INSERT OR REPLACE INTO embeddings "
+                    "(model, text_hash, dimension, vector) VALUES (?, ?, ?, ?)",
+                    rows,
+                )
+            except Exception:
+                self._connection.execute("ROLLBACK")
+                raise
+            self._connection.execute("COMMIT")
@@ -0,0 +1,398 @@
+"""Zero-downtime switch of the document index to another embedding model.
+
+Vectors of every model live in their own store. A migration run re-embeds all
+indexed chunks into the store of the target model while the source store keeps
+serving; every worker writes new and deleted documents to both stores for the
+duration of the run. Once a course has caught up, it is switched to the target
+in the run record, which all workers pick up within the state TTL:
+
+    python -m app.services.embedding_migration --target all-mpnet-base-v2
+    python -m app.services.embedding_migration --status
+
+A run that was interrupted is resumed by starting it again with the same
+target; courses already switched are not loaded again.
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import logging
+import re
+import time
+from collections.abc import Callable, Iterable
+from contextlib import AbstractContextManager
+from dataclasses import dataclass
+from pathlib import Path
+from threading import Lock
+
+from sqlalchemy.orm import Session
+
+from app.models.domain_enums import GenerationRunStatus
+from app.models.embedding_migration_run import EmbeddingMigrationRun
+from app.repositories.embedding_migration import EmbeddingMigrationRepository
+from app.services.vector_rehydration import rehydrate_vector_store
+from app.services.vector_store import (
+    PartitionDocuments,
+    VectorMatch,
+    VectorRecord,
+    VectorSearchFilters,
+    VectorStore,
+)
+
+logger = logging.getLogger(__name__)
+
+MODEL_MARKER_FILENAME = "MODEL"
+
+
+def model_storage_dir(base_dir: Path, model_id: str) -> Path:
+    """Directory holding the vectors of ``model_id`` below ``base_dir``.
+
+    ``base_dir`` itself belongs to the first model that used it, recorded in a
+    marker file, so changing ``EMBEDDING_MODEL`` never mixes dimensions in one
+    index. Every other model gets ``base_dir/models/<model>``.
+    """
+    base_dir.mkdir(parents=True, exist_ok=True)
+    marker = base_dir / MODEL_MARKER_FILENAME
+    try:
+        with marker.open("x") as file:
+            file.write(model_id)
+        owner = model_id
+    except FileExistsError:
+        owner = marker.read_text().strip()
+    if owner == model_id:
+        return base_dir
+    return base_dir / "models" / re.sub(r"[^A-Za-z0-9._-]+", "_", model_id)
+
+
+@dataclass(frozen=True)
+class ModelIndexState:
+    """Which model serves which course, as recorded by migration runs."""
+
+    serving_model: str
+    # Set while a migration run is in progress.
+    target_model: str | None = None
+    switched_course_ids: frozenset[int] = frozenset()
+
+    @property
+    def models(self) -> tuple[str, ...]:
+        """Models whose stores receive every write."""
+        if self.target_model is None:
+            return (self.serving_model,)
+        return self.serving_model, self.target_model
+
+    def model_for(self, course_id: int) -> str:
+        if self.target_model is not None and course_id in self.switched_course_ids:
+            return self.target_model
+        return self.serving_model
+
+
+def read_index_state(db: Session, default_model: str) -> ModelIndexState:
+    run = EmbeddingMigrationRepository.latest_run(
+        db, (GenerationRunStatus.RUNNING, GenerationRunStatus.SUCCEEDED)
+    )
+    if run is None:
+        return ModelIndexState(default_model)
+    if run.status == GenerationRunStatus.SUCCEEDED.value:
+        return ModelIndexState(run.target_model)
+    return ModelIndexState(
+        run.source_model, run.target_model, frozenset(run.switched_course_ids)
+    )
+
+
+class VersionedVectorStore:
+    """``VectorStore`` that routes every course to the store of its model.
+
+    Searches go to the store of the model serving the course. While a
+    migration runs, writes and deletes go to the stores of both models, so
+    the target does not fall behind documents indexed during the run. The
+    state is re-read at most every ``state_ttl_seconds``; ``initial_state``
+    applies until the first successful read.
+    """
+
+    def __init__(
+        self,
+        store_factory: Callable[[str], VectorStore],
+        state_provider: Callable[[], ModelIndexState],
+        initial_state: ModelIndexState,
+        *,
+        state_ttl_seconds: float = 5,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self._store_factory = store_factory
+        self._state_provider = state_provider
+        self.state_ttl_seconds = state_ttl_seconds
+        self._clock = clock
+        self._stores: dict[str, VectorStore] = {}
+        self._state = initial_state
+        self._state_read_at: float | None = None
+        self._lock = Lock()
+
+    def state(self) -> ModelIndexState:
+        with self._lock:
+            if (
+                self._state_read_at is not None
+                and self._clock() - self._state_read_at < self.state_ttl_seconds
+            ):
+                return self._state
+        try:
+            state = self._state_provider()
+        except Exception as exc:
+            # Keeps routing as before rather than dropping the dual writes of
+            # a migration in progress.
+            logger.warning("Состояние миграции эмбеддингов не прочитано: %s", exc)
+            state = self._state
+        with self._lock:
+            self._state = state
+            self._state_read_at = self._clock()
+        return state
+
+    def refresh(self) -> None:
+        with self._lock:
+            self._state_read_at = None
+
+    def store(self, model_id: str) -> VectorStore:
+        with self._lock:
+            store = self._stores.get(model_id)
+            if store is None:
+                store = self._stores[model_id] = self._store_factory(model_id)
+            return store
+
+    def replace_document(
+        self,
+        document_id: int,
+        document_version: int,
+        records: Iterable[VectorRecord],
+        *,
+        vector_source: int | None = None,
+    ) -> list[str]:
+        # ``records`` is read once per written store, see
+        # app.services.embedding_service.replace_document_embeddings.
+        embedding_ids: list[str] = []
+        for model_id in self.state().models:
+            embedding_ids = self.store(model_id).replace_document(
+                document_id, document_version, records, vector_source=vector_source
+            )
+        return embedding_ids
+
+    def replace_documents(
+        self, documents: PartitionDocuments, *, skip_current: bool = False
+    ) -> int:
+        """Bulk load into every written store; returns the largest count."""
+        return max(
+            (
+                self.store(model_id).replace_documents(
+                    documents, skip_current=skip_current
+                )
+                for model_id in self.state().models
+            ),
+            default=0,
+        )
+
+    def delete_document(self, document_id: int) -> None:
+        for model_id in self.state().models:
+            self.store(model_id).delete_document(document_id)
+
+    def search(
+        self,
+        query: str,
+        filters: VectorSearchFilters,
+        limit: int,
+        *,
+        ef_search: int | None = None,
+    ) -> list[VectorMatch]:
+        return self.search_many([query], filters, limit, ef_search=ef_search)[0]
+
+    def search_many(
+        self,
+        queries: list[str],
+        filters: VectorSearchFilters,
+        limit: int,
+        *,
+        ef_search: int | None = None,
+    ) -> list[list[VectorMatch]]:
+        model_id = self.state().model_for(filters.course_id)
+        return self.store(model_id).search_many(
+            queries, filters, limit, ef_search=ef_search
+        )
+
+
+def _elapsed_ms(started: float, clock: Callable[[], float]) -> int:
+    return int((clock() - started) * 1000)
+
+
+def migrate_embeddings(
+    session_factory: Callable[[], AbstractContextManager[Session]],
+    vector_store: VersionedVectorStore,
+    target_model: str,
+    to_documents: Callable[[list], PartitionDocuments],
+    *,
+    page_size: int = 500,
+    clock: Callable[[], float] = time.perf_counter,
+    sleep: Callable[[float], None] = time.sleep,
+) -> int:
+    """Re-embed every indexed course into ``target_model`` and switch to it.
+
+    Returns the id of the ``EmbeddingMigrationRun``. Each course is loaded in
+    streamed pages, then loaded once more after the state TTL has passed since
+    the run started: a worker that had not seen the run yet may have written a
+    document to the source store only. Documents the target store already
+    holds with the same chunks and texts are skipped, so the second pass and
+    resumed runs only encode what changed, including reindexes that kept the
+    document version.
+    """
+    vector_store.refresh()
+    state = vector_store.state()
+    with session_factory() as db:
+        run = EmbeddingMigrationRepository.latest_run(db, (GenerationRunStatus.RUNNING,))
+        if run is not None and run.target_model != target_model:
+            raise ValueError(
+                f"Migration {run.id} to {run.target_model} is still running"
+            )
+        if run is None:
+            if state.serving_model == target_model:
+                raise ValueError(f"{target_model} already serves the document index")
+            run = EmbeddingMigrationRun(
+                source_model=state.serving_model,
+                target_model=target_model,
+                status=GenerationRunStatus.RUNNING.value,
+                switched_course_ids=[],
+                output={},
+            )
+            db.add(run)
+            db.commit()
+        run_id = run.id
+        switched = list(run.switched_course_ids)
+        chunks_processed = run.chunks_processed
+        output = dict(run.output or {})
+    logger.info("Embedding migration %s to %s started", run_id, target_model)
+
+    # From here on workers write to both stores within one TTL.
+    vector_store.refresh()
+    target = vector_store.store(target_model)
+    started = clock()
+    documents_loaded = 0
+    try:
+        while True:
+            with session_factory() as db:
+                pending = [
+                    course_id
+                    for course_id in EmbeddingMigrationRepository.indexed_course_ids(db)
+                    if course_id not in switched
+                ]
+                # Courses indexed for the first time during the run are
+                # picked up by the next round.
+                if not pending:
+                    break
+                run = db.get(EmbeddingMigrationRun, run_id)
+                run.courses_total = len(switched) + len(pending)
+                db.commit()
+            for course_id in pending:
+                report = rehydrate_vector_store(
+                    session_factory,
+                    target,
+                    to_documents,
+                    page_size=page_size,
+                    course_id=course_id,
+                )
+                wait = vector_store.state_ttl_seconds - (clock() - started)
+                if wait > 0:
+                    sleep(wait)
+                catch_up = rehydrate_vector_store(
+                    session_factory,
+                    target,
+                    to_documents,
+                    page_size=page_size,
+                    course_id=course_id,
+                )
+                switched.append(course_id)
+                chunks_processed += report.chunks
+                documents_loaded += report.documents + catch_up.documents
+                elapsed_ms = _elapsed_ms(started, clock)
+                output.update(
+                    documents_loaded=documents_loaded,
+                    chunks_per_second=(
+                        chunks_processed * 1000 / elapsed_ms if elapsed_ms else 0.0
+                    ),
+                )
+                with session_factory() as db:
+                    run = db.get(EmbeddingMigrationRun, run_id)
+                    run.switched_course_ids = list(switched)
+                    run.courses_done = len(switched)
+                    run.chunks_processed = chunks_processed
+                    run.latency_ms = elapsed_ms
+                    run.output = dict(output)
+                    db.commit()
+                logger.info(
+                    "Embedding migration %s: course %s switched to %s, "
+                    "%s chunks, %.1f chunks/s",
+                    run_id,
+                    course_id,
+                    target_model,
+                    chunks_processed,
+                    output["chunks_per_second"],
+                )
+        with session_factory() as db:
+            run = db.get(EmbeddingMigrationRun, run_id)
+            run.status = GenerationRunStatus.SUCCEEDED.value
+            run.latency_ms = _elapsed_ms(started, clock)
+            db.commit()
+    except Exception as exc:
+        with session_factory() as db:
+            run = db.get(EmbeddingMigrationRun, run_id)
+            run.status = GenerationRunStatus.FAILED.value
+            run.error = str(exc)
+            run.latency_ms = _elapsed_ms(started, clock)
+            db.commit()
+        raise
+    vector_store.refresh()
+    logger.info("Embedding migration %s to %s succeeded", run_id, target_model)
+    return run_id
+
+
+def _run_summary(run: EmbeddingMigrationRun | None) -> dict | None:
+    if run is None:
+        return None
+    return {
+        "id": run.id,
+        "source_model": run.source_model,
+        "target_model": run.target_model,
+        "status": run.status,
+        "courses_total": run.courses_total,
+        "courses_done": run.courses_done,
+        "chunks_processed": run.chunks_processed,
+        "latency_ms": run.latency_ms,
+        "output": run.output,
+        "error": run.error,
+    }
+
+
+def main() -> None:
+    from app.core.config import settings
+    from app.database.db import SessionLocal
+    from app.services.embedding_service import chunk_documents, versioned_vector_store
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    action = parser.add_mutually_exclusive_group(required=True)
+    action.add_argument("--target", help="sentence-transformers model to switch to")
+    action.add_argument("--status", action="store_true", help="print the latest run")
+    parser.add_argument("--page-size", type=int, default=500)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(message)s")
+
+    if args.target is not None:
+        if settings.VECTOR_STORE_DIR is None:
+            parser.error("a migration needs VECTOR_STORE_DIR shared with the workers")
+        migrate_embeddings(
+            SessionLocal,
+            versioned_vector_store,
+            args.target,
+            chunk_documents,
+            page_size=args.page_size,
+        )
+    with SessionLocal() as db:
+        print(json.dumps(_run_summary(EmbeddingMigrationRepository.latest_run(db))))
+
+
+if __name__ == "__main__":
+    main()
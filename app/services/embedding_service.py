@@ -1,128 +1,358 @@
 import logging
-from threading import RLock
-
-import faiss
-import numpy as np
+from collections.abc import Callable, Iterable, Iterator
+from functools import partial
+from threading import Event, Thread
 
 from app.core.config import settings
-from app.services.vector_store import FaissVectorStore, VectorRecord, VectorStore
+from app.database.db import SessionLocal
+from app.repositories.retrieval import RetrievalRepository
+from app.services.embedding_backends import (
+    OnnxEmbeddingModel,
+    load_torch_model,
+    token_counter,
+)
+from app.services.embedding_batcher import MicroBatchEncoder
+from app.services.embedding_cache import SqliteEmbeddingCache
+from app.services.embedding_migration import (
+    ModelIndexState,
+    VersionedVectorStore,
+    model_storage_dir,
+    read_index_state,
+)
+from app.services.lesson_index import LessonContentIndex
+from app.services.model_loader import ModelLoader
+from app.services.search_cache import SearchCache
+from app.services.vector_rehydration import rehydrate_vector_store
+from app.services.vector_store import (
+    CodecConfig,
+    FaissVectorStore,
+    HnswConfig,
+    PartitionDocuments,
+    PartitionKey,
+    VectorRecord,
+    VectorStore,
+)
 
 logger = logging.getLogger(__name__)
-model = None
-_index_lock = RLock()
 
-# Глобальный FAISS-индекс и метаданные (можно заменить на persistent storage)
-index = faiss.IndexFlatL2(384)
-metadata = []
+
+def _load_model():
+    if settings.EMBEDDING_BACKEND == "onnx":
+        if settings.EMBEDDING_ONNX_DIR is None:
+            raise RuntimeError("EMBEDDING_ONNX_DIR is required for the onnx backend")
+        return OnnxEmbeddingModel.from_directory(
+            settings.EMBEDDING_ONNX_DIR,
+            quantized=settings.EMBEDDING_ONNX_QUANTIZED,
+            intra_op_threads=settings.EMBEDDING_INTRA_OP_THREADS,
+        )
+    return load_torch_model(
+        settings.EMBEDDING_MODEL, intra_op_threads=settings.EMBEDDING_INTRA_OP_THREADS
+    )
+
+
+# Vectors of different backends are close but not identical, so cached
+# embeddings are keyed by the backend as well.
+embedding_model_id = settings.EMBEDDING_MODEL
+if settings.EMBEDDING_BACKEND == "onnx":
+    embedding_model_id += "@onnx-int8" if settings.EMBEDDING_ONNX_QUANTIZED else "@onnx"
+
+# Загружается один раз: в фоне при старте приложения или первым запросом.
+model_loader = ModelLoader(_load_model)
 
 
 def get_model():
-    global model
-    if model is not None:
-        return model
+    return model_loader.get()
 
-    try:
-        from sentence_transformers import SentenceTransformer
 
-        model = SentenceTransformer(settings.EMBEDDING_MODEL)
-    except Exception as exc:
-        logger.warning("SentenceTransformer недоступен, семантический поиск отключён: %s", exc)
-        model = False
+def document_token_counter() -> Callable[[str], int]:
+    """Counts tokens of the embedding model, for chunks sized in tokens."""
+    model = get_model()
+    if model is None:
+        raise RuntimeError("Embedding model is unavailable")
+    return token_counter(model)
+
+
+query_encoder = MicroBatchEncoder(
+    get_model,
+    max_batch_size=settings.EMBEDDING_BATCH_MAX_SIZE,
+    max_wait_ms=settings.EMBEDDING_BATCH_WINDOW_MS,
+)
+embedding_cache = (
+    SqliteEmbeddingCache(settings.EMBEDDING_CACHE_PATH, embedding_model_id)
+    if settings.EMBEDDING_CACHE_PATH is not None
+    else None
+)
+ann_config = (
+    HnswConfig(
+        min_rows=settings.VECTOR_HNSW_MIN_CHUNKS,
+        m=settings.VECTOR_HNSW_M,
+        ef_construction=settings.VECTOR_HNSW_EF_CONSTRUCTION,
+        ef_search=settings.VECTOR_HNSW_EF_SEARCH,
+    )
+    if settings.VECTOR_HNSW_MIN_CHUNKS
+    else None
+)
+codec_config = CodecConfig(
+    codec=settings.VECTOR_CODEC,
+    train_min_rows=settings.VECTOR_CODEC_MIN_CHUNKS,
+    pq_subquantizers=settings.VECTOR_PQ_SUBQUANTIZERS,
+    rescore=settings.VECTOR_RESCORE,
+    rescore_factor=settings.VECTOR_RESCORE_FACTOR,
+)
+
+
+def _search_cache(model_id: str = embedding_model_id) -> SearchCache:
+    return SearchCache(
+        model_id,
+        vector_entries=settings.QUERY_EMBEDDING_CACHE_SIZE,
+        result_entries=settings.RETRIEVAL_CACHE_SIZE,
+        result_ttl_seconds=settings.RETRIEVAL_CACHE_TTL_SECONDS,
+    )
+
+
+def _document_record(
+    document_id: int, document_version: int, chunk: dict
+) -> VectorRecord:
+    return VectorRecord(
+        embedding_id=(
+            f"document:{document_id}:v{document_version}:chunk:{chunk['chunk_index']}"
+        ),
+        text=chunk["text"],
+        metadata={
+            "kind": "document",
+            "document_id": document_id,
+            "document_version": document_version,
+            "chunk_id": chunk["chunk_id"],
+            "chunk_index": chunk["chunk_index"],
+            "page": chunk.get("page"),
+            "section": chunk.get("section"),
+            "source": chunk.get("source"),
+            "source_type": chunk.get("source_type"),
+            "owner_id": chunk["owner_id"],
+            "organization_id": chunk.get("organization_id"),
+            "course_id": chunk["course_id"],
+        },
+    )
+
+
+def _document_records(
+    document_id: int, document_version: int, chunks: list[dict]
+) -> list[VectorRecord]:
+    return [_document_record(document_id, document_version, chunk) for chunk in chunks]
+
+
+class _LazyDocumentRecords:
+    """Vector records of ``chunks``, built while they are iterated.
+
+    Iterable as often as ``chunks`` is, so chunks read back from the database
+    batch by batch can be written to the stores of both models of a migration
+    without all their texts in memory.
+    """
+
+    def __init__(self, document_id: int, document_version: int, chunks: Iterable[dict]):
+        self.document_id = document_id
+        self.document_version = document_version
+        self.chunks = chunks
+
+    def __iter__(self) -> Iterator[VectorRecord]:
+        for chunk in self.chunks:
+            yield _document_record(self.document_id, self.document_version, chunk)
+
+
+def chunk_documents(rows) -> PartitionDocuments:
+    """Group ``DocumentChunk`` rows by document version into vector records.
+
+    Rows carry the fields selected by ``RetrievalRepository._vector_fields``
+    and come ordered by document and chunk index.
+    """
+    documents: dict[tuple[int, int], list[dict]] = {}
+    for row in rows:
+        documents.setdefault((row.document_id, row.document_version), []).append(
+            {
+                "chunk_id": row.id,
+                "chunk_index": row.chunk_index,
+                "text": row.text,
+                "page": row.page,
+                "section": row.section,
+                "source": row.original_filename,
+                "source_type": row.source_type,
+                "owner_id": row.owner_id,
+                "course_id": row.course_id,
+            }
+        )
+    return [
+        (document_id, version, _document_records(document_id, version, chunks))
+        for (document_id, version), chunks in documents.items()
+    ]
 
-    return model if model is not False else None
 
+def _rehydrate_course(key: PartitionKey) -> PartitionDocuments:
+    """Rebuild an evicted in-memory course partition from ``DocumentChunk``."""
+    owner_id, course_id = key
+    with SessionLocal() as db:
+        rows = RetrievalRepository.partition_chunks(db, owner_id, course_id)
+    return chunk_documents(rows)
 
-document_vector_store = FaissVectorStore(get_model)
+
+# Vectors of the configured model; other models get their own stores below.
+document_vector_store = FaissVectorStore(
+    get_model,
+    (
+        model_storage_dir(settings.VECTOR_STORE_DIR, embedding_model_id)
+        if settings.VECTOR_STORE_DIR
+        else None
+    ),
+    embedding_cache=embedding_cache,
+    query_encoder=query_encoder,
+    search_cache=_search_cache(),
+    ann=ann_config,
+    codec=codec_config,
+    max_bytes=settings.VECTOR_STORE_MAX_BYTES,
+    rehydrate=_rehydrate_course,
+)
+# Lesson content lives in its own store: module ids are its document ids.
+lesson_vector_store = FaissVectorStore(
+    get_model,
+    (
+        model_storage_dir(settings.VECTOR_STORE_DIR / "lessons", embedding_model_id)
+        if settings.VECTOR_STORE_DIR
+        else None
+    ),
+    embedding_cache=embedding_cache,
+    query_encoder=query_encoder,
+    search_cache=_search_cache(),
+    ann=ann_config,
+    codec=codec_config,
+    max_bytes=settings.VECTOR_STORE_MAX_BYTES,
+    # /search covers all courses of a user with one lookup.
+    partition_by_course=False,
+)
+
+
+def _model_store(model_id: str) -> VectorStore:
+    """Document store of a model an embedding migration switches to."""
+    if model_id == embedding_model_id:
+        return document_vector_store
+    loader = ModelLoader(
+        partial(
+            load_torch_model,
+            model_id,
+            intra_op_threads=settings.EMBEDDING_INTRA_OP_THREADS,
+        )
+    )
+    return FaissVectorStore(
+        loader.get,
+        (
+            model_storage_dir(settings.VECTOR_STORE_DIR, model_id)
+            if settings.VECTOR_STORE_DIR
+            else None
+        ),
+        embedding_cache=(
+            SqliteEmbeddingCache(settings.EMBEDDING_CACHE_PATH, model_id)
+            if settings.EMBEDDING_CACHE_PATH is not None
+            else None
+        ),
+        query_encoder=MicroBatchEncoder(
+            loader.get,
+            max_batch_size=settings.EMBEDDING_BATCH_MAX_SIZE,
+            max_wait_ms=settings.EMBEDDING_BATCH_WINDOW_MS,
+        ),
+        search_cache=_search_cache(model_id),
+        ann=ann_config,
+        codec=codec_config,
+        max_bytes=settings.VECTOR_STORE_MAX_BYTES,
+        rehydrate=_rehydrate_course,
+    )
+
+
+def _index_state() -> ModelIndexState:
+    with SessionLocal() as db:
+        return read_index_state(db, embedding_model_id)
+
+
+# Routes each course to the model that serves it, see embedding_migration.
+versioned_vector_store = VersionedVectorStore(
+    _model_store,
+    _index_state,
+    ModelIndexState(embedding_model_id),
+    state_ttl_seconds=settings.EMBEDDING_MIGRATION_STATE_TTL_SECONDS,
+)
+lesson_content_index = LessonContentIndex(
+    lesson_vector_store, sync_ttl_seconds=settings.LESSON_INDEX_SYNC_TTL_SECONDS
+)
+lesson_content_index.listen()
 
 
 def get_vector_store() -> VectorStore:
-    return document_vector_store
+    return versioned_vector_store
+
+
+def get_lesson_index() -> LessonContentIndex:
+    return lesson_content_index
 
-def embed_and_add(lesson_id: int, obj_type: str, text: str):
-    active_model = get_model()
-    if active_model is None or not text.strip():
+
+def _rehydrate_documents() -> None:
+    try:
+        report = rehydrate_vector_store(
+            SessionLocal,
+            versioned_vector_store,
+            chunk_documents,
+            page_size=settings.VECTOR_REHYDRATE_PAGE_SIZE,
+        )
+    except Exception as exc:
+        logger.warning("Векторный индекс документов не восстановлен: %s", exc)
         return
-    embedding = active_model.encode([text])[0]
-    with _index_lock:
-        index.add(np.array([embedding], dtype=np.float32))
-        metadata.append({
-            "kind": "lesson",
-            "lesson_id": lesson_id,
-            "type": obj_type,
-            "text": text
-        })
+    logger.info(
+        "Векторный индекс документов восстановлен: %s chunks за %.1f с",
+        report.chunks,
+        report.seconds,
+    )
+
+
+def start_lesson_index_sync(stop: Event) -> None:
+    """Sync the lesson index in the background until ``stop`` is set."""
+    lesson_content_index.start(SessionLocal, stop)
+
+
+def start_vector_rehydration() -> None:
+    """Refill the in-memory document store from the database in the background."""
+    Thread(target=_rehydrate_documents, name="vector-rehydration", daemon=True).start()
 
 
 def replace_document_embeddings(
     document_id: int,
     document_version: int,
-    chunks: list[dict],
+    chunks: Iterable[dict],
+    *,
+    vector_source: int | None = None,
 ) -> list[str]:
-    """Replace a document and deactivate all older in-memory versions."""
-    records = []
-    for chunk in chunks:
-        embedding_id = (
-            f"document:{document_id}:v{document_version}:chunk:{chunk['chunk_index']}"
-        )
-        records.append(
-            VectorRecord(
-                embedding_id=embedding_id,
-                text=chunk["text"],
-                metadata={
-                    "kind": "document",
-                    "document_id": document_id,
-                    "document_version": document_version,
-                    "chunk_id": chunk["chunk_id"],
-                    "chunk_index": chunk["chunk_index"],
-                    "page": chunk.get("page"),
-                    "section": chunk.get("section"),
-                    "source": chunk.get("source"),
-                    "source_type": chunk.get("source_type"),
-                    "owner_id": chunk["owner_id"],
-                    "organization_id": chunk.get("organization_id"),
-                    "course_id": chunk["course_id"],
-                },
-            )
-        )
-    return document_vector_store.replace_document(
-        document_id, document_version, records
+    """Replace a document and deactivate all older in-memory versions.
+
+    ``chunks`` may be a lazy iterable; it is read once per written store.
+    ``vector_source`` is a document with the same content whose vectors the
+    store may reuse.
+    """
+    return versioned_vector_store.replace_document(
+        document_id,
+        document_version,
+        _LazyDocumentRecords(document_id, document_version, chunks),
+        vector_source=vector_source,
     )
 
 
+def replace_chunk_embeddings(rows) -> dict[int, str]:
+    """Re-embed whole documents from ``_vector_fields`` rows.
+
+    Returns the embedding id of every chunk in ``rows``.
+    """
+    documents = chunk_documents(rows)
+    versioned_vector_store.replace_documents(documents)
+    return {
+        record.metadata["chunk_id"]: record.embedding_id
+        for _, _, records in documents
+        for record in records
+    }
+
+
 def remove_document_embeddings(document_id: int) -> None:
-    document_vector_store.delete_document(document_id)
-
-def search(query: str, k: int = 5, allowed_lesson_ids: set[int] | None = None):
-    active_model = get_model()
-    if active_model is None or not metadata or allowed_lesson_ids == set():
-        return []
-
-    query_vec = active_model.encode([query])[0]
-    with _index_lock:
-        candidate_count = len(metadata) if allowed_lesson_ids is not None else k
-        _, indices = index.search(
-            np.array([query_vec], dtype=np.float32),
-            min(candidate_count, len(metadata)),
-        )
-        results = []
-        for item_index in indices[0]:
-            if item_index < 0 or item_index >= len(metadata):
-                continue
-            item = metadata[item_index]
-            if not isinstance(item, dict):
-                if allowed_lesson_ids is None:
-                    results.append(item)
-                if len(results) == k:
-                    break
-                continue
-            if item.get("kind", "lesson") != "lesson":
-                continue
-            if (
-                allowed_lesson_ids is not None
-                and item.get("lesson_id") not in allowed_lesson_ids
-            ):
-                continue
-            results.append(item)
-            if len(results) == k:
-                break
-    return results
+    versioned_vector_store.delete_document(document_id)
@@ -1,6 +1,8 @@
 import hashlib
 import os
 import tempfile
+from collections.abc import Iterator
+from contextlib import AbstractContextManager, contextmanager
 from dataclasses import dataclass
 from pathlib import Path
 from typing import BinaryIO, Protocol
@@ -25,6 +27,10 @@ class FileStorage(Protocol):
 
     def read_bytes(self, storage_key: str) -> bytes: ...
 
+    def local_path(self, storage_key: str) -> AbstractContextManager[Path]:
+        """Path of the stored file on local disk while the context is open."""
+        ...
+
 
 class LocalFileStorage:
     chunk_size = 1024 * 1024
@@ -69,6 +75,11 @@ class LocalFileStorage:
     def read_bytes(self, storage_key: str) -> bytes:
         return self._target(storage_key).read_bytes()
 
+    @contextmanager
+    def local_path(self, storage_key: str) -> Iterator[Path]:
+        # Files already live on local disk; readers open them directly.
+        yield self._target(storage_key)
+
 
 def get_file_storage() -> FileStorage:
     return LocalFileStorage(settings.UPLOAD_DIR, settings.max_document_bytes)
@@ -0,0 +1,246 @@
+"""Workers of the ``generation_runs`` queue.
+
+API requests only queue document indexing and graph generation runs; clients
+poll ``GET /generation-runs/{run_id}``. A worker claims the oldest queued run
+of its type with ``SELECT ... FOR UPDATE SKIP LOCKED``, marks it running in the
+same transaction and executes it, so any number of workers on any number of
+hosts share one queue. Every run type has its own number of workers, which
+caps how many runs of that type one worker group executes at once.
+
+A claimed run is leased to its worker for ``JOB_LEASE_SECONDS``, and the
+worker renews the lease while the run executes. Runs whose lease expired, left
+by a crashed or hung worker, are queued again; the former worker then finds
+the lease gone and does not commit its results. Start a group of worker
+processes with:
+
+    python -m app.services.job_queue
+
+With ``JOB_WORKERS_IN_PROCESS`` the API process runs the same workers as
+threads instead.
+"""
+
+from __future__ import annotations
+
+import argparse
+import logging
+import multiprocessing
+import signal
+import uuid
+from collections.abc import Callable, Iterator
+from contextlib import AbstractContextManager, contextmanager
+from datetime import datetime, timedelta
+from threading import Event, Thread
+
+from sqlalchemy.orm import Session
+
+from app.core.config import settings
+from app.models.domain_enums import GenerationRunStatus, GenerationRunType
+from app.models.generation_run import GenerationRun
+from app.repositories.pipeline import PipelineRepository
+from app.services.file_storage import FileStorage, get_file_storage
+from app.services.pipeline_service import (
+    PipelineRunFailed,
+    PipelineService,
+    RunLeaseLost,
+)
+
+logger = logging.getLogger(__name__)
+
+SessionFactory = Callable[[], AbstractContextManager[Session]]
+
+
+def worker_run_types() -> list[str]:
+    """Run type of every worker, as many as its configured concurrency."""
+    return [GenerationRunType.DOCUMENT_INDEX.value] * (
+        settings.JOB_DOCUMENT_INDEX_CONCURRENCY
+    ) + [GenerationRunType.GRAPH_GENERATION.value] * (
+        settings.JOB_GRAPH_GENERATION_CONCURRENCY
+    )
+
+
+def _lease_expiry() -> datetime:
+    return datetime.utcnow() + timedelta(seconds=settings.JOB_LEASE_SECONDS)
+
+
+def claim_run(db: Session, run_type: str) -> GenerationRun | None:
+    """Take the oldest queued run of ``run_type`` and lease it to the caller.
+
+    The claim token is the run's ``lease_owner``.
+    """
+    expired = PipelineRepository.requeue_expired_runs(db, run_type, datetime.utcnow())
+    if expired:
+        logger.warning("Возвращено в очередь брошенных запусков %s: %s", run_type, expired)
+    run = PipelineRepository.next_queued_run(db, run_type)
+    if run is not None:
+        run.status = GenerationRunStatus.RUNNING.value
+        run.lease_owner = uuid.uuid4().hex
+        run.lease_expires_at = _lease_expiry()
+    db.commit()
+    return run
+
+
+@contextmanager
+def heartbeat(
+    session_factory: SessionFactory, run_id: int, lease_owner: str
+) -> Iterator[None]:
+    """Renew the lease of a run from a background thread until the block ends."""
+    stop = Event()
+
+    def renew() -> None:
+        while not stop.wait(settings.JOB_LEASE_SECONDS / 3):
+            try:
+                with session_factory() as db:
+                    renewed = PipelineRepository.renew_lease(
+                        db, run_id, lease_owner, _lease_expiry()
+                    )
+                    db.commit()
+            except Exception:
+                # The next beat retries; the lease outlives two missed ones.
+                logger.exception("Не удалось продлить аренду запуска %s", run_id)
+                continue
+            if not renewed:
+                logger.warning("Аренда запуска %s потеряна", run_id)
+                return
+
+    thread = Thread(target=renew, name=f"job-heartbeat-{run_id}", daemon=True)
+    thread.start()
+    try:
+        yield
+    finally:
+        stop.set()
+        thread.join()
+
+
+def process_next_run(
+    db: Session,
+    run_type: str,
+    storage: FileStorage,
+    *,
+    session_factory: SessionFactory | None = None,
+) -> GenerationRun | None:
+    """Claim and execute one run; None when the queue of the type is empty.
+
+    With ``session_factory`` the lease is renewed from separate sessions while
+    the run executes.
+    """
+    run = claim_run(db, run_type)
+    if run is None:
+        return None
+    run_id = run.id
+    try:
+        if session_factory is None:
+            return PipelineService.execute_run(db, run, storage)
+        with heartbeat(session_factory, run_id, run.lease_owner):
+            return PipelineService.execute_run(db, run, storage)
+    except PipelineRunFailed as exc:
+        # The failure is already recorded on the run for the polling client.
+        logger.warning("Запуск %s завершился ошибкой: %s", exc.run_id, exc.message)
+        return db.get(GenerationRun, exc.run_id)
+    except RunLeaseLost:
+        logger.warning("Запуск %s передан другому воркеру, результат отброшен", run_id)
+        return db.get(GenerationRun, run_id)
+
+
+def work(
+    run_type: str,
+    *,
+    session_factory: SessionFactory,
+    storage: FileStorage,
+    stop: Event,
+    poll_interval: float | None = None,
+) -> None:
+    """Execute runs of ``run_type`` one after another until ``stop`` is set."""
+    poll_interval = poll_interval or settings.JOB_POLL_INTERVAL_SECONDS
+    while not stop.is_set():
+        try:
+            with session_factory() as db:
+                run = process_next_run(
+                    db, run_type, storage, session_factory=session_factory
+                )
+        except Exception:
+            logger.exception("Воркер очереди %s: ошибка при выполнении запуска", run_type)
+            run = None
+        if run is None:
+            stop.wait(poll_interval)
+
+
+def start_job_threads(stop: Event) -> list[Thread]:
+    """Run the queue workers as daemon threads of the calling process."""
+    from app.database.db import SessionLocal
+
+    threads = []
+    for number, run_type in enumerate(worker_run_types()):
+        thread = Thread(
+            target=work,
+            args=(run_type,),
+            kwargs={
+                "session_factory": SessionLocal,
+                "storage": get_file_storage(),
+                "stop": stop,
+            },
+            name=f"job-{run_type}-{number}",
+            daemon=True,
+        )
+        thread.start()
+        threads.append(thread)
+    return threads
+
+
+def _worker_process(run_type: str) -> None:
+    from app.database.db import SessionLocal
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(message)s")
+    stop = Event()
+    signal.signal(signal.SIGTERM, lambda *_: stop.set())
+    signal.signal(signal.SIGINT, lambda *_: stop.set())
+    work(
+        run_type, session_factory=SessionLocal, storage=get_file_storage(), stop=stop
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--run-type",
+        choices=[run_type.value for run_type in GenerationRunType],
+        action="append",
+        help="only start the workers of this run type; repeatable",
+    )
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(message)s")
+
+    run_types = [
+        run_type
+        for run_type in worker_run_types()
+        if args.run_type is None or run_type in args.run_type
+    ]
+    if not run_types:
+        parser.error("no workers configured for the selected run types")
+    # Workers start clean instead of inheriting the parent's engine and model.
+    context = multiprocessing.get_context("spawn")
+    processes = [
+        context.Process(
+            target=_worker_process, args=(run_type,), name=f"job-{run_type}-{number}"
+        )
+        for number, run_type in enumerate(run_types)
+    ]
+    for process in processes:
+        process.start()
+    logger.info("Воркеры очереди запущены: %s", ", ".join(run_types))
+
+    def shutdown(*_) -> None:
+        for process in processes:
+            process.terminate()
+
+    signal.signal(signal.SIGTERM, shutdown)
+    try:
+        for process in processes:
+            process.join()
+    except KeyboardInterrupt:
+        shutdown()
+        for process in processes:
+            process.join()
+
+
+if __name__ == "__main__":
+    main()
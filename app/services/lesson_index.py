@@ -0,0 +1,416 @@
+from __future__ import annotations
+
+import logging
+import time
+from collections.abc import Callable, Iterable, Iterator
+from itertools import chain
+from threading import Event, Lock, Thread
+
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session, sessionmaker
+
+from app.models.course import Course
+from app.models.lesson import Lesson
+from app.models.module import Module
+from app.models.task import Task
+from app.models.test import Test
+from app.models.theory import Theory
+from app.repositories.lesson_index import LessonIndexRepository
+from app.services.vector_store import (
+    PartitionKey,
+    VectorMatch,
+    VectorRecord,
+    VectorSearchFilters,
+    VectorStore,
+)
+
+logger = logging.getLogger(__name__)
+
+_PENDING = "lesson_index_invalidations"
+
+
+def _history(instance, attribute: str) -> set:
+    state = inspect(instance)
+    return {
+        value
+        for value in (
+            getattr(instance, attribute),
+            *state.attrs[attribute].history.deleted,
+        )
+        if value is not None
+    }
+
+
+def _content_rows(lessons, theories, tasks, tests) -> Iterator[tuple]:
+    """(module_id, type, item_id, lesson_id, text) of every content row."""
+    for lesson in lessons:
+        text = "\n".join(part for part in (lesson.title, lesson.description) if part)
+        yield lesson.module_id, "lesson", lesson.id, lesson.id, text
+    for theory in theories:
+        yield theory.module_id, "theory", theory.id, theory.lesson_id, theory.content
+    for task in tasks:
+        yield task.module_id, "task", task.id, None, task.description or task.name
+    for test in tests:
+        yield test.module_id, "test", test.id, None, test.question
+
+
+def _module_records(
+    owner_id: int, course_id: int, module_id: int, rows
+) -> list[VectorRecord]:
+    records = []
+    for kind, item_id, lesson_id, text in rows:
+        if not text or not text.strip():
+            continue
+        records.append(
+            VectorRecord(
+                embedding_id=f"{kind}:{item_id}",
+                text=text,
+                metadata={
+                    "kind": "lesson",
+                    "type": kind,
+                    "item_id": item_id,
+                    "lesson_id": lesson_id,
+                    "module_id": module_id,
+                    "owner_id": owner_id,
+                    "course_id": course_id,
+                    "chunk_id": None,
+                },
+            )
+        )
+    return records
+
+
+class LessonContentIndex:
+    """Vector index over lessons, theories, tasks and tests of every course.
+
+    Content is derived from the database: a module is one document of the
+    vector store, re-embedded as a whole when the row counts or update times
+    of its content change. The store keeps all courses of an owner in one
+    partition, so a search is one lookup whatever the number of courses.
+
+    Searches never sync. Commits that touch content in this process mark
+    their courses and wake the sync thread (``start``); the thread also
+    re-checks every course once per TTL, which bounds how long writes of
+    other workers and bulk statements stay invisible. Unchanged texts hit the
+    embedding cache, so the first sync after a restart does not re-run the
+    model.
+    """
+
+    def __init__(
+        self,
+        vector_store: VectorStore,
+        *,
+        sync_ttl_seconds: float = 30,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self._vector_store = vector_store
+        self._sync_ttl_seconds = sync_ttl_seconds
+        self._clock = clock
+        # module_id -> content stamp that is embedded, per course partition
+        self._stamps: dict[PartitionKey, dict[int, tuple]] = {}
+        self._checked: dict[PartitionKey, float] = {}
+        self._versions: dict[int, int] = {}
+        self._module_courses: dict[int, int] = {}
+        self._lesson_modules: dict[int, int] = {}
+        # Content committed in this process and not synced yet.
+        self._dirty_courses: set[int] = set()
+        self._dirty_modules: set[int] = set()
+        self._dirty_lessons: set[int] = set()
+        self._wake = Event()
+        # Bumped on invalidation so that a sync racing with a commit does not
+        # mark the course as fresh.
+        self._generation = 0
+        self._lock = Lock()
+        self._sync_locks: dict[PartitionKey, Lock] = {}
+        # Several indexes may listen to the same sessions.
+        self._pending_key = (_PENDING, id(self))
+
+    def search(
+        self,
+        query: str,
+        *,
+        owner_id: int,
+        course_id: int | None = None,
+        limit: int,
+    ) -> list[VectorMatch]:
+        """Top ``limit`` matches over the courses of ``owner_id``, or one of them.
+
+        Serves what the last sync embedded; see ``sync_pending`` and
+        ``refresh``.
+        """
+        matches = self._vector_store.search(
+            query, VectorSearchFilters(owner_id, course_id, None), limit
+        )
+        stale = self._stale_modules(owner_id, matches)
+        return [
+            match for match in matches if match.metadata.get("module_id") not in stale
+        ]
+
+    @staticmethod
+    def texts(db: Session, matches: list[VectorMatch]) -> dict[str, str]:
+        """Current text of every match by embedding id.
+
+        The vector store keeps no texts, so they are read for the hits only.
+        Items deleted since the last sync have no entry.
+        """
+        item_ids: dict[str, set[int]] = {}
+        for match in matches:
+            item_ids.setdefault(match.metadata["type"], set()).add(
+                match.metadata["item_id"]
+            )
+        if not item_ids:
+            return {}
+        content = LessonIndexRepository.item_content(db, item_ids)
+        return {
+            f"{kind}:{item_id}": text
+            for _, kind, item_id, _, text in _content_rows(*content)
+            if text
+        }
+
+    def _stale_modules(self, owner_id: int, matches: list[VectorMatch]) -> set[int]:
+        suspects: dict[PartitionKey, set[int]] = {}
+        with self._lock:
+            for match in matches:
+                key = (owner_id, match.metadata.get("course_id"))
+                live = self._stamps.get(key)
+                if live is not None and match.metadata.get("module_id") not in live:
+                    suspects.setdefault(key, set()).add(match.metadata.get("module_id"))
+        stale = set()
+        for key, module_ids in suspects.items():
+            # Checked again under the sync lock: a concurrent sync may have
+            # embedded a module without having recorded its stamp yet.
+            with self._sync_lock(key):
+                with self._lock:
+                    live = self._stamps.get(key, {})
+                for module_id in module_ids:
+                    if module_id not in live:
+                        # Left on disk by a module deleted while the process
+                        # was down.
+                        self._vector_store.delete_document(module_id)
+                        stale.add(module_id)
+        return stale
+
+    def sync_pending(self, db: Session) -> None:
+        """Sync the courses whose content was committed in this process."""
+        with self._lock:
+            self._wake.clear()
+            course_ids = self._dirty_courses
+            module_ids, lesson_ids = self._dirty_modules, self._dirty_lessons
+            self._dirty_courses, self._dirty_modules, self._dirty_lessons = (
+                set(),
+                set(),
+                set(),
+            )
+        if module_ids or lesson_ids:
+            # Content of modules this process has not indexed yet.
+            resolved = LessonIndexRepository.content_course_ids(
+                db, module_ids, lesson_ids
+            )
+            with self._lock:
+                for key in list(self._checked):
+                    if key[1] in resolved:
+                        del self._checked[key]
+            course_ids |= resolved
+        if course_ids:
+            self._sync_courses(
+                db, LessonIndexRepository.course_owners(db, course_ids), course_ids
+            )
+
+    def refresh(self, db: Session) -> None:
+        """Sync every course, live or indexed, not checked within the TTL."""
+        self._sync_courses(db, LessonIndexRepository.course_owners(db), None)
+
+    def _sync_courses(
+        self, db: Session, owners: dict[int, int], course_ids: set[int] | None
+    ) -> None:
+        keys = {(owner_id, course_id) for course_id, owner_id in owners.items()}
+        with self._lock:
+            # Deleted courses and previous owners are synced to empty.
+            keys.update(
+                key for key in self._stamps if course_ids is None or key[1] in course_ids
+            )
+            keys = {key for key in keys if not self._is_checked(key)}
+            generation = self._generation
+        if not keys:
+            return
+        # The stamps of every course at once: a refresh costs a few grouped
+        # queries per TTL, not a round of queries per course.
+        checked_at = self._clock()
+        stamps = LessonIndexRepository.module_stamps(db, course_ids)
+        for owner_id, course_id in sorted(keys):
+            key = (owner_id, course_id)
+            try:
+                self._sync(db, key, (generation, checked_at, stamps.get(key, {})))
+            except Exception as exc:
+                # Left unchecked, the course is retried by the next refresh.
+                db.rollback()
+                logger.warning(
+                    "Индекс уроков курса %s не синхронизирован: %s", course_id, exc
+                )
+
+    def start(self, session_factory: sessionmaker, stop: Event) -> Thread:
+        """Keep the index in sync in a daemon thread until ``stop`` is set."""
+        thread = Thread(
+            target=self._run,
+            args=(session_factory, stop),
+            name="lesson-index-sync",
+            daemon=True,
+        )
+        thread.start()
+        return thread
+
+    def _run(self, session_factory: sessionmaker, stop: Event) -> None:
+        refresh_at = self._clock()
+        while not stop.is_set():
+            try:
+                with session_factory() as db:
+                    if self._clock() >= refresh_at:
+                        self.refresh(db)
+                        refresh_at = self._clock() + self._sync_ttl_seconds
+                    self.sync_pending(db)
+            except Exception as exc:
+                logger.warning("Индекс уроков не синхронизирован: %s", exc)
+            self._wake.wait(max(0.0, refresh_at - self._clock()))
+
+    def sync(self, db: Session, *, owner_id: int, course_id: int) -> None:
+        """Re-embed the modules of a course whose content changed."""
+        self._sync(db, (owner_id, course_id), None)
+
+    def _is_checked(self, key: PartitionKey) -> bool:
+        checked_at = self._checked.get(key)
+        return (
+            checked_at is not None
+            and self._clock() - checked_at < self._sync_ttl_seconds
+        )
+
+    def _sync(
+        self,
+        db: Session,
+        key: PartitionKey,
+        snapshot: tuple[int, float, dict[int, tuple]] | None,
+    ) -> None:
+        """Sync ``key`` to module stamps read now or to ``snapshot``.
+
+        ``snapshot`` holds the invalidation generation and the time its
+        stamps were read at; invalidations since then keep the course
+        unchecked.
+        """
+        owner_id, course_id = key
+        with self._sync_lock(key):
+            with self._lock:
+                if self._is_checked(key):
+                    return
+                generation = self._generation
+                previous = self._stamps.get(key, {})
+            if snapshot is None:
+                checked_at = self._clock()
+                stamps = LessonIndexRepository.module_stamps(db, {course_id}).get(
+                    key, {}
+                )
+            else:
+                generation, checked_at, stamps = snapshot
+            changed = [
+                module_id
+                for module_id, stamp in stamps.items()
+                if previous.get(module_id) != stamp
+            ]
+            removed = [module_id for module_id in previous if module_id not in stamps]
+
+            lessons, theories, tasks, tests = LessonIndexRepository.module_content(
+                db, changed
+            )
+            rows: dict[int, list[tuple]] = {module_id: [] for module_id in changed}
+            lesson_modules = {lesson.id: lesson.module_id for lesson in lessons}
+            for module_id, *row in _content_rows(lessons, theories, tasks, tests):
+                rows[module_id].append(tuple(row))
+
+            for module_id in changed:
+                with self._lock:
+                    version = self._versions.get(module_id, 0) + 1
+                    self._versions[module_id] = version
+                self._vector_store.replace_document(
+                    module_id,
+                    version,
+                    _module_records(owner_id, course_id, module_id, rows[module_id]),
+                )
+            for module_id in removed:
+                self._vector_store.delete_document(module_id)
+
+            with self._lock:
+                self._stamps[key] = stamps
+                self._module_courses.update(
+                    (module_id, course_id) for module_id in stamps
+                )
+                self._lesson_modules.update(lesson_modules)
+                if self._generation == generation:
+                    self._checked[key] = checked_at
+        if changed or removed:
+            logger.info(
+                "Lesson index of course %s: %s modules re-embedded, %s removed",
+                course_id,
+                len(changed),
+                len(removed),
+            )
+
+    def _sync_lock(self, key: PartitionKey) -> Lock:
+        with self._lock:
+            return self._sync_locks.setdefault(key, Lock())
+
+    def invalidate(
+        self,
+        *,
+        course_ids: Iterable[int] = (),
+        module_ids: Iterable[int] = (),
+        lesson_ids: Iterable[int] = (),
+    ) -> None:
+        """Mark content for the sync thread and wake it."""
+        with self._lock:
+            self._generation += 1
+            courses = set(course_ids)
+            for module_id in module_ids:
+                course_id = self._module_courses.get(module_id)
+                if course_id is None:
+                    self._dirty_modules.add(module_id)
+                else:
+                    courses.add(course_id)
+            for lesson_id in lesson_ids:
+                course_id = self._module_courses.get(self._lesson_modules.get(lesson_id))
+                if course_id is None:
+                    self._dirty_lessons.add(lesson_id)
+                else:
+                    courses.add(course_id)
+            self._dirty_courses |= courses
+            for key in list(self._checked):
+                if key[1] in courses:
+                    del self._checked[key]
+        self._wake.set()
+
+    def listen(self, session_class: type[Session] = Session) -> None:
+        """Mark courses for a resync when sessions of ``session_class`` commit."""
+        event.listen(session_class, "after_flush", self._collect)
+        event.listen(session_class, "after_commit", self._apply)
+        event.listen(session_class, "after_rollback", self._discard)
+
+    def _collect(self, session: Session, flush_context) -> None:
+        pending = session.info.setdefault(
+            self._pending_key,
+            {"course_ids": set(), "module_ids": set(), "lesson_ids": set()},
+        )
+        for instance in chain(session.new, session.dirty, session.deleted):
+            if isinstance(instance, Course):
+                # Deleting a course or handing it over moves its content.
+                pending["course_ids"].add(instance.id)
+            elif isinstance(instance, Module):
+                pending["course_ids"].update(_history(instance, "course_id"))
+            elif isinstance(instance, (Lesson, Task, Test)):
+                pending["module_ids"].update(_history(instance, "module_id"))
+            elif isinstance(instance, Theory):
+                pending["lesson_ids"].update(_history(instance, "lesson_id"))
+
+    def _apply(self, session: Session) -> None:
+        pending = session.info.pop(self._pending_key, None)
+        if pending:
+            self.invalidate(**pending)
+
+    def _discard(self, session: Session) -> None:
+        session.info.pop(self._pending_key, None)
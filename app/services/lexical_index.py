@@ -0,0 +1,218 @@
+from __future__ import annotations
+
+import heapq
+import math
+import re
+from collections import Counter
+from collections.abc import Iterable
+from dataclasses import dataclass
+from threading import RLock
+from typing import Protocol
+
+from app.services.vector_store import PartitionKey, VectorSearchFilters
+
+# Dotted identifiers (``np.argsort``) are indexed whole and by their parts.
+_TOKEN = re.compile(r"\w+(?:\.\w+)*")
+# Inflectional endings only, longest first; stems keep at least three letters.
+_SUFFIXES = tuple(
+    sorted(
+        (
+            "иями", "ями", "ами", "ого", "его", "ому", "ему", "ыми", "ими",
+            "ых", "их", "ая", "яя", "ой", "ей", "ий", "ый", "ое", "ее", "ую",
+            "юю", "ом", "ем", "ам", "ям", "ах", "ях", "ов", "ев", "ью", "ие",
+            "ия", "ию", "ии", "ы", "и", "а", "я", "о", "е", "у", "ю", "ь",
+            "ing", "ed", "es", "s",
+        ),
+        key=len,
+        reverse=True,
+    )
+)
+
+
+def _stem(token: str) -> str:
+    if not token.isalpha() or token.endswith("ss"):
+        return token
+    for suffix in _SUFFIXES:
+        if token.endswith(suffix) and len(token) - len(suffix) >= 3:
+            return token[: -len(suffix)]
+    return token
+
+
+def tokenize(text: str) -> list[str]:
+    tokens = []
+    for match in _TOKEN.findall(text.lower().replace("ё", "е")):
+        parts = match.split(".")
+        if len(parts) > 1:
+            tokens.append(match)
+        tokens.extend(_stem(part) for part in parts if part)
+    return tokens
+
+
+@dataclass(frozen=True)
+class LexicalRecord:
+    chunk_id: int
+    owner_id: int
+    course_id: int
+    text: str
+
+
+@dataclass(frozen=True)
+class LexicalMatch:
+    chunk_id: int
+    score: float
+
+
+class LexicalIndex(Protocol):
+    def document_version(self, document_id: int) -> int | None: ...
+
+    def document_chunk_ids(self, document_id: int) -> frozenset[int] | None: ...
+
+    def replace_document(
+        self,
+        document_id: int,
+        document_version: int,
+        records: Iterable[LexicalRecord],
+    ) -> None: ...
+
+    def delete_document(self, document_id: int) -> None: ...
+
+    def search(
+        self, query: str, filters: VectorSearchFilters, limit: int
+    ) -> list[LexicalMatch]: ...
+
+
+class _LexicalPartition:
+    def __init__(self):
+        # term -> chunk_id -> term frequency
+        self.postings: dict[str, dict[int, int]] = {}
+        self.lengths: dict[int, int] = {}
+        self.total_length = 0
+
+    def add(self, chunk_id: int, terms: Counter[str]) -> None:
+        for term, frequency in terms.items():
+            self.postings.setdefault(term, {})[chunk_id] = frequency
+        length = sum(terms.values())
+        self.lengths[chunk_id] = length
+        self.total_length += length
+
+    def remove(self, chunk_id: int, terms: tuple[str, ...]) -> None:
+        for term in terms:
+            chunks = self.postings.get(term)
+            if chunks is None:
+                continue
+            chunks.pop(chunk_id, None)
+            if not chunks:
+                del self.postings[term]
+        self.total_length -= self.lengths.pop(chunk_id, 0)
+
+
+class Bm25Index:
+    """In-memory BM25 index over document chunks, partitioned by course.
+
+    Documents are replaced as a whole, like in the vector store, so a reindex
+    only touches the postings of that document. The index is derived data:
+    callers rebuild missing documents from ``DocumentChunk`` rows.
+    """
+
+    def __init__(self, *, k1: float = 1.2, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self._partitions: dict[PartitionKey, _LexicalPartition] = {}
+        # document_id -> (partition, version, {chunk_id: distinct terms})
+        self._documents: dict[
+            int, tuple[PartitionKey, int, dict[int, tuple[str, ...]]]
+        ] = {}
+        self._lock = RLock()
+
+    def document_version(self, document_id: int) -> int | None:
+        with self._lock:
+            entry = self._documents.get(document_id)
+            return entry[1] if entry is not None else None
+
+    def document_chunk_ids(self, document_id: int) -> frozenset[int] | None:
+        with self._lock:
+            entry = self._documents.get(document_id)
+            return frozenset(entry[2]) if entry is not None else None
+
+    def replace_document(
+        self,
+        document_id: int,
+        document_version: int,
+        records: Iterable[LexicalRecord],
+    ) -> None:
+        # Read once: a lazy iterable keeps only the terms of its texts.
+        keys = set()
+        analyzed = []
+        for record in records:
+            keys.add((record.owner_id, record.course_id))
+            if len(keys) > 1:
+                raise ValueError("Document chunks must belong to one owner and course")
+            analyzed.append((record.chunk_id, Counter(tokenize(record.text))))
+
+        with self._lock:
+            self._remove_document(document_id)
+            if not keys:
+                return
+            key = keys.pop()
+            partition = self._partitions.setdefault(key, _LexicalPartition())
+            chunk_terms = {}
+            for chunk_id, terms in analyzed:
+                partition.add(chunk_id, terms)
+                chunk_terms[chunk_id] = tuple(terms)
+            self._documents[document_id] = (key, document_version, chunk_terms)
+
+    def delete_document(self, document_id: int) -> None:
+        with self._lock:
+            self._remove_document(document_id)
+
+    def search(
+        self, query: str, filters: VectorSearchFilters, limit: int
+    ) -> list[LexicalMatch]:
+        terms = set(tokenize(query))
+        if not terms or limit <= 0 or filters.allowed_chunk_ids == frozenset():
+            return []
+        allowed = filters.allowed_chunk_ids
+        scores: dict[int, float] = {}
+        with self._lock:
+            partition = self._partitions.get((filters.owner_id, filters.course_id))
+            if partition is None or not partition.lengths:
+                return []
+            total = len(partition.lengths)
+            average_length = partition.total_length / total
+            lengths = partition.lengths
+            for term in terms:
+                chunks = partition.postings.get(term)
+                if not chunks:
+                    continue
+                idf = math.log(1 + (total - len(chunks) + 0.5) / (len(chunks) + 0.5))
+                for chunk_id, frequency in chunks.items():
+                    if allowed is not None and chunk_id not in allowed:
+                        continue
+                    norm = self.k1 * (
+                        1 - self.b + self.b * lengths[chunk_id] / average_length
+                    )
+                    scores[chunk_id] = scores.get(chunk_id, 0.0) + idf * (
+                        frequency * (self.k1 + 1) / (frequency + norm)
+                    )
+        best = heapq.nlargest(
+            limit, scores.items(), key=lambda item: (item[1], -item[0])
+        )
+        return [LexicalMatch(chunk_id, score) for chunk_id, score in best]
+
+    def _remove_document(self, document_id: int) -> None:
+        entry = self._documents.pop(document_id, None)
+        if entry is None:
+            return
+        key, _, chunk_terms = entry
+        partition = self._partitions[key]
+        for chunk_id, terms in chunk_terms.items():
+            partition.remove(chunk_id, terms)
+        if not partition.lengths:
+            del self._partitions[key]
+
+
+document_lexical_index = Bm25Index()
+
+
+def get_lexical_index() -> LexicalIndex:
+    return document_lexical_index
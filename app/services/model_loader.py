@@ -0,0 +1,101 @@
+from __future__ import annotations
+
+import logging
+import time
+from collections.abc import Callable
+from threading import Event, Lock, Thread
+from typing import Any
+
+logger = logging.getLogger(__name__)
+
+
+class ModelLoader:
+    """Loads a model once and warms it up, optionally in the background.
+
+    Loading is single-flight: whichever caller comes first runs ``factory``,
+    everyone else waits for that attempt instead of loading a second copy. A
+    failed load is not retried; ``get`` then returns ``None`` and callers run
+    without the model, as before.
+    """
+
+    NOT_LOADED = "not_loaded"
+    LOADING = "loading"
+    READY = "ready"
+    UNAVAILABLE = "unavailable"
+
+    def __init__(
+        self,
+        factory: Callable[[], Any],
+        *,
+        warmup_texts: tuple[str, ...] = ("warm-up",),
+        clock: Callable[[], float] = time.perf_counter,
+    ):
+        self._factory = factory
+        self._warmup_texts = warmup_texts
+        self._clock = clock
+        self._lock = Lock()
+        self._done = Event()
+        self._model: Any = None
+        self.state = self.NOT_LOADED
+        self.error: str | None = None
+        self.load_seconds: float | None = None
+        self.warmup_seconds: float | None = None
+
+    def start(self) -> None:
+        """Begin loading in a daemon thread; returns immediately."""
+        with self._lock:
+            if self.state != self.NOT_LOADED:
+                return
+            self.state = self.LOADING
+        Thread(target=self._load, name="model-warmup", daemon=True).start()
+
+    def get(self) -> Any:
+        """The loaded model, blocking while a load is in flight."""
+        with self._lock:
+            owner = self.state == self.NOT_LOADED
+            if owner:
+                self.state = self.LOADING
+        if owner:
+            self._load()
+        self._done.wait()
+        return self._model
+
+    def status(self) -> dict[str, Any]:
+        with self._lock:
+            return {
+                "state": self.state,
+                "load_seconds": self.load_seconds,
+                "warmup_seconds": self.warmup_seconds,
+                "error": self.error,
+            }
+
+    def _load(self) -> None:
+        started = self._clock()
+        try:
+            model = self._factory()
+            loaded = self._clock()
+            # The first forward pass allocates buffers and compiles kernels;
+            # pay for it here instead of in the first user request.
+            model.encode(list(self._warmup_texts))
+            warmed = self._clock()
+        except Exception as exc:
+            logger.warning(
+                "Модель эмбеддингов недоступна, семантический поиск отключён: %s", exc
+            )
+            with self._lock:
+                self.state = self.UNAVAILABLE
+                self.error = str(exc)
+                self.load_seconds = self._clock() - started
+        else:
+            logger.info(
+                "Модель эмбеддингов загружена за %.2f с, прогрев %.2f с",
+                loaded - started,
+                warmed - loaded,
+            )
+            with self._lock:
+                self._model = model
+                self.state = self.READY
+                self.load_seconds = loaded - started
+                self.warmup_seconds = warmed - loaded
+        finally:
+            self._done.set()
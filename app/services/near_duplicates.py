@@ -0,0 +1,103 @@
+"""Near-duplicate detection for document chunks.
+
+A chunk is summarized by a 64-bit SimHash of its word 3-shingles: texts that
+share most shingles get signatures a few bits apart, whatever their length.
+``NearDuplicateIndex`` finds a signature within ``max_distance`` bits without
+comparing against every chunk of the course: signatures are cut into
+``max_distance + 1`` bands, and by the pigeonhole principle two signatures
+that close agree exactly on at least one band.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import re
+
+import numpy as np
+
+SIGNATURE_BITS = 64
+
+_WORD_RE = re.compile(r"\w+")
+_BIT_SHIFTS = np.arange(SIGNATURE_BITS, dtype=np.uint64)
+
+
+def _shingle_hash(shingle: str) -> int:
+    return int.from_bytes(
+        hashlib.blake2b(shingle.encode(), digest_size=8).digest(), "little"
+    )
+
+
+def simhash(text: str, *, shingle_words: int = 3, min_shingles: int = 8) -> int | None:
+    """Signed 64-bit SimHash of ``text``, or None if it is too short to tell.
+
+    The value is signed so that it fits a BIGINT column as is.
+    """
+    words = _WORD_RE.findall(text.lower())
+    shingle_count = len(words) - shingle_words + 1
+    if shingle_count < min_shingles:
+        return None
+    hashes = np.fromiter(
+        (
+            _shingle_hash(" ".join(words[index : index + shingle_words]))
+            for index in range(shingle_count)
+        ),
+        dtype=np.uint64,
+        count=shingle_count,
+    )
+    bits = (hashes[:, None] >> _BIT_SHIFTS) & np.uint64(1)
+    # A signature bit is set where most shingles have it set.
+    ones = bits.sum(axis=0, dtype=np.int64)
+    signature = 0
+    for bit in np.flatnonzero(ones * 2 > shingle_count):
+        signature |= 1 << int(bit)
+    return signature - (1 << SIGNATURE_BITS) if signature >> 63 else signature
+
+
+def hamming(left: int, right: int) -> int:
+    return ((left ^ right) & ((1 << SIGNATURE_BITS) - 1)).bit_count()
+
+
+class NearDuplicateIndex:
+    """Chunk ids by SimHash; ``find`` returns the closest one in range."""
+
+    def __init__(self, max_distance: int):
+        if not 0 <= max_distance < SIGNATURE_BITS:
+            raise ValueError("max_distance must be between 0 and 63")
+        self.max_distance = max_distance
+        bands = max_distance + 1
+        bounds = [index * SIGNATURE_BITS // bands for index in range(bands + 1)]
+        # (shift, mask) of every band
+        self._bands = [
+            (start, (1 << (end - start)) - 1)
+            for start, end in zip(bounds, bounds[1:])
+        ]
+        self._buckets: list[dict[int, list[int]]] = [{} for _ in self._bands]
+        self._signatures: dict[int, int] = {}
+
+    def __len__(self) -> int:
+        return len(self._signatures)
+
+    def _band_values(self, signature: int):
+        for shift, mask in self._bands:
+            yield (signature >> shift) & mask
+
+    def add(self, chunk_id: int, signature: int) -> None:
+        self._signatures[chunk_id] = signature
+        for buckets, value in zip(
+            self._buckets, self._band_values(signature), strict=True
+        ):
+            buckets.setdefault(value, []).append(chunk_id)
+
+    def find(self, signature: int) -> int | None:
+        """Closest chunk within ``max_distance`` bits; the earliest on ties."""
+        best: tuple[int, int] | None = None
+        for buckets, value in zip(
+            self._buckets, self._band_values(signature), strict=True
+        ):
+            for chunk_id in buckets.get(value, ()):
+                distance = hamming(signature, self._signatures[chunk_id])
+                if distance <= self.max_distance and (
+                    best is None or (distance, chunk_id) < best
+                ):
+                    best = (distance, chunk_id)
+        return best[1] if best is not None else None
@@ -3,8 +3,12 @@ from __future__ import annotations
 import hashlib
 import json
 import time
+from collections import deque
+from collections.abc import Iterable, Iterator
+from contextlib import contextmanager
 
 from fastapi import HTTPException
+from sqlalchemy.engine import Row
 from sqlalchemy.orm import Session
 
 from app.core.config import settings
@@ -16,12 +20,26 @@ from app.models.domain_enums import (
     GenerationRunType,
     CourseStatus,
 )
+from app.models.document import Document, DocumentChunk
 from app.models.generation_run import GenerationRun
 from app.repositories.pipeline import PipelineRepository
+from app.repositories.retrieval import RetrievalRepository
 from app.schemas.pipeline import GeneratedGraphPayload
-from app.services.document_processing import chunk_blocks, extract_blocks
-from app.services.embedding_service import replace_document_embeddings
+from app.services.document_processing import (
+    CHUNKER_VERSION,
+    batched,
+    chunk_blocks,
+    chunk_fingerprint,
+    extract_blocks,
+)
+from app.services.embedding_service import (
+    document_token_counter,
+    replace_chunk_embeddings,
+    replace_document_embeddings,
+)
 from app.services.file_storage import FileStorage
+from app.services.lexical_index import LexicalRecord, document_lexical_index
+from app.services.near_duplicates import NearDuplicateIndex, simhash
 from app.services.generation_service import DEFAULT_ENGINE, generate_from_prompt
 from app.services.course_generation_settings_service import (
     generation_settings_snapshot,
@@ -37,6 +55,30 @@ class PipelineRunFailed(Exception):
         self.status_code = status_code
 
 
+class RunLeaseLost(Exception):
+    """The lease of a run expired and another worker may be executing it.
+
+    Nothing of the run is committed: its results belong to the new holder.
+    """
+
+    def __init__(self, run_id: int):
+        super().__init__(f"Lease of run {run_id} was lost")
+        self.run_id = run_id
+
+
+def _check_lease(db: Session, run_id: int, lease_owner: str | None) -> None:
+    """Raise ``RunLeaseLost`` unless the worker still holds the run's lease.
+
+    Runs executed inline have no lease. On success the row stays locked until
+    the caller commits, so the lease cannot expire in between.
+    """
+    if lease_owner is None:
+        return
+    if PipelineRepository.locked_lease_owner(db, run_id) != lease_owner:
+        db.rollback()
+        raise RunLeaseLost(run_id)
+
+
 def _elapsed_ms(started: float) -> int:
     return max(0, int((time.perf_counter() - started) * 1000))
 
@@ -52,6 +94,196 @@ def _safe_document_error(exc: Exception) -> str:
     return "Не удалось обработать документ"
 
 
+def _chunk_sizes() -> dict:
+    if settings.DOCUMENT_CHUNK_UNIT == "tokens":
+        return {
+            "max_size": settings.DOCUMENT_CHUNK_TOKENS,
+            "overlap": settings.DOCUMENT_CHUNK_OVERLAP_TOKENS,
+            "length": document_token_counter(),
+        }
+    return {
+        "max_size": settings.DOCUMENT_CHUNK_CHARS,
+        "overlap": settings.DOCUMENT_CHUNK_OVERLAP_CHARS,
+    }
+
+
+def _chunking_key() -> str:
+    """Digest of the settings that decide how a file is cut into chunks."""
+    config = {"chunker": CHUNKER_VERSION, "unit": settings.DOCUMENT_CHUNK_UNIT}
+    if settings.DOCUMENT_CHUNK_UNIT == "tokens":
+        config.update(
+            max_size=settings.DOCUMENT_CHUNK_TOKENS,
+            overlap=settings.DOCUMENT_CHUNK_OVERLAP_TOKENS,
+            tokenizer=settings.EMBEDDING_MODEL,
+        )
+    else:
+        config.update(
+            max_size=settings.DOCUMENT_CHUNK_CHARS,
+            overlap=settings.DOCUMENT_CHUNK_OVERLAP_CHARS,
+        )
+    return hashlib.sha256(json.dumps(config, sort_keys=True).encode()).hexdigest()
+
+
+@contextmanager
+def _new_chunks(
+    db: Session, document: Document, storage: FileStorage, artifact: Document | None
+) -> Iterator[Iterable[dict]]:
+    """Chunks of the document file, copied from ``artifact`` when there is one.
+
+    The same file indexed in another course was already extracted and cut
+    with the same settings; its chunk rows are the cached result.
+    """
+    if artifact is not None:
+        yield (
+            {
+                "text": row.text,
+                "page": row.page,
+                "section": row.section,
+                "metadata_json": {"page": row.page, "section": row.section},
+                "chunk_index": row.chunk_index,
+            }
+            for row in PipelineRepository.version_chunks(
+                db, artifact, settings.DOCUMENT_INDEX_BATCH_SIZE
+            )
+        )
+        return
+    with storage.local_path(document.storage_key) as path:
+        yield chunk_blocks(
+            extract_blocks(
+                path,
+                document.mime_type,
+                parallel_min_pages=settings.PDF_PARALLEL_MIN_PAGES,
+                workers=settings.PDF_EXTRACT_WORKERS,
+            ),
+            **_chunk_sizes(),
+        )
+
+
+def _promote_duplicates(db: Session, duplicates: list[DocumentChunk]) -> None:
+    """Relink near-duplicates whose canonical chunk is about to be replaced.
+
+    The first duplicate of every canonical chunk takes its place and gets a
+    vector of its own; the others link to it.
+    """
+    if not duplicates:
+        return
+    promoted: dict[int, DocumentChunk] = {}
+    for chunk in duplicates:
+        canonical = promoted.setdefault(chunk.canonical_chunk_id, chunk)
+        chunk.canonical_chunk_id = None if canonical is chunk else canonical.id
+    db.flush()
+    embedding_ids = replace_chunk_embeddings(
+        RetrievalRepository.document_vector_chunks(
+            db, sorted({chunk.document_id for chunk in promoted.values()})
+        )
+    )
+    for chunk in duplicates:
+        chunk.embedding_id = embedding_ids[chunk.canonical_chunk_id or chunk.id]
+
+
+def _course_duplicate_index(
+    db: Session, document: Document
+) -> tuple[NearDuplicateIndex | None, dict[int, str]]:
+    """Canonical chunks of the other documents of the course, by SimHash.
+
+    Also returns their embedding ids, which linked duplicates share.
+    """
+    if settings.DOCUMENT_DEDUP_MAX_DISTANCE is None:
+        return None, {}
+    index = NearDuplicateIndex(settings.DOCUMENT_DEDUP_MAX_DISTANCE)
+    embedding_ids = {}
+    for row in PipelineRepository.course_chunk_signatures(
+        db, document.course_id, document.owner_id, document.id
+    ):
+        index.add(row.id, row.simhash)
+        embedding_ids[row.id] = row.embedding_id
+    return index, embedding_ids
+
+
+def _link_near_duplicates(
+    signatures: list[Row], linked_ids: set[int], index: NearDuplicateIndex | None
+) -> dict[int, int]:
+    """Canonical chunk of every near-duplicate among ``linked_ids``.
+
+    ``signatures`` are the ``(id, simhash, canonical_chunk_id)`` rows of a
+    document version by position. Canonical chunks come from other documents
+    of the course, from the other rows of the version, or from earlier chunks
+    of ``linked_ids``, which are added to ``index`` as they are seen.
+    """
+    if index is None:
+        return {}
+    for row in signatures:
+        if (
+            row.id not in linked_ids
+            and row.canonical_chunk_id is None
+            and row.simhash is not None
+        ):
+            index.add(row.id, row.simhash)
+    links = {}
+    for row in signatures:
+        if row.id not in linked_ids or row.simhash is None:
+            continue
+        canonical_id = index.find(row.simhash)
+        if canonical_id is None:
+            index.add(row.id, row.simhash)
+        else:
+            links[row.id] = canonical_id
+    return links
+
+
+def _rows_by_fingerprint(
+    db: Session, previous: list[DocumentChunk]
+) -> dict[str, deque[DocumentChunk]]:
+    """Stored rows by text, for pairing with new chunks in document order."""
+    legacy = [row for row in previous if row.fingerprint is None]
+    texts = PipelineRepository.chunk_texts(db, [row.id for row in legacy])
+    for row in legacy:
+        row.fingerprint = chunk_fingerprint(texts[row.id])
+    rows: dict[str, deque[DocumentChunk]] = {}
+    for row in previous:
+        rows.setdefault(row.fingerprint, deque()).append(row)
+    return rows
+
+
+class _VectorChunks:
+    """Canonical chunks of the version being indexed, read back in batches.
+
+    Every iteration queries the database again, so the texts of a document
+    are never all in memory, not even when two stores of a migration read
+    them.
+    """
+
+    def __init__(self, db: Session, document: Document):
+        self.db = db
+        self.document = document
+
+    def __iter__(self) -> Iterator[dict]:
+        document = self.document
+        for row in PipelineRepository.version_chunks(
+            self.db, document, settings.DOCUMENT_INDEX_BATCH_SIZE, canonical_only=True
+        ):
+            yield {
+                "chunk_id": row.id,
+                "chunk_index": row.chunk_index,
+                "text": row.text,
+                "page": row.page,
+                "section": row.section,
+                "source": document.original_filename,
+                "source_type": document.source_type,
+                "owner_id": document.owner_id,
+                "organization_id": None,
+                "course_id": document.course_id,
+            }
+
+
+def _chunk_moved(chunk_model: DocumentChunk, chunk: dict) -> bool:
+    return (chunk_model.chunk_index, chunk_model.page, chunk_model.section) != (
+        chunk["chunk_index"],
+        chunk.get("page"),
+        chunk.get("section"),
+    )
+
+
 def _unique_node_id(existing: set[str], base: str) -> str:
     candidate = base
     suffix = 2
@@ -121,18 +353,18 @@ class PipelineService:
         return run
 
     @staticmethod
-    def reindex_document(
-        db: Session,
-        *,
-        document_id: int,
-        owner_id: int,
-        storage: FileStorage,
+    def enqueue_reindex(
+        db: Session, *, document_id: int, owner_id: int
     ) -> GenerationRun:
+        """Queue indexing of a document; a run already pending is returned."""
         document = PipelineRepository.get_owned_document(db, document_id, owner_id)
         if document is None:
             raise HTTPException(status_code=404, detail="Документ не найден")
         if document.status == DocumentStatus.ARCHIVED.value:
             raise HTTPException(status_code=409, detail="Документ архивирован")
+        pending = PipelineRepository.pending_document_run(db, document.id)
+        if pending is not None:
+            return pending
 
         fingerprint = hashlib.sha256(
             f"{document.id}:{document.version}:{document.content_hash}".encode()
@@ -158,63 +390,221 @@ class PipelineService:
         db.add(run)
         db.commit()
         db.refresh(run)
-        run_id = run.id
+        return run
+
+    @staticmethod
+    def reindex_document(
+        db: Session,
+        *,
+        document_id: int,
+        owner_id: int,
+        storage: FileStorage,
+    ) -> GenerationRun:
+        """Queue and run the indexing of a document in the calling thread."""
+        run = PipelineService.enqueue_reindex(
+            db, document_id=document_id, owner_id=owner_id
+        )
+        if run.status != GenerationRunStatus.QUEUED.value:
+            return run
+        return PipelineService.execute_run(db, run, storage)
 
+    @staticmethod
+    def execute_run(
+        db: Session, run: GenerationRun, storage: FileStorage | None
+    ) -> GenerationRun:
+        """Run a claimed or freshly queued run to its final status.
+
+        A failure is recorded on the run and raised as ``PipelineRunFailed``.
+        A run claimed by a worker (``lease_owner`` set) is only committed while
+        the worker holds its lease, otherwise ``RunLeaseLost`` is raised.
+        """
+        if run.run_type == GenerationRunType.DOCUMENT_INDEX.value:
+            return PipelineService._index_document(db, run, storage)
+        return PipelineService._generate_graph(db, run)
+
+    @staticmethod
+    def _index_document(
+        db: Session, run: GenerationRun, storage: FileStorage
+    ) -> GenerationRun:
+        run_id, document_id, owner_id = run.id, run.document_id, run.owner_id
+        lease_owner = run.lease_owner
         started = time.perf_counter()
         try:
+            document = PipelineRepository.get_owned_document(db, document_id, owner_id)
+            if document is None:
+                raise LookupError("Документ удалён до начала индексации")
             run.status = GenerationRunStatus.RUNNING.value
             document.status = DocumentStatus.PROCESSING.value
             db.commit()
 
-            content = storage.read_bytes(document.storage_key)
-            blocks = extract_blocks(content, document.mime_type)
-            chunks = chunk_blocks(
-                blocks,
-                max_chars=settings.DOCUMENT_CHUNK_CHARS,
-                overlap_chars=settings.DOCUMENT_CHUNK_OVERLAP_CHARS,
+            previous = PipelineRepository.document_chunk_states(db, document)
+            chunking_key = _chunking_key()
+            artifact = PipelineRepository.chunk_artifact(db, document, chunking_key)
+            unmatched = _rows_by_fingerprint(db, previous)
+
+            # The file streams into the database batch by batch: only the texts
+            # of one batch are in memory. Positions are unique per document
+            # version, so new and moved rows are parked past every old
+            # position until the stream ends.
+            parking = max(
+                (chunk_model.chunk_index + 1 for chunk_model in previous), default=0
             )
-            if not chunks:
+            kept: list[DocumentChunk] = []
+            updated_ids: set[int] = set()
+            new_chunk_ids: set[int] = set()
+            chunk_count = 0
+            with _new_chunks(db, document, storage, artifact) as chunks:
+                for batch in batched(chunks, settings.DOCUMENT_INDEX_BATCH_SIZE):
+                    chunk_count += len(batch)
+                    inserted = []
+                    for chunk in batch:
+                        chunk["fingerprint"] = chunk_fingerprint(chunk["text"])
+                        rows = unmatched.get(chunk["fingerprint"])
+                        if not rows:
+                            chunk["simhash"] = simhash(chunk["text"])
+                            chunk["chunk_index"] += parking
+                            inserted.append(chunk)
+                            continue
+                        chunk_model = rows.popleft()
+                        kept.append(chunk_model)
+                        if chunk_model.chunk_index != chunk["chunk_index"]:
+                            chunk["chunk_index"] += parking
+                        if _chunk_moved(chunk_model, chunk):
+                            PipelineRepository.update_chunk(document, chunk_model, chunk)
+                            updated_ids.add(chunk_model.id)
+                    new_chunk_ids.update(
+                        chunk_model.id
+                        for chunk_model in PipelineRepository.add_chunks(
+                            db, document, inserted
+                        )
+                    )
+            if not chunk_count:
                 raise ValueError("В документе не найден текст для индексации")
 
-            chunk_models = PipelineRepository.replace_chunks(db, document, chunks)
-            vector_chunks = [
+            # Rows whose text is gone: their duplicates in other documents are
+            # promoted, the ones of this document are linked again below.
+            deleted_ids = [
+                chunk_model.id for rows in unmatched.values() for chunk_model in rows
+            ]
+            _promote_duplicates(
+                db,
+                PipelineRepository.dependent_duplicates(db, document.id, deleted_ids),
+            )
+            deleted_set = set(deleted_ids)
+            relinked = {
+                chunk_model.id: chunk_model
+                for chunk_model in kept
+                if chunk_model.canonical_chunk_id in deleted_set
+            }
+            for chunk_model in relinked.values():
+                chunk_model.canonical_chunk_id = None
+            db.flush()
+            PipelineRepository.delete_chunks(db, deleted_ids)
+            PipelineRepository.unpark_chunks(db, document, parking, chunk_count)
+            updated_ids.update(relinked)
+
+            duplicate_index, embedding_ids = _course_duplicate_index(db, document)
+            duplicate_links = _link_near_duplicates(
+                PipelineRepository.version_chunk_signatures(db, document),
+                new_chunk_ids | set(relinked),
+                duplicate_index,
+            )
+            for chunk_id, canonical_id in duplicate_links.items():
+                if chunk_id in relinked:
+                    relinked[chunk_id].canonical_chunk_id = canonical_id
+            PipelineRepository.set_canonical_chunk_ids(
+                db,
                 {
-                    "chunk_id": chunk_model.id,
-                    "chunk_index": chunk_model.chunk_index,
-                    "text": chunk_model.text,
-                    "page": chunk_model.page,
-                    "section": chunk_model.section,
-                    "source": document.original_filename,
-                    "source_type": document.source_type,
-                    "owner_id": document.owner_id,
-                    "organization_id": None,
-                    "course_id": document.course_id,
-                }
-                for chunk_model in chunk_models
+                    chunk_id: canonical_id
+                    for chunk_id, canonical_id in duplicate_links.items()
+                    if chunk_id in new_chunk_ids
+                },
+            )
+            db.flush()
+
+            # (chunk id, canonical chunk id) of every chunk of the new version;
+            # only canonical chunks are embedded, duplicates share their vector.
+            links = PipelineRepository.version_chunk_links(db, document)
+            canonical_ids = [
+                chunk_id for chunk_id, canonical_id in links if canonical_id is None
             ]
-            embedding_ids = replace_document_embeddings(
-                document.id, document.version, vector_chunks
+            # Vectors of unchanged texts, and of the artifact document, are
+            # reused by the store; only the other chunks are encoded. Texts
+            # are read back batch by batch and the version is published once.
+            canonical_embedding_ids = replace_document_embeddings(
+                document.id,
+                document.version,
+                _VectorChunks(db, document),
+                vector_source=artifact.id if artifact is not None else None,
             )
-            for chunk_model, embedding_id in zip(
-                chunk_models, embedding_ids, strict=True
+            embedding_ids.update(
+                zip(canonical_ids, canonical_embedding_ids, strict=True)
+            )
+            # Embedding ids follow chunk positions: moved canonical chunks
+            # relabel their duplicates in other documents too.
+            relabeled = {}
+            for chunk_model in kept:
+                embedding_id = embedding_ids.get(
+                    chunk_model.canonical_chunk_id or chunk_model.id,
+                    chunk_model.embedding_id,
+                )
+                if embedding_id != chunk_model.embedding_id:
+                    chunk_model.embedding_id = embedding_id
+                    relabeled[chunk_model.id] = embedding_id
+            for duplicate in PipelineRepository.dependent_duplicates(
+                db, document.id, list(relabeled)
             ):
-                chunk_model.embedding_id = embedding_id
+                duplicate.embedding_id = relabeled[duplicate.canonical_chunk_id]
+            PipelineRepository.set_embedding_ids(
+                db,
+                {
+                    chunk_id: embedding_ids[canonical_id or chunk_id]
+                    for chunk_id, canonical_id in links
+                    if chunk_id in new_chunk_ids
+                },
+            )
+            document_lexical_index.replace_document(
+                document.id,
+                document.version,
+                (
+                    LexicalRecord(
+                        chunk_id=row.id,
+                        owner_id=document.owner_id,
+                        course_id=document.course_id,
+                        text=row.text,
+                    )
+                    for row in PipelineRepository.version_chunks(
+                        db, document, settings.DOCUMENT_INDEX_BATCH_SIZE
+                    )
+                ),
+            )
 
             document.status = DocumentStatus.INDEXED.value
             document.processing_error = None
+            document.chunking_key = chunking_key
             run.status = GenerationRunStatus.SUCCEEDED.value
             run.latency_ms = _elapsed_ms(started)
             run.output = {
                 "document_id": document.id,
                 "document_version": document.version,
-                "chunk_count": len(chunk_models),
-                "embedding_count": len(embedding_ids),
+                "artifact_document_id": artifact.id if artifact is not None else None,
+                "chunk_count": len(links),
+                "embedding_count": len(canonical_embedding_ids),
+                "duplicate_chunk_count": len(links) - len(canonical_ids),
+                "unchanged_chunk_count": len(kept) - len(updated_ids),
+                "updated_chunk_count": len(updated_ids),
+                "inserted_chunk_count": len(new_chunk_ids),
+                "deleted_chunk_count": len(deleted_ids),
             }
+            _check_lease(db, run_id, lease_owner)
             db.commit()
             db.refresh(run)
             return run
+        except RunLeaseLost:
+            raise
         except Exception as exc:
             db.rollback()
+            _check_lease(db, run_id, lease_owner)
             error = _safe_error(exc)
             failed_run = db.get(GenerationRun, run_id)
             failed_document = PipelineRepository.get_owned_document(
@@ -232,9 +622,14 @@ class PipelineService:
             raise PipelineRunFailed(run_id, error, status_code) from exc
 
     @staticmethod
-    def generate_graph(
+    def enqueue_graph_generation(
         db: Session, *, course_id: int, owner_id: int, force: bool
     ) -> GenerationRun:
+        """Queue graph generation for a course.
+
+        Without ``force`` the earlier successful run is returned when the
+        documents and settings it was generated from are unchanged.
+        """
         course = PipelineRepository.get_owned_course(db, course_id, owner_id)
         if course is None:
             raise HTTPException(status_code=404, detail="Курс не найден")
@@ -315,10 +710,39 @@ class PipelineService:
         course.status = CourseStatus.GENERATING.value
         db.commit()
         db.refresh(run)
-        run_id = run.id
+        return run
 
+    @staticmethod
+    def generate_graph(
+        db: Session, *, course_id: int, owner_id: int, force: bool
+    ) -> GenerationRun:
+        """Queue and run graph generation in the calling thread."""
+        run = PipelineService.enqueue_graph_generation(
+            db, course_id=course_id, owner_id=owner_id, force=force
+        )
+        if run.status != GenerationRunStatus.QUEUED.value:
+            return run
+        return PipelineService.execute_run(db, run, None)
+
+    @staticmethod
+    def _generate_graph(db: Session, run: GenerationRun) -> GenerationRun:
+        run_id, course_id, owner_id = run.id, run.course_id, run.owner_id
+        lease_owner = run.lease_owner
+        settings_snapshot = run.settings_snapshot
         started = time.perf_counter()
         try:
+            course = PipelineRepository.get_owned_course(db, course_id, owner_id)
+            if course is None:
+                raise LookupError("Курс удалён до начала генерации")
+            # The documents the run was queued with, as long as still indexed.
+            document_ids = {item["document_id"] for item in run.input_docs}
+            documents = [
+                document
+                for document in PipelineRepository.indexed_documents(
+                    db, course_id, owner_id
+                )
+                if document.id in document_ids
+            ]
             run.status = GenerationRunStatus.RUNNING.value
             db.commit()
 
@@ -400,11 +824,15 @@ class PipelineService:
                 "node_count": len(nodes),
                 "edge_count": len(edges),
             }
+            _check_lease(db, run_id, lease_owner)
             db.commit()
             db.refresh(run)
             return run
+        except RunLeaseLost:
+            raise
         except Exception as exc:
             db.rollback()
+            _check_lease(db, run_id, lease_owner)
             error = _safe_error(exc)
             failed_run = db.get(GenerationRun, run_id)
             failed_course = PipelineRepository.get_owned_course(
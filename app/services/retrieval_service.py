@@ -1,9 +1,97 @@
+import logging
+
 from fastapi import HTTPException
 from sqlalchemy.orm import Session
 
+from app.core.config import settings
 from app.repositories.retrieval import RetrievalRepository
-from app.schemas.retrieval import RetrievalCitation, RetrievalResponse
-from app.services.vector_store import VectorSearchFilters, VectorStore
+from app.schemas.retrieval import (
+    RetrievalBatchResponse,
+    RetrievalCitation,
+    RetrievalResponse,
+)
+from app.services.acl_cache import CourseAcl, CourseAclCache
+from app.services.lexical_index import LexicalIndex, LexicalMatch, LexicalRecord
+from app.services.vector_store import VectorMatch, VectorSearchFilters, VectorStore
+
+logger = logging.getLogger(__name__)
+
+# chunk_id, fused score, vector score, lexical score
+FusedCandidate = tuple[int, float, float | None, float | None]
+
+
+def _load_acl(
+    db: Session, course_id: int, owner_id: int, acl_cache: CourseAclCache | None
+) -> CourseAcl:
+    if acl_cache is not None:
+        return acl_cache.get(db, course_id, owner_id)
+    return CourseAcl.from_rows(
+        RetrievalRepository.accessible_chunk_ids(db, course_id, owner_id)
+    )
+
+
+def _sync_lexical_index(
+    db: Session,
+    lexical_index: LexicalIndex,
+    acl: CourseAcl,
+    *,
+    course_id: int,
+    owner_id: int,
+) -> None:
+    """Index accessible documents whose chunks this process has not seen yet.
+
+    The pipeline updates the index of the worker that ran it; other workers
+    and restarted processes load the text of the missing documents once.
+    Documents are compared by their chunk ids, not by version: an incremental
+    reindex or a new chunker setting keeps the version but replaces chunks.
+    """
+    missing = {
+        document_id: version
+        for document_id, version in acl.document_versions.items()
+        if lexical_index.document_chunk_ids(document_id)
+        != acl.document_chunk_ids.get(document_id)
+    }
+    records: dict[int, list[LexicalRecord]] = {}
+    for row in RetrievalRepository.document_chunk_texts(db, missing):
+        records.setdefault(row.document_id, []).append(
+            LexicalRecord(
+                chunk_id=row.id, owner_id=owner_id, course_id=course_id, text=row.text
+            )
+        )
+    for document_id, document_records in records.items():
+        lexical_index.replace_document(
+            document_id, missing[document_id], document_records
+        )
+
+
+def _fuse(
+    acl: CourseAcl,
+    matches: list[VectorMatch],
+    lexical_matches: list[LexicalMatch],
+    *,
+    retrievers: int,
+    limit: int,
+) -> list[FusedCandidate]:
+    # Reciprocal rank fusion. Every retriever contributes 1 / (k + rank),
+    # normalized so that first place in all of them scores 1.0.
+    rrf_k = settings.RETRIEVAL_RRF_K
+    fused: dict[int, list[float | None]] = {}
+    ranked_vector = [(match.metadata.get("chunk_id"), match.score) for match in matches]
+    ranked_lexical = [(match.chunk_id, match.score) for match in lexical_matches]
+    for slot, ranked in ((1, ranked_vector), (2, ranked_lexical)):
+        # Defense in depth: a backend must never widen DB-derived ACL.
+        # Near-duplicates count as their canonical chunk, at its best rank.
+        allowed: dict[int, float] = {}
+        for chunk_id, score in ranked:
+            if chunk_id in acl.chunk_ids:
+                canonical_id = acl.canonical_chunk_ids.get(chunk_id, chunk_id)
+                allowed.setdefault(canonical_id, score)
+        for rank, (chunk_id, score) in enumerate(allowed.items(), start=1):
+            entry = fused.setdefault(chunk_id, [0.0, None, None])
+            entry[0] += (rrf_k + 1) / (rrf_k + rank) / retrievers
+            entry[slot] = score
+    ranked_fused = sorted(fused.items(), key=lambda item: -item[1][0])[:limit]
+    return [(chunk_id, *scores) for chunk_id, scores in ranked_fused]
 
 
 class RetrievalService:
@@ -16,51 +104,126 @@ class RetrievalService:
         query: str,
         limit: int,
         vector_store: VectorStore,
+        ef_search: int | None = None,
+        lexical_index: LexicalIndex | None = None,
+        acl_cache: CourseAclCache | None = None,
     ) -> RetrievalResponse:
+        return RetrievalService.search_course_batch(
+            db,
+            course_id=course_id,
+            owner_id=owner_id,
+            queries=[query],
+            limit=limit,
+            vector_store=vector_store,
+            ef_search=ef_search,
+            lexical_index=lexical_index,
+            acl_cache=acl_cache,
+        ).results[0]
+
+    @staticmethod
+    def search_course_batch(
+        db: Session,
+        *,
+        course_id: int,
+        owner_id: int,
+        queries: list[str],
+        limit: int,
+        vector_store: VectorStore,
+        ef_search: int | None = None,
+        lexical_index: LexicalIndex | None = None,
+        acl_cache: CourseAclCache | None = None,
+    ) -> RetrievalBatchResponse:
+        """Answer several queries with one ACL load, encode and index scan."""
         if RetrievalRepository.get_owned_course(db, course_id, owner_id) is None:
             raise HTTPException(status_code=404, detail="Курс не найден")
 
-        chunks = RetrievalRepository.accessible_chunks(db, course_id, owner_id)
-        chunks_by_id = {chunk.id: chunk for chunk in chunks}
+        # Only chunk ids are needed to filter; text and citation fields are
+        # fetched for the final top-k below.
+        acl = _load_acl(db, course_id, owner_id, acl_cache)
+        filters = VectorSearchFilters(
+            owner_id=owner_id,
+            course_id=course_id,
+            allowed_chunk_ids=acl.chunk_ids,
+        )
         try:
-            matches = vector_store.search(
-                query,
-                VectorSearchFilters(
-                    owner_id=owner_id,
-                    course_id=course_id,
-                    allowed_chunk_ids=frozenset(chunks_by_id),
-                ),
-                limit,
+            vector_matches = vector_store.search_many(
+                queries,
+                filters,
+                max(limit, settings.RETRIEVAL_VECTOR_CANDIDATES),
+                ef_search=ef_search,
             )
         except RuntimeError as exc:
-            raise HTTPException(
-                status_code=503, detail="Семантический поиск временно недоступен"
-            ) from exc
-
-        citations = []
-        for match in matches:
-            chunk_id = match.metadata.get("chunk_id")
-            chunk = chunks_by_id.get(chunk_id)
-            if chunk is None:
-                # Defense in depth: a backend must never widen DB-derived ACL.
-                continue
-            document = chunk.document
-            citations.append(
-                RetrievalCitation(
-                    chunk_id=chunk.id,
-                    document_id=document.id,
-                    document_version=chunk.document_version,
-                    source_document=document.original_filename,
-                    source_type=document.source_type,
-                    page=chunk.page,
-                    section=chunk.section,
-                    text=chunk.text,
-                    score=match.score,
+            if lexical_index is None:
+                raise HTTPException(
+                    status_code=503, detail="Семантический поиск временно недоступен"
+                ) from exc
+            # Lexical retrieval still answers while the embedding model is down.
+            logger.warning("Vector retrieval unavailable, using BM25 only: %s", exc)
+            vector_matches = [[] for _ in queries]
+
+        lexical_matches: list[list[LexicalMatch]] = [[] for _ in queries]
+        if lexical_index is not None:
+            _sync_lexical_index(
+                db, lexical_index, acl, course_id=course_id, owner_id=owner_id
+            )
+            lexical_matches = [
+                lexical_index.search(
+                    query, filters, max(limit, settings.RETRIEVAL_LEXICAL_CANDIDATES)
                 )
+                for query in queries
+            ]
+
+        fused = [
+            _fuse(
+                acl,
+                query_matches,
+                query_lexical_matches,
+                retrievers=1 if lexical_index is None else 2,
+                limit=limit,
+            )
+            for query_matches, query_lexical_matches in zip(
+                vector_matches, lexical_matches, strict=True
+            )
+        ]
+        chunk_ids = list(
+            dict.fromkeys(
+                chunk_id for candidates in fused for chunk_id, *_ in candidates
             )
-            if len(citations) == limit:
-                break
+        )
+        rows = {
+            row.id: row
+            for row in RetrievalRepository.citation_chunks(
+                db, course_id, owner_id, chunk_ids
+            )
+        }
+        if acl_cache is not None and len(rows) < len(chunk_ids):
+            # The cached ACL granted chunks the database no longer serves.
+            acl_cache.invalidate(owner_id, course_id)
 
-        return RetrievalResponse(
-            query=query, course_id=course_id, citations=citations
+        return RetrievalBatchResponse(
+            course_id=course_id,
+            results=[
+                RetrievalResponse(
+                    query=query,
+                    course_id=course_id,
+                    citations=[
+                        RetrievalCitation(
+                            chunk_id=row.id,
+                            document_id=row.document_id,
+                            document_version=row.document_version,
+                            source_document=row.original_filename,
+                            source_type=row.source_type,
+                            page=row.page,
+                            section=row.section,
+                            text=row.text,
+                            score=min(score, 1.0),
+                            vector_score=vector_score,
+                            lexical_score=lexical_score,
+                        )
+                        for chunk_id, score, vector_score, lexical_score in candidates
+                        if (row := rows.get(chunk_id)) is not None
+                    ],
+                )
+                for query, candidates in zip(queries, fused, strict=True)
+            ],
         )
@@ -0,0 +1,106 @@
+from __future__ import annotations
+
+import time
+from collections import OrderedDict
+from collections.abc import Callable, Hashable
+from threading import Lock
+from typing import Any
+
+_MISSING = object()
+
+
+def normalize_query(query: str) -> str:
+    return " ".join(query.split())
+
+
+class LruCache:
+    """Bounded LRU cache with an optional TTL and hit/eviction counters."""
+
+    def __init__(
+        self,
+        max_entries: int,
+        ttl_seconds: float | None = None,
+        *,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._clock = clock
+        self._entries: OrderedDict[Hashable, tuple[float, Any]] = OrderedDict()
+        self._lock = Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            entry = self._entries.get(key, _MISSING)
+            if entry is _MISSING:
+                self.misses += 1
+                return default
+            stored_at, value = entry
+            if self.ttl_seconds is not None and self._clock() - stored_at > self.ttl_seconds:
+                del self._entries[key]
+                self.expirations += 1
+                self.misses += 1
+                return default
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key: Hashable, value: Any) -> None:
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (self._clock(), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def discard(self, key: Hashable) -> None:
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict[str, float | int]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+            }
+
+
+class SearchCache:
+    """Two-tier cache in front of vector search.
+
+    ``vectors`` maps (model, normalized query) to the query embedding.
+    ``results`` maps the search scope, the partition corpus version, the query
+    and the limit to the matches; the vector store bumps the corpus version on
+    every write, so stale results are never served.
+    """
+
+    def __init__(
+        self,
+        model_name: str,
+        *,
+        vector_entries: int = 2048,
+        result_entries: int = 1024,
+        result_ttl_seconds: float | None = 300,
+    ):
+        self.model_name = model_name
+        self.vectors = LruCache(vector_entries)
+        self.results = LruCache(result_entries, result_ttl_seconds)
+
+    def stats(self) -> dict[str, dict[str, float | int]]:
+        return {"query_vectors": self.vectors.stats(), "results": self.results.stats()}
@@ -0,0 +1,182 @@
+"""Rebuild the document vector store from indexed ``DocumentChunk`` rows.
+
+Chunks are streamed from the database in keyset-paginated pages, so memory
+stays bounded by one page plus the largest document however large the corpus
+is. Every page is bulk-loaded with one cache-aware encode call: after a
+restart with ``EMBEDDING_CACHE_PATH`` set, unchanged chunks never reach the
+model. Run it once for a persisted store, e.g. after its directory was lost:
+
+    python -m app.services.vector_rehydration --checkpoint rehydrate.json
+
+An interrupted run resumes from the checkpoint of the last loaded page.
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import logging
+import os
+import time
+from collections.abc import Callable
+from contextlib import AbstractContextManager
+from dataclasses import asdict, dataclass
+from pathlib import Path
+
+from sqlalchemy.orm import Session
+
+from app.repositories.retrieval import RetrievalRepository
+from app.services.vector_store import VectorStore
+
+logger = logging.getLogger(__name__)
+
+ChunkKey = tuple[int, int, int]
+
+
+@dataclass
+class RehydrationReport:
+    chunks: int = 0
+    documents: int = 0
+    # Already stored in the current version, not re-encoded.
+    skipped_documents: int = 0
+    pages: int = 0
+    seconds: float = 0.0
+    resumed_from: ChunkKey | None = None
+
+    @property
+    def chunks_per_second(self) -> float:
+        return self.chunks / self.seconds if self.seconds else 0.0
+
+
+def _row_key(row) -> ChunkKey:
+    return row.course_id, row.document_id, row.chunk_index
+
+
+def _read_checkpoint(path: Path, course_id: int | None) -> ChunkKey | None:
+    try:
+        state = json.loads(path.read_text())
+    except FileNotFoundError:
+        return None
+    if state.get("course_id") != course_id:
+        logger.warning("Checkpoint %s belongs to another scope, starting over", path)
+        return None
+    return tuple(state["after"])
+
+
+def _write_checkpoint(
+    path: Path, after: ChunkKey, course_id: int | None, report: RehydrationReport
+) -> None:
+    temporary = path.with_name(f".{path.name}.tmp")
+    temporary.write_text(
+        json.dumps(
+            {
+                "after": list(after),
+                "course_id": course_id,
+                "chunks": report.chunks,
+                "documents": report.documents,
+            }
+        )
+    )
+    os.replace(temporary, path)
+
+
+def rehydrate_vector_store(
+    session_factory: Callable[[], AbstractContextManager[Session]],
+    vector_store: VectorStore,
+    to_documents: Callable[[list], list],
+    *,
+    page_size: int = 500,
+    course_id: int | None = None,
+    checkpoint_path: str | Path | None = None,
+    skip_current: bool = True,
+    clock: Callable[[], float] = time.perf_counter,
+) -> RehydrationReport:
+    """Load every indexed chunk (of ``course_id``) into ``vector_store``.
+
+    ``to_documents`` turns chunk rows into ``PartitionDocuments``. Rows of the
+    last document of a page are held back until the document is complete,
+    because the store replaces documents as a whole. With ``skip_current``
+    documents the store already holds with the same chunks and texts are
+    skipped; a document reindexed in place, whose version did not change, is
+    loaded again.
+    """
+    checkpoint = Path(checkpoint_path) if checkpoint_path is not None else None
+    after = _read_checkpoint(checkpoint, course_id) if checkpoint else None
+    report = RehydrationReport(resumed_from=after)
+    started = clock()
+    pending: list = []
+    while True:
+        # A short session per page: no snapshot is held for the whole run.
+        with session_factory() as db:
+            page = RetrievalRepository.indexed_chunk_page(
+                db, after, page_size, course_id=course_id
+            )
+        last_page = len(page) < page_size
+        if page:
+            after = _row_key(page[-1])
+        rows = pending + page
+        pending = []
+        if not last_page:
+            tail = rows[-1].document_id
+            split = len(rows)
+            while split and rows[split - 1].document_id == tail:
+                split -= 1
+            rows, pending = rows[:split], rows[split:]
+        if rows:
+            documents = to_documents(rows)
+            written = vector_store.replace_documents(
+                documents, skip_current=skip_current
+            )
+            report.pages += 1
+            report.documents += written
+            report.skipped_documents += len(documents) - written
+            report.chunks += len(rows)
+            report.seconds = clock() - started
+            if checkpoint is not None:
+                _write_checkpoint(checkpoint, _row_key(rows[-1]), course_id, report)
+            logger.info(
+                "Vector rehydration: %s chunks, %s documents loaded, %s current, "
+                "%.1f chunks/s",
+                report.chunks,
+                report.documents,
+                report.skipped_documents,
+                report.chunks_per_second,
+            )
+        if last_page:
+            break
+    report.seconds = clock() - started
+    if checkpoint is not None:
+        checkpoint.unlink(missing_ok=True)
+    return report
+
+
+def main() -> None:
+    from app.database.db import SessionLocal
+    from app.services.embedding_service import chunk_documents, versioned_vector_store
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--course-id", type=int)
+    parser.add_argument("--page-size", type=int, default=500)
+    parser.add_argument("--checkpoint", type=Path)
+    parser.add_argument(
+        "--force",
+        action="store_true",
+        help="re-encode documents that are already stored with the same chunks",
+    )
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(message)s")
+
+    report = rehydrate_vector_store(
+        SessionLocal,
+        versioned_vector_store,
+        chunk_documents,
+        page_size=args.page_size,
+        course_id=args.course_id,
+        checkpoint_path=args.checkpoint,
+        skip_current=not args.force,
+    )
+    print(json.dumps({**asdict(report), "chunks_per_second": report.chunks_per_second}))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,13 +1,37 @@
 from __future__ import annotations
 
-from collections.abc import Callable
+import copy
+import hashlib
+import json
+import logging
+import os
+import shutil
+import tempfile
+import time
+from collections import OrderedDict
+from collections.abc import Callable, Iterable, Iterator, Mapping
+from contextlib import contextmanager
 from dataclasses import dataclass
-from threading import RLock
+from itertools import islice
+from pathlib import Path
+from threading import Event, RLock, Thread
 from typing import Any, Protocol
 
 import faiss
 import numpy as np
 
+from app.services.embedding_cache import EmbeddingCache
+from app.services.search_cache import SearchCache, normalize_query
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - Windows
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+PartitionKey = tuple[int, int]
+
 
 @dataclass(frozen=True)
 class VectorRecord:
@@ -19,132 +43,2048 @@ class VectorRecord:
 @dataclass(frozen=True)
 class VectorSearchFilters:
     owner_id: int
-    course_id: int
-    allowed_chunk_ids: frozenset[int]
+    # None searches every course of the owner; only stores that partition by
+    # owner support it.
+    course_id: int | None
+    # None searches the whole owner/course partition.
+    allowed_chunk_ids: frozenset[int] | None
 
 
 @dataclass(frozen=True)
 class VectorMatch:
+    # The store keeps no texts; callers read them from the database.
     embedding_id: str
-    text: str
     score: float
     metadata: dict[str, Any]
 
 
 class VectorStore(Protocol):
     def replace_document(
-        self, document_id: int, document_version: int, records: list[VectorRecord]
+        self,
+        document_id: int,
+        document_version: int,
+        records: Iterable[VectorRecord],
+        *,
+        vector_source: int | None = None,
     ) -> list[str]: ...
 
+    def replace_documents(
+        self, documents: PartitionDocuments, *, skip_current: bool = False
+    ) -> int: ...
+
     def delete_document(self, document_id: int) -> None: ...
 
     def search(
-        self, query: str, filters: VectorSearchFilters, limit: int
+        self,
+        query: str,
+        filters: VectorSearchFilters,
+        limit: int,
+        *,
+        ef_search: int | None = None,
     ) -> list[VectorMatch]: ...
 
+    def search_many(
+        self,
+        queries: list[str],
+        filters: VectorSearchFilters,
+        limit: int,
+        *,
+        ef_search: int | None = None,
+    ) -> list[list[VectorMatch]]: ...
+
+
+_COLUMNS = ("document_id", "document_version", "chunk_id", "owner_id", "course_id")
+# Course id in the key of a partition holding all courses of an owner.
+ALL_COURSES = 0
+# Null of the integer metadata columns; string columns use code -1.
+_NULL = np.iinfo(np.int64).min
+
+# Documents of a partition rebuilt from the database:
+# (document_id, document_version, records).
+PartitionDocuments = list[tuple[int, int, list[VectorRecord]]]
+
+
+def _text_hash(text: str) -> int:
+    """64-bit key under which the vector of a chunk text is reused."""
+    digest = hashlib.blake2b(text.encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "little", signed=True)
+
+
+class _StringColumn:
+    """UTF-8 strings packed into one buffer and addressed by end offsets."""
+
+    def __init__(self, data: bytes = b"", ends: np.ndarray | None = None):
+        self.data = bytearray(data)
+        self.ends = np.array([] if ends is None else ends, dtype=np.int64)
+        self.count = len(self.ends)
+
+    def __len__(self) -> int:
+        return self.count
+
+    def __getitem__(self, row: int) -> str:
+        start = int(self.ends[row - 1]) if row else 0
+        return self.data[start : int(self.ends[row])].decode("utf-8")
+
+    @property
+    def nbytes(self) -> int:
+        return len(self.data) + self.ends.nbytes
+
+    def _reserve(self, needed: int) -> None:
+        if needed > len(self.ends):
+            grown = np.empty(max(needed, len(self.ends) * 2, 64), dtype=np.int64)
+            grown[: self.count] = self.ends[: self.count]
+            self.ends = grown
+
+    def extend(self, values: Iterable[str]) -> None:
+        encoded = [value.encode("utf-8") for value in values]
+        needed = self.count + len(encoded)
+        self._reserve(needed)
+        self.ends[self.count : needed] = len(self.data) + np.cumsum(
+            [len(value) for value in encoded], dtype=np.int64
+        )
+        self.data += b"".join(encoded)
+        self.count = needed
+
+    def append(self, other: _StringColumn) -> None:
+        needed = self.count + other.count
+        self._reserve(needed)
+        self.ends[self.count : needed] = len(self.data) + other.ends[: other.count]
+        self.data += other.data
+        self.count = needed
+
+    def take(self, rows: np.ndarray) -> _StringColumn:
+        ends = self.ends[: self.count]
+        starts = np.concatenate(([0], ends[:-1]))[rows]
+        lengths = ends[rows] - starts
+        taken_ends = np.cumsum(lengths, dtype=np.int64)
+        # Byte positions of the kept strings, gathered without decoding them.
+        positions = np.repeat(starts - (taken_ends - lengths), lengths) + np.arange(
+            int(taken_ends[-1]) if len(rows) else 0
+        )
+        data = np.frombuffer(self.data, dtype=np.uint8)[positions]
+        return _StringColumn(data.tobytes(), taken_ends)
+
+    def arrays(self) -> tuple[np.ndarray, np.ndarray]:
+        return np.frombuffer(bytes(self.data), dtype=np.uint8), self.ends[: self.count]
+
+
+@dataclass(frozen=True)
+class HnswConfig:
+    """Approximate search for large course partitions.
+
+    A partition switches from exact flat search to an HNSW graph once it holds
+    ``min_rows`` live vectors. Searches whose ACL mask keeps fewer than
+    ``exact_max_rows`` rows or less than ``min_selectivity`` of the partition
+    stay exact, because filtered graph traversal loses recall there.
+    """
+
+    min_rows: int = 50_000
+    m: int = 32
+    ef_construction: int = 80
+    ef_search: int = 64
+    exact_max_rows: int = 2_048
+    min_selectivity: float = 0.25
+
+
+@dataclass(frozen=True)
+class CodecConfig:
+    """Compressed vector storage for course partitions.
+
+    ``codec`` is one of ``flat`` (float32), ``fp16``, ``sq8`` (8-bit scalar
+    quantization) or ``pq`` (product quantization, one byte per
+    sub-quantizer). The trained codecs ``sq8`` and ``pq`` are used once a
+    partition holds ``train_min_rows`` live vectors; smaller partitions stay
+    float32. With ``rescore`` the float32 vectors are kept next to the index
+    (memory-mapped when the store is persisted) and the top
+    ``limit * rescore_factor`` candidates are re-ranked by exact distance.
+    """
+
+    codec: str = "flat"
+    train_min_rows: int = 10_000
+    train_max_rows: int = 65_536
+    pq_subquantizers: int = 96
+    rescore: bool = False
+    rescore_factor: int = 4
+
+
+_SCALAR_QUANTIZERS = {
+    "fp16": faiss.ScalarQuantizer.QT_fp16,
+    "sq8": faiss.ScalarQuantizer.QT_8bit,
+}
+
+
+def _index_layout(index: faiss.Index) -> tuple[bool, str]:
+    approximate = isinstance(index, faiss.IndexHNSW)
+    storage = faiss.downcast_index(index.storage) if approximate else index
+    if isinstance(storage, faiss.IndexPQ):
+        return approximate, "pq"
+    if isinstance(storage, faiss.IndexScalarQuantizer):
+        for codec, qtype in _SCALAR_QUANTIZERS.items():
+            if storage.sq.qtype == qtype:
+                return approximate, codec
+    return approximate, "flat"
+
+
+class _Segment:
+    """Columnar vector storage of a run of rows of one partition.
+
+    Vectors live in one contiguous matrix owned by a FAISS index and row
+    metadata lives in arrays aligned with it: integer fields in int64
+    columns, string fields as codes into a table of distinct values and
+    embedding ids in one packed buffer, so a row costs no Python objects.
+    Chunk texts are not kept at all; a 64-bit hash of each text is enough to
+    reuse its vector, and callers read the texts of their hits from the
+    database. ``record`` builds a row on demand. Deleting a document
+    only tombstones its rows, so reindexing one document never copies the rest
+    of the course; an unpersisted segment is compacted once tombstones
+    dominate. The ACL filter runs as a bitmap id-selector over the rows.
+
+    With ``ann`` set, large segments are served by an HNSW graph whose
+    storage is the same matrix, so the vectors are not duplicated. With
+    ``codec`` set, the matrix is stored compressed.
+
+    A persisted segment (``name`` set) is immutable on disk; only its
+    ``alive`` mask changes, as tombstones of later generations arrive.
+    """
+
+    compaction_min_rows = 1024
+    compaction_ratio = 0.5
+
+    def __init__(
+        self,
+        index: faiss.Index | None = None,
+        *,
+        read_only: bool = False,
+        ann: HnswConfig | None = None,
+        codec: CodecConfig | None = None,
+        exact: np.ndarray | None = None,
+        name: str | None = None,
+        baked: int | None = None,
+    ):
+        # Directory of the segment within its partition, once persisted.
+        self.name = name
+        # Tombstones of generations up to ``baked`` are part of the stored
+        # mask; up to ``applied`` they are part of the in-memory one.
+        self.baked = baked
+        self.applied = baked or 0
+        # Files written by a background merge, published under the lock.
+        self.staged: Path | None = None
+        self.index = index
+        self.ann = ann
+        self.codec = codec
+        self._rows = 0
+        # Integer metadata fields, ``_NULL`` where a row has none.
+        self.columns = {name: np.full(0, _NULL, dtype=np.int64) for name in _COLUMNS}
+        # String metadata fields as codes into ``strings``, -1 for null.
+        self.codes: dict[str, np.ndarray] = {}
+        self.strings: list[str] = []
+        self._string_codes: dict[str, int] = {}
+        self.embedding_ids = _StringColumn()
+        self.text_hashes = np.empty(0, dtype=np.int64)
+        self.alive = np.empty(0, dtype=bool)
+        self.live_rows = 0
+        # Memory-mapped indexes are copied into memory before the first write.
+        self.read_only = read_only
+        # Float32 copy of the rows used for re-scoring, with spare capacity.
+        self._exact = exact
+
+    def __len__(self) -> int:
+        return self.live_rows
+
+    @property
+    def row_count(self) -> int:
+        return self._rows
+
+    @property
+    def sparse(self) -> bool:
+        """Whether tombstoned rows dominate and the segment should be rewritten."""
+        dead_rows = self.row_count - self.live_rows
+        return (
+            dead_rows >= self.compaction_min_rows
+            and dead_rows >= self.row_count * self.compaction_ratio
+        )
+
+    @property
+    def is_approximate(self) -> bool:
+        return isinstance(self.index, faiss.IndexHNSW)
+
+    @property
+    def storage(self) -> faiss.Index:
+        if self.is_approximate:
+            return faiss.downcast_index(self.index.storage)
+        return self.index
+
+    @property
+    def rescores(self) -> bool:
+        return (
+            self.codec is not None
+            and self.codec.rescore
+            and self._exact is not None
+            and _index_layout(self.index)[1] != "flat"
+        )
+
+    def exact_vectors(self) -> np.ndarray | None:
+        """Float32 rows kept for re-scoring, tombstoned rows included."""
+        if self._exact is None:
+            return None
+        return self._exact[: self.row_count]
+
+    def attach_exact(self, vectors: np.ndarray) -> None:
+        if len(vectors) != self.row_count:
+            raise RuntimeError("Exact vectors do not match the partition rows")
+        self._exact = vectors
+
+    def vectors(self) -> np.ndarray:
+        """Float32 partition matrix, tombstoned rows included.
+
+        A zero-copy view for float32 storage, decoded rows otherwise.
+        """
+        if self.index is None:
+            return np.empty((0, 0), dtype=np.float32)
+        exact = self.exact_vectors()
+        if exact is not None:
+            return exact
+        storage = self.storage
+        if not isinstance(storage, faiss.IndexFlat):
+            return storage.reconstruct_n(0, storage.ntotal)
+        size = storage.ntotal * storage.d
+        return faiss.rev_swig_ptr(storage.get_xb(), size).reshape(
+            storage.ntotal, storage.d
+        )
+
+    def _layout(self, rows: int) -> tuple[bool, str]:
+        approximate = self.ann is not None and rows >= self.ann.min_rows
+        codec = "flat"
+        if self.codec is not None and (
+            self.codec.codec not in ("sq8", "pq") or rows >= self.codec.train_min_rows
+        ):
+            codec = self.codec.codec
+        return approximate, codec
+
+    def _new_index(self, vectors: np.ndarray) -> faiss.Index:
+        """Build, train and fill an index in the layout for ``vectors``."""
+        dimension = vectors.shape[1]
+        approximate, codec = self._layout(len(vectors))
+        if codec == "pq" and dimension % self.codec.pq_subquantizers:
+            raise RuntimeError("PQ sub-quantizers must divide the embedding dimension")
+        if approximate:
+            if codec == "pq":
+                index = faiss.IndexHNSWPQ(
+                    dimension, self.codec.pq_subquantizers, self.ann.m, 8
+                )
+            elif codec in _SCALAR_QUANTIZERS:
+                index = faiss.IndexHNSWSQ(
+                    dimension, _SCALAR_QUANTIZERS[codec], self.ann.m
+                )
+            else:
+                index = faiss.IndexHNSWFlat(dimension, self.ann.m)
+            index.hnsw.efConstruction = self.ann.ef_construction
+        elif codec == "pq":
+            index = faiss.IndexPQ(dimension, self.codec.pq_subquantizers, 8)
+        elif codec in _SCALAR_QUANTIZERS:
+            index = faiss.IndexScalarQuantizer(dimension, _SCALAR_QUANTIZERS[codec])
+        else:
+            index = faiss.IndexFlatL2(dimension)
+        if not index.is_trained:
+            sample = vectors
+            if len(sample) > self.codec.train_max_rows:
+                rows = np.random.default_rng(0).choice(
+                    len(sample), self.codec.train_max_rows, replace=False
+                )
+                sample = sample[np.sort(rows)]
+            index.train(np.ascontiguousarray(sample))
+        if len(vectors):
+            index.add(vectors)
+        return index
+
+    def _reserve(self, rows: int) -> None:
+        capacity = len(self.alive)
+        if rows <= capacity:
+            return
+        capacity = max(rows, capacity * 2, 64)
+        used = self.row_count
+
+        def grow(column: np.ndarray, null: int) -> np.ndarray:
+            grown = np.full(capacity, null, dtype=column.dtype)
+            grown[:used] = column[:used]
+            return grown
+
+        self.columns = {name: grow(column, _NULL) for name, column in self.columns.items()}
+        self.codes = {name: grow(codes, -1) for name, codes in self.codes.items()}
+        self.text_hashes = grow(self.text_hashes, 0)
+        self.alive = grow(self.alive, False)
+
+    def trim(self) -> None:
+        """Release the spare capacity kept for appended rows."""
+        used = self.row_count
+        self.columns = {name: column[:used].copy() for name, column in self.columns.items()}
+        self.codes = {name: codes[:used].copy() for name, codes in self.codes.items()}
+        self.text_hashes = self.text_hashes[:used].copy()
+        self.alive = self.alive[:used].copy()
+        self.embedding_ids = _StringColumn(*self.embedding_ids.arrays())
+
+    def _column(self, name: str, value: Any) -> np.ndarray:
+        if isinstance(value, str):
+            columns, other, dtype, null = self.codes, self.columns, np.int32, -1
+        elif isinstance(value, int) and not isinstance(value, bool):
+            columns, other, dtype, null = self.columns, self.codes, np.int64, _NULL
+        else:
+            raise TypeError(f"Metadata field {name!r} must be an int, a str or None")
+        if name in other:
+            raise TypeError(f"Metadata field {name!r} mixes ints and strings")
+        column = columns.get(name)
+        if column is None:
+            column = columns[name] = np.full(len(self.alive), null, dtype=dtype)
+        return column
+
+    def _string_code(self, value: str) -> int:
+        code = self._string_codes.get(value)
+        if code is None:
+            code = self._string_codes[value] = len(self.strings)
+            self.strings.append(value)
+        return code
+
+    def _append_rows(self, records: list[VectorRecord]) -> None:
+        start = self.row_count
+        self._reserve(start + len(records))
+        for row, record in enumerate(records, start=start):
+            for name, value in record.metadata.items():
+                if value is None:
+                    continue
+                column = self._column(name, value)
+                column[row] = self._string_code(value) if isinstance(value, str) else value
+            self.text_hashes[row] = _text_hash(record.text)
+            self.alive[row] = True
+            self.live_rows += 1
+        self.embedding_ids.extend(record.embedding_id for record in records)
+        self._rows += len(records)
+
+    def record(self, row: int) -> VectorRecord | None:
+        """Row ``row`` as a record; its text is not stored and left empty."""
+        if not self.alive[row]:
+            return None
+        metadata: dict[str, Any] = {}
+        for name, column in self.columns.items():
+            value = int(column[row])
+            if value != _NULL:
+                metadata[name] = value
+        for name, codes in self.codes.items():
+            code = int(codes[row])
+            if code >= 0:
+                metadata[name] = self.strings[code]
+        return VectorRecord(self.embedding_ids[row], "", metadata)
+
+    def row_arrays(self) -> dict[str, np.ndarray]:
+        """Row metadata as named arrays, tombstoned rows included."""
+        used = self.row_count
+        embedding_data, embedding_ends = self.embedding_ids.arrays()
+        strings = _StringColumn()
+        strings.extend(self.strings)
+        string_data, string_ends = strings.arrays()
+        arrays = {
+            "alive": self.alive[:used],
+            "text_hash": self.text_hashes[:used],
+            "embedding_id_data": embedding_data,
+            "embedding_id_ends": embedding_ends,
+            "string_data": string_data,
+            "string_ends": string_ends,
+        }
+        arrays.update(
+            (f"int.{name}", column[:used]) for name, column in self.columns.items()
+        )
+        arrays.update((f"str.{name}", codes[:used]) for name, codes in self.codes.items())
+        return arrays
+
+    def attach_rows(self, arrays: Mapping[str, np.ndarray]) -> None:
+        """Install rows written by ``row_arrays`` into an empty partition."""
+        if self.row_count:
+            raise RuntimeError("Rows can only be attached to an empty partition")
+        self.alive = np.array(arrays["alive"], dtype=bool)
+        self.text_hashes = np.array(arrays["text_hash"], dtype=np.int64)
+        self.embedding_ids = _StringColumn(
+            arrays["embedding_id_data"].tobytes(), arrays["embedding_id_ends"]
+        )
+        strings = _StringColumn(arrays["string_data"].tobytes(), arrays["string_ends"])
+        self.strings = [strings[code] for code in range(len(strings))]
+        self._string_codes = {value: code for code, value in enumerate(self.strings)}
+        self.columns = {name: np.full(0, _NULL, dtype=np.int64) for name in _COLUMNS}
+        self.codes = {}
+        for key, array in arrays.items():
+            if key.startswith("int."):
+                self.columns[key.removeprefix("int.")] = np.array(array, dtype=np.int64)
+            elif key.startswith("str."):
+                self.codes[key.removeprefix("str.")] = np.array(array, dtype=np.int32)
+        self._rows = len(self.alive)
+        for name in _COLUMNS:
+            if len(self.columns[name]) != self._rows:
+                self.columns[name] = np.full(self._rows, _NULL, dtype=np.int64)
+        self.live_rows = int(np.count_nonzero(self.alive))
+
+    def _writable_index(self, dimension: int) -> faiss.Index:
+        if self.index is None:
+            self.index = self._new_index(np.empty((0, dimension), dtype=np.float32))
+        elif self.read_only:
+            self.index = faiss.clone_index(self.index)
+        self.read_only = False
+        if self.index.d != dimension:
+            raise RuntimeError("Embedding dimensions do not match")
+        return self.index
+
+    def _append_exact(self, vectors: np.ndarray) -> None:
+        if self.codec is None or not self.codec.rescore:
+            return
+        used = self.row_count
+        if self._exact is None and used:
+            # Rows stored without their float32 copy cannot be re-scored.
+            return
+        needed = used + len(vectors)
+        exact = self._exact
+        if exact is None or needed > len(exact) or not exact.flags.writeable:
+            capacity = needed if exact is None else max(needed, len(exact) * 2)
+            grown = np.empty((max(capacity, 64), vectors.shape[1]), dtype=np.float32)
+            if used:
+                grown[:used] = exact[:used]
+            self._exact = exact = grown
+        exact[used:needed] = vectors
+
+    def add(self, records: list[VectorRecord], vectors: np.ndarray) -> None:
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        self._writable_index(vectors.shape[1]).add(vectors)
+        self._append_exact(vectors)
+        self._append_rows(records)
+        if self._layout(self.live_rows) != self._layout(self.live_rows - len(records)):
+            # The partition crossed an HNSW or codec training threshold;
+            # compaction rebuilds the index in the new layout.
+            self.compact()
+
+    def remove_document(self, document_id: int) -> bool:
+        used = self.row_count
+        rows = np.flatnonzero(
+            self.alive[:used] & (self.columns["document_id"][:used] == document_id)
+        )
+        if not len(rows):
+            return False
+        self.alive[rows] = False
+        self.live_rows -= len(rows)
+        # Persisted segments are rewritten by background merges instead.
+        if self.name is None and self.sparse:
+            self.compact()
+        return True
+
+    def remove_documents(self, document_ids: np.ndarray) -> None:
+        """Apply a tombstone file: kill every row of ``document_ids``."""
+        used = self.row_count
+        self.alive[:used] &= ~np.isin(self.columns["document_id"][:used], document_ids)
+        self.live_rows = int(np.count_nonzero(self.alive[:used]))
+
+    def detached(self) -> _Segment:
+        """A copy sharing the stored rows, with an ``alive`` mask of its own."""
+        segment = copy.copy(self)
+        segment.alive = self.alive.copy()
+        return segment
+
+    def document_vectors(self, document_id: int) -> dict[int, np.ndarray]:
+        """Float32 vectors of the live rows of a document, by text hash.
+
+        Empty when the partition keeps lossy codes only: re-adding decoded
+        vectors would drift from the ones the model returns.
+        """
+        if self.index is None or (
+            self.exact_vectors() is None
+            and not isinstance(self.storage, faiss.IndexFlat)
+        ):
+            return {}
+        used = self.row_count
+        rows = np.flatnonzero(
+            self.alive[:used] & (self.columns["document_id"][:used] == document_id)
+        )
+        if not len(rows):
+            return {}
+        vectors = np.array(self.vectors()[rows], dtype=np.float32)
+        return dict(zip(self.text_hashes[rows].tolist(), vectors, strict=True))
+
+    def document_version(self, document_id: int) -> int | None:
+        used = self.row_count
+        rows = np.flatnonzero(
+            self.alive[:used] & (self.columns["document_id"][:used] == document_id)
+        )
+        if not len(rows):
+            return None
+        return int(self.columns["document_version"][rows].max())
+
+    def document_content(self, document_id: int) -> set[tuple[int, int]]:
+        """(chunk id, text hash) of every live row of a document."""
+        used = self.row_count
+        rows = np.flatnonzero(
+            self.alive[:used] & (self.columns["document_id"][:used] == document_id)
+        )
+        return set(
+            zip(
+                self.columns["chunk_id"][rows].tolist(),
+                self.text_hashes[rows].tolist(),
+                strict=True,
+            )
+        )
+
+    @classmethod
+    def merged(
+        cls,
+        parts: list[tuple[_Segment, np.ndarray]],
+        *,
+        ann: HnswConfig | None,
+        codec: CodecConfig | None,
+    ) -> _Segment:
+        """One unpersisted segment with the rows of ``parts`` alive in their masks."""
+        segment = cls(ann=ann, codec=codec)
+        vectors = []
+        for source, alive in parts:
+            rows = np.flatnonzero(alive)
+            if len(rows):
+                vectors.append(np.asarray(source.vectors()[rows], dtype=np.float32))
+                segment._append_rows_of(source, rows)
+        if vectors:
+            matrix = np.ascontiguousarray(np.vstack(vectors))
+            segment.index = segment._new_index(matrix)
+            if all(source.exact_vectors() is not None for source, _ in parts):
+                segment._exact = matrix
+        return segment
+
+    def _append_rows_of(self, source: _Segment, rows: np.ndarray) -> None:
+        start = self.row_count
+        stop = start + len(rows)
+        self._reserve(stop)
+        for name, column in source.columns.items():
+            self._column(name, 0)[start:stop] = column[rows]
+        # Only values still referenced enter the string table.
+        for name, codes in source.codes.items():
+            taken = codes[rows]
+            used = np.unique(taken[taken >= 0])
+            # The extra last slot maps the null code -1 to itself.
+            remap = np.full(len(source.strings) + 1, -1, dtype=np.int32)
+            remap[used] = [self._string_code(source.strings[code]) for code in used.tolist()]
+            self._column(name, "")[start:stop] = remap[taken]
+        self.embedding_ids.append(source.embedding_ids.take(rows))
+        self.text_hashes[start:stop] = source.text_hashes[rows]
+        self.alive[start:stop] = True
+        self.live_rows += len(rows)
+        self._rows = stop
+
+    def compact(self) -> None:
+        compacted = _Segment.merged(
+            [(self, self.alive[: self.row_count])], ann=self.ann, codec=self.codec
+        )
+        if self._exact is None:
+            compacted._exact = None
+        vars(self).update(vars(compacted))
+
+    def resident_bytes(self) -> int:
+        """Approximate memory held by the segment, mapped files included."""
+        total = self.alive.nbytes + self.text_hashes.nbytes + self.embedding_ids.nbytes
+        total += sum(column.nbytes for column in self.columns.values())
+        total += sum(codes.nbytes for codes in self.codes.values())
+        total += sum(len(value) for value in self.strings)
+        if self._exact is not None:
+            total += self._exact.nbytes
+        if self.index is not None:
+            storage = self.storage
+            total += storage.ntotal * storage.code_size
+            if self.is_approximate:
+                hnsw = self.index.hnsw
+                total += 4 * (hnsw.neighbors.size() + hnsw.levels.size())
+                total += 8 * hnsw.offsets.size()
+        return total
+
+    def allowed_rows(
+        self, chunk_ids: frozenset[int] | None, course_id: int | None = None
+    ) -> np.ndarray:
+        used = self.row_count
+        mask = self.alive[:used].copy()
+        if course_id is not None:
+            mask &= self.columns["course_id"][:used] == course_id
+        if chunk_ids is not None:
+            allowed = np.fromiter(chunk_ids, dtype=np.int64, count=len(chunk_ids))
+            mask &= np.isin(self.columns["chunk_id"][:used], allowed)
+        return mask
+
+    def search(
+        self,
+        query_vector: np.ndarray,
+        mask: np.ndarray,
+        limit: int,
+        *,
+        ef_search: int | None = None,
+    ) -> list[tuple[float, VectorRecord]]:
+        return self.search_many(query_vector, mask, limit, ef_search=ef_search)[0]
+
+    def search_many(
+        self,
+        query_vectors: np.ndarray,
+        mask: np.ndarray,
+        limit: int,
+        *,
+        ef_search: int | None = None,
+    ) -> list[list[tuple[float, VectorRecord]]]:
+        """Search every row of ``query_vectors`` with one FAISS call."""
+        if query_vectors.ndim != 2 or query_vectors.shape[1] != self.index.d:
+            raise RuntimeError("Embedding dimensions do not match")
+        query_vectors = np.ascontiguousarray(query_vectors, dtype=np.float32)
+        allowed = int(np.count_nonzero(mask))
+        limit = min(limit, allowed)
+        rescores = self.rescores
+        candidates = limit
+        if rescores:
+            candidates = min(limit * self.codec.rescore_factor, allowed)
+        bitmap = np.packbits(mask, bitorder="little")
+        selector = faiss.IDSelectorBitmap(len(mask), faiss.swig_ptr(bitmap))
+        if (
+            self.is_approximate
+            and allowed > self.ann.exact_max_rows
+            and allowed >= self.row_count * self.ann.min_selectivity
+        ):
+            params = faiss.SearchParametersHNSW(
+                sel=selector, efSearch=max(ef_search or self.ann.ef_search, candidates)
+            )
+            distances, rows = self.index.search(
+                query_vectors, candidates, params=params
+            )
+        elif isinstance(self.storage, faiss.IndexPQ):
+            distances, rows = self._search_pq(query_vectors, mask, candidates)
+        else:
+            params = faiss.SearchParameters(sel=selector)
+            distances, rows = self.storage.search(
+                query_vectors, candidates, params=params
+            )
+
+        results = []
+        for query_vector, query_distances, query_rows in zip(
+            query_vectors, distances, rows, strict=True
+        ):
+            if rescores:
+                query_rows = query_rows[query_rows >= 0]
+                # Fancy indexing reads only the candidate rows of a memory map.
+                query_distances = np.square(
+                    self._exact[query_rows] - query_vector
+                ).sum(axis=1)
+                order = np.argsort(query_distances, kind="stable")[:limit]
+                query_distances, query_rows = query_distances[order], query_rows[order]
+            results.append(
+                [
+                    (float(distance), self.record(int(row)))
+                    for distance, row in zip(query_distances, query_rows, strict=True)
+                    if row >= 0 and self.alive[row]
+                ]
+            )
+        return results
+
+    def _search_pq(
+        self, query_vectors: np.ndarray, mask: np.ndarray, limit: int
+    ) -> tuple[np.ndarray, np.ndarray]:
+        # Flat PQ search has no id-selector support, so the asymmetric
+        # distances of the allowed rows are summed from the lookup table.
+        storage = self.storage
+        if mask.all():
+            return storage.search(query_vectors, limit)
+        pq = storage.pq
+        rows = np.flatnonzero(mask)
+        codes = faiss.rev_swig_ptr(
+            storage.codes.data(), storage.ntotal * storage.code_size
+        ).reshape(storage.ntotal, storage.code_size)[rows]
+        table = np.empty((pq.M, pq.ksub), dtype=np.float32)
+        distances = np.empty((len(query_vectors), limit), dtype=np.float32)
+        labels = np.empty((len(query_vectors), limit), dtype=np.int64)
+        for position, query in enumerate(query_vectors):
+            pq.compute_distance_table(faiss.swig_ptr(query), faiss.swig_ptr(table))
+            scores = table[np.arange(pq.M), codes].sum(axis=1)
+            top = np.argpartition(scores, limit - 1)[:limit]
+            top = top[np.argsort(scores[top], kind="stable")]
+            distances[position], labels[position] = scores[top], rows[top]
+        return distances, labels
+
+
+class _Partition:
+    """Vector storage of one (owner_id, course_id) scope as a list of segments.
+
+    An in-memory store appends to one segment. A persisted store adds a
+    segment per write and tombstones the rows of removed documents in the
+    older ones, so a write costs as much as its own rows; background merges
+    keep the number of segments small. Rows are numbered across segments in
+    order, which is how ACL masks and ``record`` address them.
+    """
+
+    def __init__(
+        self, *, ann: HnswConfig | None = None, codec: CodecConfig | None = None
+    ):
+        self.ann = ann
+        self.codec = codec
+        self.segments: list[_Segment] = []
+        # Documents tombstoned in persisted segments since the last write.
+        self.removed: set[int] = set()
+        # Document ids of every tombstone file still listed in the manifest.
+        self.tombstones: dict[int, np.ndarray] = {}
+
+    def __len__(self) -> int:
+        return sum(len(segment) for segment in self.segments)
+
+    @property
+    def row_count(self) -> int:
+        return sum(segment.row_count for segment in self.segments)
+
+    def _starts(self) -> list[int]:
+        starts, start = [], 0
+        for segment in self.segments:
+            starts.append(start)
+            start += segment.row_count
+        return starts
+
+    def add(self, records: list[VectorRecord], vectors: np.ndarray) -> None:
+        # Persisted segments never change on disk; writes go to a new one.
+        if not self.segments or self.segments[-1].name is not None:
+            self.segments.append(_Segment(ann=self.ann, codec=self.codec))
+        self.segments[-1].add(records, vectors)
+
+    def remove_document(self, document_id: int) -> bool:
+        removed = False
+        for segment in self.segments:
+            if segment.remove_document(document_id):
+                removed = True
+                if segment.name is not None:
+                    self.removed.add(document_id)
+        return removed
+
+    def document_vectors(self, document_id: int) -> dict[int, np.ndarray]:
+        vectors: dict[int, np.ndarray] = {}
+        for segment in self.segments:
+            vectors.update(segment.document_vectors(document_id))
+        return vectors
+
+    def document_version(self, document_id: int) -> int | None:
+        versions = [
+            version
+            for segment in self.segments
+            if (version := segment.document_version(document_id)) is not None
+        ]
+        return max(versions, default=None)
+
+    def document_content(self, document_id: int) -> set[tuple[int, int]]:
+        content: set[tuple[int, int]] = set()
+        for segment in self.segments:
+            content |= segment.document_content(document_id)
+        return content
+
+    def record(self, row: int) -> VectorRecord | None:
+        for segment, start in zip(self.segments, self._starts(), strict=True):
+            if row < start + segment.row_count:
+                return segment.record(row - start)
+        raise IndexError(row)
+
+    def compact(self) -> None:
+        """Rewrite every segment into one unpersisted segment."""
+        merged = _Segment.merged(
+            [(segment, segment.alive[: segment.row_count]) for segment in self.segments],
+            ann=self.ann,
+            codec=self.codec,
+        )
+        if any(segment.exact_vectors() is None for segment in self.segments):
+            merged._exact = None
+        self.segments = [merged]
+
+    def merge_candidates(self, max_segments: int, merge_factor: int) -> list[_Segment]:
+        """Persisted segments a background merge should rewrite into one."""
+        persisted = [segment for segment in self.segments if segment.name is not None]
+        sparse = [segment for segment in persisted if segment.sparse]
+        if sparse:
+            return sparse
+        if len(persisted) <= max_segments:
+            return []
+        # Size-tiered: the smallest segments are merged first, so a row is
+        # rewritten a logarithmic number of times.
+        return sorted(persisted, key=len)[:merge_factor]
+
+    def resident_bytes(self) -> int:
+        """Approximate memory held by the partition, mapped files included."""
+        return sum(segment.resident_bytes() for segment in self.segments) + sum(
+            ids.nbytes for ids in self.tombstones.values()
+        )
+
+    def allowed_rows(
+        self, chunk_ids: frozenset[int] | None, course_id: int | None = None
+    ) -> np.ndarray:
+        if not self.segments:
+            return np.zeros(0, dtype=bool)
+        return np.concatenate(
+            [segment.allowed_rows(chunk_ids, course_id) for segment in self.segments]
+        )
+
+    def search(
+        self,
+        query_vector: np.ndarray,
+        mask: np.ndarray,
+        limit: int,
+        *,
+        ef_search: int | None = None,
+    ) -> list[tuple[float, VectorRecord]]:
+        return self.search_many(query_vector, mask, limit, ef_search=ef_search)[0]
+
+    def search_many(
+        self,
+        query_vectors: np.ndarray,
+        mask: np.ndarray,
+        limit: int,
+        *,
+        ef_search: int | None = None,
+    ) -> list[list[tuple[float, VectorRecord]]]:
+        """Search every segment and keep the ``limit`` closest rows per query."""
+        results: list[list[tuple[float, VectorRecord]]] = [[] for _ in query_vectors]
+        for segment, start in zip(self.segments, self._starts(), strict=True):
+            segment_mask = mask[start : start + segment.row_count]
+            if not segment_mask.any():
+                continue
+            found = segment.search_many(
+                query_vectors, segment_mask, limit, ef_search=ef_search
+            )
+            for result, segment_found in zip(results, found, strict=True):
+                result.extend(segment_found)
+        return [
+            sorted(result, key=lambda match: match[0])[:limit] for result in results
+        ]
+
+
+def _with_document(
+    records: list[VectorRecord], document_id: int, document_version: int
+) -> list[VectorRecord]:
+    return [
+        VectorRecord(
+            embedding_id=record.embedding_id,
+            text=record.text,
+            metadata={
+                **record.metadata,
+                "document_id": document_id,
+                "document_version": document_version,
+            },
+        )
+        for record in records
+    ]
+
+
+def _row_content(record: VectorRecord) -> tuple[int, int]:
+    """(chunk id, text hash) of a record, as ``document_content`` reports rows."""
+    chunk_id = record.metadata.get("chunk_id")
+    return (_NULL if chunk_id is None else chunk_id), _text_hash(record.text)
+
+
+def _partition_key(records: list[VectorRecord]) -> PartitionKey:
+    keys = {
+        (record.metadata.get("owner_id"), record.metadata.get("course_id"))
+        for record in records
+    }
+    if len(keys) != 1:
+        raise ValueError("Document vectors must belong to one owner and course")
+    owner_id, course_id = keys.pop()
+    if owner_id is None or course_id is None:
+        raise ValueError("Document vectors must belong to one owner and course")
+    return int(owner_id), int(course_id)
+
+
+def _atomic_write(target: Path, write: Callable[[Path], None]) -> None:
+    target.parent.mkdir(parents=True, exist_ok=True)
+    temp_path: Path | None = None
+    try:
+        with tempfile.NamedTemporaryFile(
+            dir=target.parent, prefix=f".{target.name}.", delete=False
+        ) as temporary:
+            temp_path = Path(temporary.name)
+        write(temp_path)
+        os.replace(temp_path, target)
+    except Exception:
+        if temp_path is not None:
+            temp_path.unlink(missing_ok=True)
+        raise
+
+
+def _file_stamp(path: Path) -> tuple[int, int, int] | None:
+    # Files are replaced by rename, so a new inode marks a new version.
+    try:
+        stat = path.stat()
+    except FileNotFoundError:
+        return None
+    return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+
+def _save_array(target: Path, array: np.ndarray) -> None:
+    # np.save appends ".npy" to paths without it, a file object keeps the name.
+    with target.open("wb") as file:
+        np.save(file, array)
+
 
 class FaissVectorStore:
-    """In-memory demo vector store; persisted chunks remain the source of truth."""
+    """Vector store partitioned by owner and course.
+
+    Persisted chunks remain the source of truth. Without ``storage_dir`` the
+    store is in-memory only. With it, every partition is written as a FAISS
+    index plus its row columns and is memory-mapped back on first access, so
+    a restart does not require re-embedding the corpus.
+
+    Partitions hold one course of an owner. With ``partition_by_course``
+    unset they hold all courses of an owner instead, so one search covers
+    them; ``VectorSearchFilters.course_id`` then narrows it to one course.
+
+    A storage directory can be shared by several worker processes. Each write
+    publishes a new generation of the partition under an exclusive file lock:
+    an immutable segment directory with the new rows, a file with the ids of
+    the documents it tombstones in older segments and a small per-partition
+    manifest listing both, then atomically replaces the ``CURRENT`` stamp. A
+    write therefore costs as much as its own rows, whatever the size of the
+    course. Readers compare the stamp before every search and re-read the
+    manifest when another process changed it, reusing the segments they
+    already mapped. The mapped files sit in the shared page cache, so the
+    vectors are resident once per host rather than once per worker.
+
+    Segments are merged in a background thread once a partition has more than
+    ``max_segments`` of them or tombstones dominate one; the merged segment is
+    built without the lock and published only if its sources are still
+    current. The partition of every document is kept in an append-only log
+    that readers follow from their last offset and writers rewrite once it is
+    mostly superseded entries.
+    """
+
+    index_filename = "index.faiss"
+    rows_filename = "rows.npz"
+    vectors_filename = "vectors.npy"
+    documents_filename = "documents.log"
+    current_filename = "CURRENT"
+    lock_filename = ".lock"
+    # Generations kept besides the current one for readers still opening them.
+    retained_generations = 1
+    # Records of a document encoded per model call by ``replace_document``.
+    write_batch_size = 256
+    # A background merge starts past ``max_segments`` persisted segments and
+    # rewrites the ``merge_factor`` smallest ones.
+    max_segments = 8
+    merge_factor = 4
+    # Superseded entries the document log may hold before it is rewritten.
+    documents_log_slack = 1024
+    # Staging directories of merges that died with their process.
+    stale_merge_seconds = 3600
 
-    def __init__(self, model_provider: Callable[[], Any]):
+    def __init__(
+        self,
+        model_provider: Callable[[], Any],
+        storage_dir: str | Path | None = None,
+        *,
+        embedding_cache: EmbeddingCache | None = None,
+        query_encoder: Any = None,
+        search_cache: SearchCache | None = None,
+        ann: HnswConfig | None = None,
+        codec: CodecConfig | None = None,
+        max_bytes: int | None = None,
+        rehydrate: Callable[[PartitionKey], PartitionDocuments] | None = None,
+        partition_by_course: bool = True,
+    ):
         self._model_provider = model_provider
-        self._entries: list[tuple[VectorRecord, np.ndarray]] = []
+        self._partition_by_course = partition_by_course
+        self._storage_dir = Path(storage_dir).resolve() if storage_dir else None
+        self._embedding_cache = embedding_cache
+        # Optional encoder for search queries, e.g. a MicroBatchEncoder.
+        self._query_encoder = query_encoder
+        self._search_cache = search_cache
+        self._ann = ann
+        self._codec = codec
+        # Bumped on every write to a partition; part of the result cache key.
+        self._versions: dict[PartitionKey, int] = {}
+        # Least recently used first. Past ``max_bytes`` cold partitions are
+        # dropped and loaded again from disk, or from ``rehydrate`` (the
+        # database) when the store is not persisted.
+        self._partitions: OrderedDict[PartitionKey, _Partition] = OrderedDict()
+        self._resident: dict[PartitionKey, int] = {}
+        self._evicted: set[PartitionKey] = set()
+        self._max_bytes = max_bytes
+        self._rehydrate = rehydrate
+        self._evictions = 0
+        self._reloads = 0
+        self._reload_seconds = 0.0
+        self._max_reload_seconds = 0.0
+        # On-disk stamp of the generation each cached partition was read from.
+        self._stamps: dict[PartitionKey, tuple[int, int, int] | None] = {}
+        self._document_partitions: dict[int, PartitionKey] = {}
+        # Placements not yet appended to the document log; None for removed.
+        self._document_changes: dict[int, PartitionKey | None] = {}
+        # Inode and read offset of the document log, entries read or written.
+        self._documents_inode: int | None = None
+        self._documents_offset = 0
+        self._documents_lines = 0
+        # Running background merges.
+        self._merges: dict[PartitionKey, Thread] = {}
+        # Partitions being loaded without the lock, set once installed.
+        self._loading: dict[PartitionKey, Event] = {}
         self._lock = RLock()
+        if self._storage_dir is not None:
+            self._refresh_documents()
 
     def replace_document(
-        self, document_id: int, document_version: int, records: list[VectorRecord]
+        self,
+        document_id: int,
+        document_version: int,
+        records: Iterable[VectorRecord],
+        *,
+        vector_source: int | None = None,
     ) -> list[str]:
-        model = self._model_provider()
-        if model is None:
-            raise RuntimeError("Embedding model is unavailable")
+        """Store the records of a document in place of all its older ones.
 
-        normalized_records = [
-            VectorRecord(
-                embedding_id=record.embedding_id,
-                text=record.text,
-                metadata={
-                    **record.metadata,
-                    "document_id": document_id,
-                    "document_version": document_version,
-                },
+        ``records`` is read and encoded ``write_batch_size`` at a time, so a
+        lazy iterable keeps one batch of texts in memory; the new version is
+        published once, after the last batch. ``vector_source`` names another
+        stored document with the same content, e.g. the same file in another
+        course, whose vectors may be reused.
+        """
+        with self._lock:
+            stored = self._stored_vectors(
+                [document_id] if vector_source is None else [document_id, vector_source]
             )
-            for record in records
+        key: PartitionKey | None = None
+        normalized_records: list[VectorRecord] = []
+        vectors: list[np.ndarray] = []
+        iterator = iter(records)
+        while batch := list(islice(iterator, self.write_batch_size)):
+            batch = _with_document(batch, document_id, document_version)
+            if key is None:
+                key = self._partition_key(batch)
+            elif self._partition_key(batch) != key:
+                raise ValueError("Document vectors must belong to one owner and course")
+            vectors.append(
+                self._document_vectors([record.text for record in batch], stored)
+            )
+            normalized_records.extend(batch)
+
+        if key is not None:
+            self._load_unlocked(key)
+        with self._lock, self._exclusive():
+            # A document has one active version in the index. Reindexing also
+            # deactivates any older version that might still be stored.
+            touched = self._remove_document(document_id)
+            if key is not None:
+                self._partition(key).add(normalized_records, np.vstack(vectors))
+                self._place_document(document_id, key)
+                touched.add(key)
+            self._persist(touched)
+            self._enforce_budget(keep=key)
+        return [record.embedding_id for record in normalized_records]
+
+    def replace_documents(
+        self, documents: PartitionDocuments, *, skip_current: bool = False
+    ) -> int:
+        """Bulk variant of ``replace_document`` for many documents at once.
+
+        All texts go through one cache-aware encode call and every touched
+        partition is written once. With ``skip_current`` documents stored with
+        the same chunks and texts, or in a newer version, are left as they
+        are, so a bulk load can run next to regular indexing and be repeated
+        cheaply. Returns the number of documents written.
+        """
+        # The last entry of a document wins, as with repeated single calls.
+        documents = list({document[0]: document for document in documents}.values())
+        normalized = [
+            (document_id, version, _with_document(records, document_id, version))
+            for document_id, version, records in documents
         ]
-        texts = [record.text for record in normalized_records]
-        vectors = (
-            np.asarray(model.encode(texts), dtype=np.float32)
-            if texts
-            else np.empty((0, 0), dtype=np.float32)
+        if skip_current:
+            with self._lock:
+                normalized = [
+                    document
+                    for document in normalized
+                    if not self._is_current(*document)
+                ]
+        vectors = self._encode_documents(
+            [record.text for _, _, records in normalized for record in records]
         )
-        if texts and (vectors.ndim != 2 or len(vectors) != len(records)):
-            raise RuntimeError("Embedding model returned an invalid vector batch")
 
-        with self._lock:
-            # A document has one active version in the demo index. Reindexing also
-            # deactivates any older version that might still be present in memory.
-            self._entries = [
-                entry
-                for entry in self._entries
-                if entry[0].metadata.get("document_id") != document_id
-            ]
-            self._entries.extend(
-                (record, vector)
-                for record, vector in zip(normalized_records, vectors, strict=True)
-            )
-        return [record.embedding_id for record in normalized_records]
+        with self._lock, self._exclusive():
+            touched: set[PartitionKey] = set()
+            added: dict[PartitionKey, tuple[list[VectorRecord], list[np.ndarray]]] = {}
+            written = 0
+            offset = 0
+            for document_id, version, records in normalized:
+                rows = vectors[offset : offset + len(records)]
+                offset += len(records)
+                # Another writer may have indexed the document meanwhile.
+                if skip_current and self._is_current(document_id, version, records):
+                    continue
+                touched |= self._remove_document(document_id)
+                written += 1
+                if not records:
+                    continue
+                key = self._partition_key(records)
+                partition_records, partition_vectors = added.setdefault(
+                    key, ([], [])
+                )
+                partition_records.extend(records)
+                partition_vectors.append(rows)
+                self._place_document(document_id, key)
+            for key, (records, rows) in added.items():
+                self._partition(key).add(records, np.vstack(rows))
+                touched.add(key)
+            self._persist(touched)
+            self._enforce_budget()
+        return written
+
+    def _partition_key(self, records: list[VectorRecord]) -> PartitionKey:
+        owner_id, course_id = _partition_key(records)
+        return (owner_id, course_id if self._partition_by_course else ALL_COURSES)
+
+    def _search_key(self, filters: VectorSearchFilters) -> PartitionKey:
+        if not self._partition_by_course:
+            return filters.owner_id, ALL_COURSES
+        if filters.course_id is None:
+            raise ValueError("The store is partitioned by course")
+        return filters.owner_id, filters.course_id
+
+    def _allowed_rows(
+        self, partition: _Partition, filters: VectorSearchFilters
+    ) -> np.ndarray:
+        # A course partition holds its course only.
+        return partition.allowed_rows(
+            filters.allowed_chunk_ids,
+            None if self._partition_by_course else filters.course_id,
+        )
+
+    def _is_current(
+        self, document_id: int, document_version: int, records: list[VectorRecord]
+    ) -> bool:
+        """Whether the store holds ``records`` or a newer version of the document.
+
+        Reindexing replaces the chunks of a document without bumping its
+        version, so within a version the stored chunk ids and texts decide.
+        """
+        key = self._document_partitions.get(document_id)
+        if key is None:
+            return False
+        partition = self._partition(key)
+        stored = partition.document_version(document_id)
+        if stored is None or stored < document_version:
+            return False
+        if stored > document_version:
+            return True
+        return partition.document_content(document_id) == {
+            _row_content(record) for record in records
+        }
 
     def delete_document(self, document_id: int) -> None:
-        with self._lock:
-            self._entries = [
-                entry
-                for entry in self._entries
-                if entry[0].metadata.get("document_id") != document_id
-            ]
+        with self._lock, self._exclusive():
+            self._persist(self._remove_document(document_id))
+            self._enforce_budget()
 
     def search(
-        self, query: str, filters: VectorSearchFilters, limit: int
+        self,
+        query: str,
+        filters: VectorSearchFilters,
+        limit: int,
+        *,
+        ef_search: int | None = None,
     ) -> list[VectorMatch]:
-        if not query.strip() or limit <= 0 or not filters.allowed_chunk_ids:
-            return []
-        # ACL and scope are applied before the candidate FAISS index is built.
+        return self.search_many([query], filters, limit, ef_search=ef_search)[0]
+
+    def search_many(
+        self,
+        queries: list[str],
+        filters: VectorSearchFilters,
+        limit: int,
+        *,
+        ef_search: int | None = None,
+    ) -> list[list[VectorMatch]]:
+        """Search several queries in one course with one encode and one scan."""
+        normalized = [normalize_query(query) for query in queries]
+        results: list[list[VectorMatch] | None] = [
+            []
+            if not query or limit <= 0 or filters.allowed_chunk_ids == frozenset()
+            else None
+            for query in normalized
+        ]
+        key = self._search_key(filters)
+        self._load_unlocked(key)
         with self._lock:
-            candidates = [
-                entry
-                for entry in self._entries
-                if entry[0].metadata.get("owner_id") == filters.owner_id
-                and entry[0].metadata.get("course_id") == filters.course_id
-                and entry[0].metadata.get("chunk_id") in filters.allowed_chunk_ids
+            # Picks up generations published by other processes before the
+            # result cache is consulted with the partition version.
+            partition = self._partition(key)
+            for position, query in enumerate(normalized):
+                if results[position] is None:
+                    results[position] = self._cached_results(
+                        key, filters, query, limit, ef_search
+                    )
+            pending = list(
+                dict.fromkeys(
+                    query
+                    for query, result in zip(normalized, results, strict=True)
+                    if result is None
+                )
+            )
+            if pending and not self._allowed_rows(partition, filters).any():
+                pending = []
+            self._enforce_budget(keep=key)
+        if not pending:
+            return [result or [] for result in results]
+
+        query_vectors = self._encode_queries(pending)
+
+        # ACL and scope are applied as a bitmap inside the course index. Rows
+        # are resolved again because the partition may have changed while the
+        # queries were encoded.
+        with self._lock:
+            partition = self._partition(key)
+            mask = self._allowed_rows(partition, filters)
+            found = [[] for _ in pending]
+            if mask.any():
+                found = partition.search_many(
+                    query_vectors, mask, limit, ef_search=ef_search
+                )
+            result_keys = [
+                self._result_key(key, filters, query, limit, ef_search)
+                for query in pending
             ]
-        if not candidates:
-            return []
+            self._enforce_budget(keep=key)
+        matches_by_query = {}
+        for query, query_found, result_key in zip(
+            pending, found, result_keys, strict=True
+        ):
+            matches = [
+                VectorMatch(
+                    embedding_id=record.embedding_id,
+                    score=1.0 / (1.0 + distance),
+                    metadata=record.metadata,
+                )
+                for distance, record in query_found
+            ]
+            if self._search_cache is not None:
+                self._search_cache.results.put(result_key, tuple(matches))
+            matches_by_query[query] = matches
+        return [
+            result if result is not None else list(matches_by_query[query])
+            for query, result in zip(normalized, results, strict=True)
+        ]
+
+    def _result_key(
+        self,
+        key: PartitionKey,
+        filters: VectorSearchFilters,
+        query: str,
+        limit: int,
+        ef_search: int | None,
+    ) -> tuple:
+        # The ACL set is keyed by its hash to keep entries small; callers
+        # re-check every match against the database ACL anyway.
+        return (
+            key,
+            self._versions.get(key, 0),
+            filters.course_id,
+            hash(filters.allowed_chunk_ids),
+            query,
+            limit,
+            ef_search,
+        )
+
+    def _cached_results(
+        self,
+        key: PartitionKey,
+        filters: VectorSearchFilters,
+        query: str,
+        limit: int,
+        ef_search: int | None,
+    ) -> list[VectorMatch] | None:
+        if self._search_cache is None:
+            return None
+        cached = self._search_cache.results.get(
+            self._result_key(key, filters, query, limit, ef_search)
+        )
+        return list(cached) if cached is not None else None
 
+    def _encode(self, texts: list[str]) -> np.ndarray:
         model = self._model_provider()
         if model is None:
             raise RuntimeError("Embedding model is unavailable")
+        vectors = np.asarray(model.encode(texts), dtype=np.float32)
+        if vectors.ndim != 2 or len(vectors) != len(texts):
+            raise RuntimeError("Embedding model returned an invalid vector batch")
+        return vectors
 
-        query_vector = np.asarray(model.encode([query]), dtype=np.float32)
-        vectors = np.asarray([entry[1] for entry in candidates], dtype=np.float32)
-        if query_vector.ndim != 2 or query_vector.shape[1] != vectors.shape[1]:
+    def _encode_queries(self, queries: list[str]) -> np.ndarray:
+        vectors: list[np.ndarray | None] = [None] * len(queries)
+        if self._search_cache is not None:
+            vectors = [
+                self._search_cache.vectors.get((self._search_cache.model_name, query))
+                for query in queries
+            ]
+        missing = [
+            query
+            for query, vector in zip(queries, vectors, strict=True)
+            if vector is None
+        ]
+        if missing:
+            if self._query_encoder is None:
+                encoded = self._encode(missing)
+            else:
+                encoded = np.asarray(
+                    self._query_encoder.encode(missing), dtype=np.float32
+                )
+            encoded_by_query = dict(zip(missing, encoded, strict=True))
+            if self._search_cache is not None:
+                for query, vector in encoded_by_query.items():
+                    self._search_cache.vectors.put(
+                        (self._search_cache.model_name, query), vector
+                    )
+            vectors = [
+                vector if vector is not None else encoded_by_query[query]
+                for query, vector in zip(queries, vectors, strict=True)
+            ]
+        if len({len(vector) for vector in vectors}) != 1:
             raise RuntimeError("Embedding dimensions do not match")
+        return np.vstack(vectors)
+
+    def _stored_vectors(self, document_ids: list[int]) -> dict[int, np.ndarray]:
+        stored: dict[int, np.ndarray] = {}
+        for document_id in document_ids:
+            key = self._document_partitions.get(document_id)
+            # An evicted in-memory partition would be rebuilt by encoding it.
+            if key is None or (
+                self._storage_dir is None and key not in self._partitions
+            ):
+                continue
+            for text_hash, vector in (
+                self._partition(key).document_vectors(document_id).items()
+            ):
+                stored.setdefault(text_hash, vector)
+        return stored
+
+    def _document_vectors(
+        self, texts: list[str], stored: dict[int, np.ndarray]
+    ) -> np.ndarray:
+        """Vectors for a batch of a new version of a document.
 
-        candidate_index = faiss.IndexFlatL2(vectors.shape[1])
-        candidate_index.add(vectors)
-        distances, indices = candidate_index.search(
-            query_vector, min(limit, len(candidates))
+        Texts whose hash is in ``stored``, the vectors the document already
+        has in the store, keep them; only the others are encoded, so an
+        incremental reindex costs as much as its changed chunks.
+        """
+        if not stored:
+            return self._encode_documents(texts)
+        hashes = [_text_hash(text) for text in texts]
+        missing = [
+            text
+            for text, text_hash in zip(texts, hashes, strict=True)
+            if text_hash not in stored
+        ]
+        encoded = iter(self._encode_documents(missing) if missing else ())
+        rows = [
+            stored[text_hash] if text_hash in stored else next(encoded)
+            for text_hash in hashes
+        ]
+        if len({len(row) for row in rows}) != 1:
+            raise RuntimeError("Embedding dimensions do not match")
+        return np.vstack(rows)
+
+    def _encode_documents(self, texts: list[str]) -> np.ndarray:
+        if not texts:
+            return np.empty((0, 0), dtype=np.float32)
+        if self._embedding_cache is None:
+            return self._encode(texts)
+
+        # Only cache misses reach the model, each distinct text once.
+        cached = self._embedding_cache.get_many(texts)
+        missing = list(
+            dict.fromkeys(
+                text
+                for text, vector in zip(texts, cached, strict=True)
+                if vector is None
+            )
         )
-        matches = []
-        for distance, candidate_index_value in zip(
-            distances[0], indices[0], strict=True
-        ):
-            if candidate_index_value < 0:
+        encoded: dict[str, np.ndarray] = {}
+        if missing:
+            vectors = self._encode(missing)
+            self._embedding_cache.put_many(missing, vectors)
+            encoded = dict(zip(missing, vectors, strict=True))
+        rows = [
+            vector if vector is not None else encoded[text]
+            for text, vector in zip(texts, cached, strict=True)
+        ]
+        if len({len(row) for row in rows}) != 1:
+            raise RuntimeError("Embedding dimensions do not match")
+        return np.vstack(rows)
+
+    def search_cache_stats(self) -> dict[str, dict[str, float | int]] | None:
+        return self._search_cache.stats() if self._search_cache else None
+
+    def _partition(self, key: PartitionKey) -> _Partition:
+        """The current partition of ``key``; the caller holds ``_lock``.
+
+        A stale partition is loaded in place. Paths that can load before
+        taking the lock call ``_load_unlocked`` first, so this is a lookup.
+        """
+        partition = self._partitions.get(key)
+        stamp = self._partition_stamp(key)
+        if partition is not None and stamp == self._stamps.get(key):
+            self._partitions.move_to_end(key)
+            return partition
+
+        # First access, eviction, or another process published a newer
+        # generation.
+        started = time.perf_counter()
+        loaded = self._load(key, key in self._evicted)
+        return self._install(key, loaded, stamp, started)
+
+    def _load_unlocked(self, key: PartitionKey) -> None:
+        """Bring the partition of ``key`` up to date without holding ``_lock``.
+
+        Mapping segments, or rehydrating an evicted partition from the
+        database and encoding it, takes long; searches of other partitions go
+        on meanwhile. Callers for the same key wait for the one load.
+        """
+        with self._lock:
+            partition = self._partitions.get(key)
+            stamp = self._partition_stamp(key)
+            if partition is not None and stamp == self._stamps.get(key):
+                return
+            loading = self._loading.get(key)
+            if loading is None:
+                loading = self._loading[key] = Event()
+                version = self._versions.get(key, 0)
+                evicted = key in self._evicted
+            else:
+                version = None
+        if version is None:
+            # Whatever it installed is checked again under the lock.
+            loading.wait()
+            return
+
+        started = time.perf_counter()
+        try:
+            loaded = self._load(key, evicted)
+            with self._lock:
+                # A write of this process changed the partition meanwhile;
+                # its state wins and ``_partition`` catches up with disk.
+                if self._versions.get(key, 0) == version:
+                    self._install(key, loaded, stamp, started)
+                    self._enforce_budget(keep=key)
+        finally:
+            with self._lock:
+                del self._loading[key]
+            loading.set()
+
+    def _load(
+        self, key: PartitionKey, evicted: bool
+    ) -> tuple[_Partition | None, list[int]]:
+        """The partition of ``key`` from disk or the database, and its documents."""
+        partition = self._load_partition(key)
+        if partition is None and evicted:
+            return self._rehydrate_partition(key)
+        return partition, []
+
+    def _install(
+        self,
+        key: PartitionKey,
+        loaded: tuple[_Partition | None, list[int]],
+        stamp: tuple[int, int, int] | None,
+        started: float,
+    ) -> _Partition:
+        partition, document_ids = loaded
+        if partition is not None:
+            elapsed = time.perf_counter() - started
+            self._reloads += 1
+            self._reload_seconds += elapsed
+            self._max_reload_seconds = max(self._max_reload_seconds, elapsed)
+        else:
+            partition = _Partition(ann=self._ann, codec=self._codec)
+        for document_id in document_ids:
+            self._place_document(document_id, key)
+        self._evicted.discard(key)
+        self._partitions[key] = partition
+        self._partitions.move_to_end(key)
+        self._resident[key] = partition.resident_bytes()
+        self._stamps[key] = stamp
+        self._versions[key] = self._versions.get(key, 0) + 1
+        return partition
+
+    def _rehydrate_partition(
+        self, key: PartitionKey
+    ) -> tuple[_Partition | None, list[int]]:
+        if self._storage_dir is not None or self._rehydrate is None:
+            return None, []
+        documents = self._rehydrate(key)
+        records = [
+            record
+            for document_id, version, document_records in documents
+            for record in _with_document(document_records, document_id, version)
+        ]
+        if not records:
+            return None, []
+        partition = _Partition(ann=self._ann, codec=self._codec)
+        # Unchanged chunk texts are served by the embedding cache.
+        vectors = self._encode_documents([record.text for record in records])
+        partition.add(records, vectors)
+        return partition, [document_id for document_id, _, _ in documents]
+
+    def _enforce_budget(self, keep: PartitionKey | None = None) -> None:
+        """Drop least recently used partitions until ``max_bytes`` holds."""
+        if self._max_bytes is None:
+            return
+        if self._storage_dir is None and self._rehydrate is None:
+            # Nothing to load an evicted partition back from.
+            return
+        resident = sum(self._resident.values())
+        for key in list(self._partitions):
+            if resident <= self._max_bytes:
+                break
+            if key == keep:
                 continue
-            record = candidates[int(candidate_index_value)][0]
-            matches.append(
-                VectorMatch(
-                    embedding_id=record.embedding_id,
-                    text=record.text,
-                    score=1.0 / (1.0 + float(distance)),
-                    metadata=dict(record.metadata),
-                )
+            del self._partitions[key]
+            resident -= self._resident.pop(key, 0)
+            self._stamps.pop(key, None)
+            self._evicted.add(key)
+            self._evictions += 1
+
+    def memory_stats(self) -> dict[str, float | int | None]:
+        with self._lock:
+            return {
+                "resident_bytes": sum(self._resident.values()),
+                "max_bytes": self._max_bytes,
+                "partitions": len(self._partitions),
+                "evicted_partitions": len(self._evicted),
+                "evictions": self._evictions,
+                "reloads": self._reloads,
+                "reload_seconds_total": self._reload_seconds,
+                "reload_seconds_max": self._max_reload_seconds,
+                "reload_seconds_avg": (
+                    self._reload_seconds / self._reloads if self._reloads else 0.0
+                ),
+            }
+
+    @contextmanager
+    def _exclusive(self) -> Iterator[None]:
+        """Serialize writers of all processes sharing ``storage_dir``."""
+        if self._storage_dir is None or fcntl is None:
+            yield
+            return
+        self._storage_dir.mkdir(parents=True, exist_ok=True)
+        with (self._storage_dir / self.lock_filename).open("a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                # Documents may have moved in another process since our read.
+                self._refresh_documents()
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _place_document(self, document_id: int, key: PartitionKey) -> None:
+        self._document_partitions[document_id] = key
+        if self._storage_dir is not None:
+            self._document_changes[document_id] = key
+
+    def _remove_document(self, document_id: int) -> set[PartitionKey]:
+        key = self._document_partitions.pop(document_id, None)
+        if key is None:
+            return set()
+        if self._storage_dir is not None:
+            self._document_changes[document_id] = None
+        self._partition(key).remove_document(document_id)
+        return {key}
+
+    def _partition_dir(self, key: PartitionKey) -> Path:
+        owner_id, course_id = key
+        return self._storage_dir / f"owner_{owner_id}" / f"course_{course_id}"
+
+    def _persist(self, keys: set[PartitionKey]) -> None:
+        for key in keys:
+            # Cached search results of older versions become unreachable.
+            self._versions[key] = self._versions.get(key, 0) + 1
+            if self._storage_dir is not None:
+                self._write_partition(key, self._partitions[key])
+                self._stamps[key] = self._partition_stamp(key)
+            self._resident[key] = self._partitions[key].resident_bytes()
+        if self._storage_dir is None:
+            return
+        self._write_documents()
+        for key in keys:
+            if self._partitions[key].merge_candidates(
+                self.max_segments, self.merge_factor
+            ):
+                self._schedule_merge(key)
+
+    def _partition_stamp(self, key: PartitionKey) -> tuple[int, int, int] | None:
+        if self._storage_dir is None:
+            return None
+        return _file_stamp(self._partition_dir(key) / self.current_filename)
+
+    def _current_generation(self, directory: Path) -> int | None:
+        try:
+            return int((directory / self.current_filename).read_text())
+        except FileNotFoundError:
+            return None
+
+    @staticmethod
+    def _manifest_name(generation: int) -> str:
+        return f"manifest_{generation:08d}.json"
+
+    @staticmethod
+    def _tombstones_name(generation: int) -> str:
+        return f"tombstones_{generation:08d}.npy"
+
+    def _write_partition(self, key: PartitionKey, partition: _Partition) -> None:
+        directory = self._partition_dir(key)
+        directory.mkdir(parents=True, exist_ok=True)
+        generation = (self._current_generation(directory) or 0) + 1
+        # Fully tombstoned segments leave the manifest without being rewritten.
+        partition.segments = [segment for segment in partition.segments if len(segment)]
+        new_segments = [segment for segment in partition.segments if segment.name is None]
+        for position, segment in enumerate(new_segments):
+            self._write_segment(directory, f"seg_{generation:08d}_{position}", segment)
+            if segment.baked is None:
+                segment.baked = generation
+        if partition.removed:
+            removed = np.array(sorted(partition.removed), dtype=np.int64)
+            _save_array(directory / self._tombstones_name(generation), removed)
+            partition.tombstones[generation] = removed
+            partition.removed = set()
+        # Tombstones older than every stored mask are not needed any more.
+        baked = min((segment.baked for segment in partition.segments), default=generation)
+        partition.tombstones = {
+            tombstones: removed
+            for tombstones, removed in partition.tombstones.items()
+            if tombstones > baked
+        }
+        manifest = {
+            "segments": [
+                {"name": segment.name, "baked": segment.baked}
+                for segment in partition.segments
+            ],
+            "tombstones": sorted(partition.tombstones),
+        }
+        _atomic_write(
+            directory / self._manifest_name(generation),
+            lambda path: path.write_text(json.dumps(manifest), encoding="utf-8"),
+        )
+        # Readers switch to the new generation at once, never to a mix of two.
+        _atomic_write(
+            directory / self.current_filename,
+            lambda path: path.write_text(str(generation), encoding="utf-8"),
+        )
+        for segment in partition.segments:
+            segment.applied = generation
+        self._retire_generations(directory, generation)
+
+    def _write_segment(self, directory: Path, name: str, segment: _Segment) -> None:
+        target = directory / name
+        # Leftovers of a writer that crashed before publishing this generation.
+        shutil.rmtree(target, ignore_errors=True)
+        if segment.staged is not None:
+            os.replace(segment.staged, target)
+            segment.staged = None
+        else:
+            target.mkdir(parents=True)
+            self._save_segment(target, segment)
+        segment.name = name
+
+        # The writer maps what it published too, so the vectors stay in the
+        # page cache shared with the other workers instead of private memory.
+        segment.index = faiss.read_index(
+            str(target / self.index_filename),
+            faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY,
+        )
+        segment.read_only = True
+        segment.trim()
+        if segment.exact_vectors() is not None:
+            # Re-scoring reads candidate rows from the page cache instead of
+            # keeping the float32 matrix resident.
+            segment.attach_exact(np.load(target / self.vectors_filename, mmap_mode="r"))
+
+    def _save_segment(self, target: Path, segment: _Segment) -> None:
+        faiss.write_index(segment.index, str(target / self.index_filename))
+        exact = segment.exact_vectors()
+        if exact is not None:
+            _save_array(target / self.vectors_filename, exact)
+        # Tombstoned rows stay in the columns, marked dead, to keep rows
+        # aligned with the index.
+        with (target / self.rows_filename).open("wb") as file:
+            np.savez(file, **segment.row_arrays())
+
+    def _manifest_files(self, path: Path) -> set[str]:
+        manifest = json.loads(path.read_text(encoding="utf-8"))
+        return {entry["name"] for entry in manifest["segments"]} | {
+            self._tombstones_name(generation) for generation in manifest["tombstones"]
+        }
+
+    def _retire_generations(self, directory: Path, generation: int) -> None:
+        """Delete what no retained generation of the partition refers to."""
+        oldest = generation - self.retained_generations
+        manifests = {
+            int(path.stem.removeprefix("manifest_")): path
+            for path in directory.glob("manifest_*.json")
+        }
+        retired = [number for number in manifests if number < oldest]
+        if retired:
+            used: set[str] = set()
+            for number, path in manifests.items():
+                if number >= oldest:
+                    used |= self._manifest_files(path)
+            for number in retired:
+                for name in self._manifest_files(manifests[number]) - used:
+                    path = directory / name
+                    if path.is_dir():
+                        shutil.rmtree(path, ignore_errors=True)
+                    else:
+                        path.unlink(missing_ok=True)
+                manifests[number].unlink(missing_ok=True)
+        for path in directory.glob(".merge-*"):
+            if time.time() - path.stat().st_mtime > self.stale_merge_seconds:
+                shutil.rmtree(path, ignore_errors=True)
+
+    def _load_partition(self, key: PartitionKey) -> _Partition | None:
+        if self._storage_dir is None:
+            return None
+        directory = self._partition_dir(key)
+        for _ in range(3):
+            generation = self._current_generation(directory)
+            try:
+                return self._load_generation(key, directory, generation)
+            except (FileNotFoundError, RuntimeError):
+                # A writer retired this generation while it was being opened.
+                if self._current_generation(directory) == generation:
+                    raise
+        return None
+
+    def _load_generation(
+        self, key: PartitionKey, directory: Path, generation: int | None
+    ) -> _Partition | None:
+        if generation is None:
+            return None
+        partition = _Partition(ann=self._ann, codec=self._codec)
+        manifest = json.loads(
+            (directory / self._manifest_name(generation)).read_text(encoding="utf-8")
+        )
+        # Segments and tombstones this process already read are reused, so a
+        # reload after another worker's write costs as much as that write.
+        previous = self._partitions.get(key)
+        reusable = {}
+        known: dict[int, np.ndarray] = {}
+        if previous is not None:
+            reusable = {segment.name: segment for segment in previous.segments}
+            known = previous.tombstones
+        partition.tombstones = {
+            tombstones: (
+                known[tombstones]
+                if tombstones in known
+                else np.load(directory / self._tombstones_name(tombstones))
             )
-        return matches
+            for tombstones in manifest["tombstones"]
+        }
+        for entry in manifest["segments"]:
+            segment = reusable.get(entry["name"])
+            if segment is None:
+                segment = self._open_segment(
+                    key, directory / entry["name"], entry["name"], entry["baked"]
+                )
+            if segment is None:
+                raise RuntimeError(f"Vector segment {entry['name']} is missing")
+            pending = [
+                removed
+                for tombstones, removed in partition.tombstones.items()
+                if tombstones > segment.applied
+            ]
+            if pending:
+                # The cached partition may be searched while this one loads.
+                segment = segment.detached()
+                for removed in pending:
+                    segment.remove_documents(removed)
+            segment.applied = max(segment.applied, generation)
+            partition.segments.append(segment)
+        return partition if partition.segments else None
+
+    def _open_segment(
+        self, key: PartitionKey, directory: Path, name: str, baked: int
+    ) -> _Segment | None:
+        index_path = directory / self.index_filename
+        rows_path = directory / self.rows_filename
+        if not index_path.exists() or not rows_path.exists():
+            return None
+
+        index = faiss.read_index(
+            str(index_path), faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY
+        )
+        with np.load(rows_path) as stored:
+            rows = {field: stored[field] for field in stored.files}
+        if len(rows["alive"]) != index.ntotal:
+            logger.warning("Vector segment %s of %s is inconsistent", name, key)
+            return None
+        exact = None
+        vectors_path = directory / self.vectors_filename
+        if self._codec is not None and self._codec.rescore and vectors_path.exists():
+            exact = np.load(vectors_path, mmap_mode="r")
+            if len(exact) != index.ntotal:
+                logger.warning("Vector partition %s has stale vectors", key)
+                exact = None
+        segment = _Segment(
+            index,
+            read_only=True,
+            ann=self._ann,
+            codec=self._codec,
+            exact=exact,
+            name=name,
+            baked=baked,
+        )
+        segment.attach_rows(rows)
+        return segment
+
+    def _schedule_merge(self, key: PartitionKey) -> None:
+        if key in self._merges:
+            return
+        thread = Thread(
+            target=self._merge_loop, args=(key,), name="vector-store-merge", daemon=True
+        )
+        self._merges[key] = thread
+        thread.start()
+
+    def _merge_loop(self, key: PartitionKey) -> None:
+        while True:
+            with self._lock:
+                partition = self._partitions.get(key)
+                sources = []
+                if partition is not None:
+                    sources = partition.merge_candidates(
+                        self.max_segments, self.merge_factor
+                    )
+                if not sources:
+                    # Under the lock, so a write that needs another merge
+                    # either sees this thread or starts a new one.
+                    del self._merges[key]
+                    return
+            try:
+                self._merge(key, sources)
+            except Exception:
+                logger.exception("Segments of vector partition %s were not merged", key)
+                with self._lock:
+                    del self._merges[key]
+                return
+
+    def wait_for_merges(self) -> None:
+        """Block until the background merges running now have finished."""
+        with self._lock:
+            threads = list(self._merges.values())
+        for thread in threads:
+            thread.join()
+
+    def merge_segments(self) -> None:
+        """Merge the segments of every cached partition into one, in this thread."""
+        if self._storage_dir is None:
+            return
+        self.wait_for_merges()
+        with self._lock:
+            keys = list(self._partitions)
+        for key in keys:
+            with self._lock:
+                partition = self._partitions.get(key)
+                sources = [] if partition is None else partition.segments
+            if len(sources) > 1 or any(segment.sparse for segment in sources):
+                self._merge(key, list(sources))
+
+    def _merge(self, key: PartitionKey, sources: list[_Segment]) -> None:
+        with self._lock:
+            parts = [
+                (segment, segment.alive[: segment.row_count].copy())
+                for segment in sources
+            ]
+            # The merged mask holds the tombstones every source had applied.
+            baked = min(segment.applied for segment in sources)
+        merged = _Segment.merged(parts, ann=self._ann, codec=self._codec)
+        merged.baked = merged.applied = baked
+        directory = self._partition_dir(key)
+        directory.mkdir(parents=True, exist_ok=True)
+        staged = Path(tempfile.mkdtemp(prefix=".merge-", dir=directory))
+        try:
+            if len(merged):
+                self._save_segment(staged, merged)
+            with self._lock, self._exclusive():
+                partition = self._partition(key)
+                names = [segment.name for segment in partition.segments]
+                merged_names = {segment.name for segment in sources}
+                if None in merged_names or not merged_names <= set(names):
+                    # Another process merged or rewrote them meanwhile.
+                    return
+                for tombstones, removed in partition.tombstones.items():
+                    if tombstones > baked:
+                        merged.remove_documents(removed)
+                first = min(names.index(name) for name in merged_names)
+                segments = [
+                    segment
+                    for segment in partition.segments
+                    if segment.name not in merged_names
+                ]
+                if len(merged):
+                    merged.staged = staged
+                    segments.insert(first, merged)
+                partition.segments = segments
+                self._persist({key})
+                self._enforce_budget()
+        finally:
+            shutil.rmtree(staged, ignore_errors=True)
+
+    def _write_documents(self) -> None:
+        if not self._document_changes:
+            return
+        path = self._storage_dir / self.documents_filename
+        superseded = self._documents_lines - len(self._document_partitions)
+        if superseded > max(
+            len(self._document_partitions), self.documents_log_slack
+        ):
+            self._rewrite_documents()
+            return
+        entries = "".join(
+            f"{document_id} -\n"
+            if key is None
+            else f"{document_id} {key[0]} {key[1]}\n"
+            for document_id, key in self._document_changes.items()
+        )
+        with path.open("a", encoding="utf-8") as file:
+            file.write(entries)
+        stat = path.stat()
+        # Everything before was read under the same lock.
+        self._documents_inode, self._documents_offset = stat.st_ino, stat.st_size
+        self._documents_lines += len(self._document_changes)
+        self._document_changes.clear()
+
+    def _rewrite_documents(self) -> None:
+        path = self._storage_dir / self.documents_filename
+        _atomic_write(
+            path,
+            lambda target: target.write_text(
+                "".join(
+                    f"{document_id} {key[0]} {key[1]}\n"
+                    for document_id, key in self._document_partitions.items()
+                ),
+                encoding="utf-8",
+            ),
+        )
+        stat = path.stat()
+        self._documents_inode, self._documents_offset = stat.st_ino, stat.st_size
+        self._documents_lines = len(self._document_partitions)
+        self._document_changes.clear()
+
+    def _refresh_documents(self) -> None:
+        path = self._storage_dir / self.documents_filename
+        try:
+            stat = path.stat()
+        except FileNotFoundError:
+            return
+        if stat.st_ino != self._documents_inode or stat.st_size < self._documents_offset:
+            # Rewritten by another process.
+            self._document_partitions = {}
+            self._documents_inode = stat.st_ino
+            self._documents_offset = self._documents_lines = 0
+        if stat.st_size == self._documents_offset:
+            return
+        with path.open("rb") as file:
+            file.seek(self._documents_offset)
+            data = file.read(stat.st_size - self._documents_offset)
+        # An entry still being appended is read by the next refresh.
+        complete = data[: data.rfind(b"\n") + 1]
+        for line in complete.decode("utf-8").splitlines():
+            document_id, *key = line.split()
+            if key == ["-"]:
+                self._document_partitions.pop(int(document_id), None)
+            else:
+                self._document_partitions[int(document_id)] = (int(key[0]), int(key[1]))
+            self._documents_lines += 1
+        self._documents_offset += len(complete)
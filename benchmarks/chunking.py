@@ -0,0 +1,129 @@
+"""Micro-benchmark: buffered sentence chunker vs the string-concatenating one.
+
+The previous ``chunk_blocks`` rebuilt the whole chunk string for every block,
+which is quadratic in chunk size; it is reproduced here as the baseline. The
+corpus is many short lines, like extracted PDF blocks. Run from the
+repository root:
+
+    python -m benchmarks.chunking --chunk-sizes 500,2000,8000,20000
+"""
+
+import argparse
+import random
+import time
+
+from app.services.document_processing import ExtractedBlock, chunk_blocks
+
+
+def _legacy_chunk_blocks(
+    blocks: list[ExtractedBlock], *, max_chars: int, overlap_chars: int
+) -> list[dict]:
+    chunks: list[dict] = []
+    current_text = ""
+    current_page = None
+    current_section = None
+
+    def emit(text: str, page: int | None, section: str | None) -> None:
+        clean = text.strip()
+        if clean:
+            chunks.append(
+                {
+                    "text": clean,
+                    "page": page,
+                    "section": section,
+                    "metadata_json": {"page": page, "section": section},
+                    "chunk_index": len(chunks),
+                }
+            )
+
+    for block in blocks:
+        text = block.text.strip()
+        if not text:
+            continue
+        metadata_changed = (
+            current_text
+            and (block.page != current_page or block.section != current_section)
+        )
+        if metadata_changed:
+            emit(current_text, current_page, current_section)
+            current_text = ""
+
+        if not current_text:
+            current_page, current_section = block.page, block.section
+        candidate = f"{current_text}\n{text}".strip()
+        if len(candidate) <= max_chars:
+            current_text = candidate
+            continue
+
+        if current_text:
+            emit(current_text, current_page, current_section)
+            prefix = current_text[-overlap_chars:] if overlap_chars else ""
+            current_text = f"{prefix}\n{text}".strip()
+        else:
+            current_text = text
+
+        while len(current_text) > max_chars:
+            emit(current_text[:max_chars], current_page, current_section)
+            start = max_chars - overlap_chars
+            current_text = current_text[start:].strip()
+
+    emit(current_text, current_page, current_section)
+    return chunks
+
+
+def _corpus(megabytes: float) -> list[ExtractedBlock]:
+    rng = random.Random(0)
+    words = ["рекурсия", "стек", "вызов", "функция", "база", "случай", "кадр", "data"]
+    blocks = []
+    size = 0
+    page = 1
+    while size < megabytes * 1024 * 1024:
+        sentence = " ".join(rng.choice(words) for _ in range(rng.randint(4, 14)))
+        blocks.append(ExtractedBlock(text=f"{sentence}.", page=page))
+        size += len(sentence) + 1
+        # Long pages so that chunks are limited by size, not by page breaks.
+        page += len(blocks) % 2000 == 0
+    return blocks
+
+
+def _best(run, repeat: int) -> tuple[float, int]:
+    best = float("inf")
+    count = 0
+    for _ in range(repeat):
+        started = time.perf_counter()
+        count = len(run())
+        best = min(best, time.perf_counter() - started)
+    return best, count
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--megabytes", type=float, default=8)
+    parser.add_argument("--chunk-sizes", default="500,2000,8000,20000")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    blocks = _corpus(args.megabytes)
+    megabytes = sum(len(block.text) for block in blocks) / 1024 / 1024
+    print(f"blocks={len(blocks)} text={megabytes:.1f} MiB")
+    print(f"{'max_chars':>9} {'legacy MiB/s':>13} {'buffered MiB/s':>15} {'chunks':>13}")
+    for max_chars in (int(value) for value in args.chunk_sizes.split(",")):
+        overlap = max_chars // 10
+        legacy_s, legacy_count = _best(
+            lambda: _legacy_chunk_blocks(
+                blocks, max_chars=max_chars, overlap_chars=overlap
+            ),
+            args.repeat,
+        )
+        buffered_s, buffered_count = _best(
+            lambda: list(chunk_blocks(blocks, max_size=max_chars, overlap=overlap)),
+            args.repeat,
+        )
+        print(
+            f"{max_chars:>9} {megabytes / legacy_s:>13.1f} "
+            f"{megabytes / buffered_s:>15.1f} {legacy_count:>6}/{buffered_count:<6}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+"""Throughput in chunks/sec and parity of torch and onnxruntime embeddings.
+
+Encodes the same synthetic document chunks with SentenceTransformer and with
+the exported ONNX model (float32 and int8), and reports the cosine similarity
+of every ONNX vector to its torch counterpart. Run from the repository root:
+
+    python -m benchmarks.embedding_backends --export models/all-MiniLM-L6-v2-onnx
+    python -m benchmarks.embedding_backends --onnx-dir models/all-MiniLM-L6-v2-onnx \\
+        --chunks 2000 --threads 4
+"""
+
+import argparse
+import time
+from pathlib import Path
+
+import numpy as np
+
+from app.services.embedding_backends import (
+    OnnxEmbeddingModel,
+    export_onnx,
+    load_torch_model,
+)
+
+_WORDS = (
+    "курс модуль урок теория задача тест документ раздел страница пример "
+    "алгоритм данные индекс поиск модель обучение вектор запрос ответ "
+    "security policy access control network protocol function argument"
+).split()
+
+
+def _chunks(count: int, words: int) -> list[str]:
+    rng = np.random.default_rng(0)
+    return [
+        " ".join(rng.choice(_WORDS, size=int(rng.integers(words // 2, words))))
+        for _ in range(count)
+    ]
+
+
+def _throughput(model, chunks: list[str], batch_size: int) -> tuple[np.ndarray, float]:
+    model.encode(chunks[:batch_size])
+    started = time.perf_counter()
+    vectors = np.vstack(
+        [
+            np.asarray(model.encode(chunks[start : start + batch_size]), dtype=np.float32)
+            for start in range(0, len(chunks), batch_size)
+        ]
+    )
+    return vectors, len(chunks) / (time.perf_counter() - started)
+
+
+def _cosine(left: np.ndarray, right: np.ndarray) -> np.ndarray:
+    left = left / np.linalg.norm(left, axis=1, keepdims=True)
+    right = right / np.linalg.norm(right, axis=1, keepdims=True)
+    return (left * right).sum(axis=1)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--model", default="all-MiniLM-L6-v2")
+    parser.add_argument("--onnx-dir", type=Path)
+    parser.add_argument("--export", type=Path, help="export the model here first")
+    parser.add_argument("--chunks", type=int, default=1000)
+    parser.add_argument("--words", type=int, default=180)
+    parser.add_argument("--batch-size", type=int, default=64)
+    parser.add_argument("--threads", type=int, default=0)
+    args = parser.parse_args()
+
+    if args.export is not None:
+        args.onnx_dir = export_onnx(args.model, args.export)
+    chunks = _chunks(args.chunks, args.words)
+    torch_vectors, torch_rate = _throughput(
+        load_torch_model(args.model, intra_op_threads=args.threads),
+        chunks,
+        args.batch_size,
+    )
+
+    print(f"chunks={args.chunks} words<={args.words} threads={args.threads or 'auto'}")
+    print(f"{'backend':>10} {'chunks/s':>9} {'speedup':>8} {'min cos':>8} {'mean cos':>9}")
+    print(f"{'torch':>10} {torch_rate:>9.1f} {1.0:>8.2f} {1.0:>8.4f} {1.0:>9.4f}")
+    if args.onnx_dir is None:
+        return
+    for name, quantized in (("onnx", False), ("onnx-int8", True)):
+        model = OnnxEmbeddingModel.from_directory(
+            args.onnx_dir,
+            quantized=quantized,
+            intra_op_threads=args.threads,
+            batch_size=args.batch_size,
+        )
+        vectors, rate = _throughput(model, chunks, args.batch_size)
+        cosine = _cosine(vectors, torch_vectors)
+        print(
+            f"{name:>10} {rate:>9.1f} {rate / torch_rate:>8.2f} "
+            f"{cosine.min():>8.4f} {cosine.mean():>9.4f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+"""Throughput of PDF text extraction by page count and worker count.
+
+Pages are filled with a few paragraphs of text so that extraction cost looks
+like a text-heavy handbook. The process pool is warmed up before timing, as
+it is in a running server. Run from the repository root:
+
+    python -m benchmarks.pdf_extraction --pages 50,200,600 --workers 1,2,4,8,16
+"""
+
+import argparse
+import tempfile
+import time
+from pathlib import Path
+
+import fitz
+
+from app.services.document_processing import extract_blocks
+
+PARAGRAPH = (
+    "Рекурсивная функция вызывает саму себя до достижения базового случая; "
+    "каждый вызов получает собственный кадр стека с локальными переменными. "
+)
+
+
+def _document(path: Path, pages: int) -> None:
+    document = fitz.open()
+    for number in range(pages):
+        page = document.new_page()
+        for paragraph in range(8):
+            page.insert_textbox(
+                fitz.Rect(50, 50 + paragraph * 90, 550, 135 + paragraph * 90),
+                f"{number}.{paragraph} " + PARAGRAPH * 3,
+                fontname="helv",
+                fontsize=9,
+            )
+    document.save(path)
+    document.close()
+
+
+def _extract(path: Path, workers: int, repeat: int) -> tuple[float, int]:
+    best = float("inf")
+    blocks = 0
+    for _ in range(repeat):
+        started = time.perf_counter()
+        blocks = sum(
+            1
+            for _ in extract_blocks(
+                path, "application/pdf", parallel_min_pages=1, workers=workers
+            )
+        )
+        best = min(best, time.perf_counter() - started)
+    return best, blocks
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--pages", default="50,200,600")
+    parser.add_argument("--workers", default="1,2,4,8,16")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+    worker_counts = [int(value) for value in args.workers.split(",")]
+
+    with tempfile.TemporaryDirectory() as directory:
+        warmup = Path(directory) / "warmup.pdf"
+        _document(warmup, 4)
+        for workers in worker_counts:
+            _extract(warmup, workers, 1)
+
+        print(f"{'pages':>6} {'workers':>8} {'seconds':>9} {'pages/s':>9} {'speedup':>8}")
+        for pages in (int(value) for value in args.pages.split(",")):
+            path = Path(directory) / f"{pages}.pdf"
+            _document(path, pages)
+            baseline = None
+            expected_blocks = None
+            for workers in worker_counts:
+                seconds, blocks = _extract(path, workers, args.repeat)
+                if expected_blocks is not None and blocks != expected_blocks:
+                    raise RuntimeError("Parallel extraction lost or duplicated blocks")
+                expected_blocks = blocks
+                baseline = baseline or seconds
+                print(
+                    f"{pages:>6} {workers:>8} {seconds:>9.3f} "
+                    f"{pages / seconds:>9.1f} {baseline / seconds:>7.2f}x"
+                )
+
+
+if __name__ == "__main__":
+    main()
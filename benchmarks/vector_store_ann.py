@@ -0,0 +1,114 @@
+"""Recall@k vs latency of HNSW course partitions against exact search.
+
+Vectors are drawn from a Gaussian mixture so that neighbourhoods look more
+like sentence embeddings than uniform noise. Stores are built and searched
+through the public ``FaissVectorStore`` API, with a model that looks texts up
+in the dataset, so latencies include the store's own overhead. Run from the
+repository root:
+
+    python -m benchmarks.vector_store_ann --size 100000 --ef-search 16,32,64,128,256
+"""
+
+import argparse
+import time
+
+import numpy as np
+
+from app.services.vector_store import (
+    FaissVectorStore,
+    HnswConfig,
+    VectorRecord,
+    VectorSearchFilters,
+)
+
+FILTERS = VectorSearchFilters(owner_id=1, course_id=1, allowed_chunk_ids=None)
+
+
+def _dataset(size: int, queries: int, dimension: int) -> tuple[np.ndarray, np.ndarray]:
+    rng = np.random.default_rng(0)
+    centers = rng.normal(size=(max(16, size // 500), dimension)).astype(np.float32)
+    labels = rng.integers(0, len(centers), size=size + queries)
+    points = centers[labels] + 0.35 * rng.normal(size=(size + queries, dimension))
+    points /= np.linalg.norm(points, axis=1, keepdims=True)
+    points = points.astype(np.float32)
+    return points[:size], points[size:]
+
+
+class _TableModel:
+    """Encodes the text ``"<row>"`` as row ``row`` of ``table``."""
+
+    def __init__(self, table: np.ndarray):
+        self.table = table
+
+    def encode(self, texts: list[str]) -> np.ndarray:
+        return self.table[[int(text) for text in texts]]
+
+
+def _store(vectors: np.ndarray, queries: np.ndarray, **options) -> FaissVectorStore:
+    """A store of ``vectors``; ``str(len(vectors) + i)`` encodes as ``queries[i]``."""
+    model = _TableModel(np.vstack([vectors, queries]))
+    store = FaissVectorStore(lambda: model, **options)
+    store.replace_documents(
+        (
+            start // 100,
+            1,
+            [
+                VectorRecord(
+                    str(row), str(row), {"owner_id": 1, "course_id": 1, "chunk_id": row}
+                )
+                for row in range(start, min(start + 100, len(vectors)))
+            ],
+        )
+        for start in range(0, len(vectors), 100)
+    )
+    return store
+
+
+def _run(store, size, queries, k, ef_search=None):
+    results = []
+    started = time.perf_counter()
+    for query in range(size, size + len(queries)):
+        found = store.search(str(query), FILTERS, k, ef_search=ef_search)
+        results.append({match.embedding_id for match in found})
+    latency_ms = (time.perf_counter() - started) * 1000 / len(queries)
+    return results, latency_ms
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--size", type=int, default=100_000)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--dimension", type=int, default=384)
+    parser.add_argument("-k", type=int, default=10)
+    parser.add_argument("--m", type=int, default=32)
+    parser.add_argument("--ef-construction", type=int, default=80)
+    parser.add_argument("--ef-search", default="16,32,64,128,256")
+    args = parser.parse_args()
+
+    vectors, queries = _dataset(args.size, args.queries, args.dimension)
+
+    exact = _store(vectors, queries)
+    truth, exact_ms = _run(exact, args.size, queries, args.k)
+
+    started = time.perf_counter()
+    hnsw = _store(
+        vectors,
+        queries,
+        ann=HnswConfig(min_rows=1, m=args.m, ef_construction=args.ef_construction),
+    )
+    build_s = time.perf_counter() - started
+
+    print(f"chunks={args.size} dim={args.dimension} k={args.k} queries={args.queries}")
+    print(f"hnsw build: {build_s:.1f}s (M={args.m}, efConstruction={args.ef_construction})")
+    print(f"{'index':>12} {'recall@k':>9} {'ms/query':>9}")
+    print(f"{'flat':>12} {1.0:>9.3f} {exact_ms:>9.3f}")
+    for ef_search in (int(value) for value in args.ef_search.split(",")):
+        found, latency_ms = _run(hnsw, args.size, queries, args.k, ef_search)
+        recall = np.mean(
+            [len(a & b) / len(b) for a, b in zip(found, truth, strict=True)]
+        )
+        print(f"{f'hnsw ef={ef_search}':>12} {recall:>9.3f} {latency_ms:>9.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+"""Index memory, latency and recall@k of compressed vector codecs.
+
+Every codec is compared with exact float32 search over the same Gaussian
+mixture, with and without float32 re-scoring of the top candidates. Memory is
+the store's own ``memory_stats()`` estimate: codes, graph, row columns and, with
+re-scoring, the float32 copy held by an in-memory store. Run from the
+repository root:
+
+    python -m benchmarks.vector_store_codecs --size 200000 --codecs flat,fp16,sq8,pq
+"""
+
+import argparse
+import time
+
+import numpy as np
+
+from app.services.vector_store import CodecConfig
+from benchmarks.vector_store_ann import _dataset, _run, _store
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--size", type=int, default=200_000)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--dimension", type=int, default=384)
+    parser.add_argument("-k", type=int, default=10)
+    parser.add_argument("--codecs", default="flat,fp16,sq8,pq")
+    parser.add_argument("--pq-subquantizers", type=int, default=96)
+    parser.add_argument("--rescore-factor", type=int, default=4)
+    args = parser.parse_args()
+
+    vectors, queries = _dataset(args.size, args.queries, args.dimension)
+    truth, _ = _run(_store(vectors, queries), args.size, queries, args.k)
+
+    print(f"chunks={args.size} dim={args.dimension} k={args.k} queries={args.queries}")
+    print(
+        f"{'codec':>14} {'store MiB':>10} {'build s':>8} "
+        f"{'recall@k':>9} {'ms/query':>9}"
+    )
+    for name in args.codecs.split(","):
+        for rescore in (False, True) if name != "flat" else (False,):
+            codec = CodecConfig(
+                codec=name,
+                train_min_rows=min(10_000, args.size),
+                pq_subquantizers=args.pq_subquantizers,
+                rescore=rescore,
+                rescore_factor=args.rescore_factor,
+            )
+            started = time.perf_counter()
+            store = _store(vectors, queries, codec=codec)
+            build_s = time.perf_counter() - started
+            store_mib = store.memory_stats()["resident_bytes"] / 2**20
+            found, latency_ms = _run(store, args.size, queries, args.k)
+            recall = np.mean(
+                [len(a & b) / len(b) for a, b in zip(found, truth, strict=True)]
+            )
+            label = f"{name}+rescore" if rescore else name
+            print(
+                f"{label:>14} {store_mib:>10.1f} {build_s:>8.1f} "
+                f"{recall:>9.3f} {latency_ms:>9.3f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
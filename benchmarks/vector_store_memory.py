@@ -0,0 +1,119 @@
+"""Memory benchmark: list-of-tuples vector entries vs ``FaissVectorStore``.
+
+Each layout is built in a fresh process so the resident set size delta is not
+polluted by the other layout. The store is filled and reindexed through its
+public API; its model returns random vectors. Run from the repository root:
+
+    python -m benchmarks.vector_store_memory --sizes 100000,1000000
+"""
+
+import argparse
+import multiprocessing
+import time
+
+import numpy as np
+
+from app.services.vector_store import FaissVectorStore, VectorRecord
+
+CHUNKS_PER_DOCUMENT = 100
+
+
+def _rss_bytes() -> int:
+    with open("/proc/self/status", encoding="utf-8") as status:
+        for line in status:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) * 1024
+    raise RuntimeError("VmRSS is not available on this platform")
+
+
+def _record(row: int) -> VectorRecord:
+    return VectorRecord(
+        embedding_id=f"document:{row // CHUNKS_PER_DOCUMENT}:v1:chunk:{row}",
+        text=f"chunk {row}",
+        metadata={
+            "kind": "document",
+            "document_id": row // CHUNKS_PER_DOCUMENT,
+            "document_version": 1,
+            "chunk_id": row,
+            "chunk_index": row % CHUNKS_PER_DOCUMENT,
+            "owner_id": 1,
+            "course_id": 1,
+        },
+    )
+
+
+class _RandomModel:
+    def __init__(self, dimension: int):
+        self.dimension = dimension
+        self.rng = np.random.default_rng(0)
+
+    def encode(self, texts: list[str]) -> np.ndarray:
+        return self.rng.random((len(texts), self.dimension), dtype=np.float32)
+
+
+def _batches(size: int, dimension: int):
+    rng = np.random.default_rng(0)
+    for start in range(0, size, CHUNKS_PER_DOCUMENT):
+        stop = min(size, start + CHUNKS_PER_DOCUMENT)
+        vectors = rng.random((stop - start, dimension), dtype=np.float32)
+        yield [_record(row) for row in range(start, stop)], vectors
+
+
+def _measure(layout: str, size: int, dimension: int, results) -> None:
+    before = _rss_bytes()
+    if layout == "list":
+        entries = []
+        for records, vectors in _batches(size, dimension):
+            entries.extend(zip(records, vectors.copy(), strict=True))
+        resident = _rss_bytes() - before
+        document_id = size // CHUNKS_PER_DOCUMENT // 2
+        records, vectors = next(_batches(CHUNKS_PER_DOCUMENT, dimension))
+        started = time.perf_counter()
+        entries = [
+            entry
+            for entry in entries
+            if entry[0].metadata.get("document_id") != document_id
+        ]
+        entries.extend(zip(records, vectors, strict=True))
+    else:
+        model = _RandomModel(dimension)
+        store = FaissVectorStore(lambda: model)
+        for records, _ in _batches(size, dimension):
+            document_id = records[0].metadata["document_id"]
+            store.replace_document(document_id, 1, records)
+        resident = _rss_bytes() - before
+        document_id = size // CHUNKS_PER_DOCUMENT // 2
+        records, _ = next(_batches(CHUNKS_PER_DOCUMENT, dimension))
+        started = time.perf_counter()
+        store.replace_document(document_id, 2, records)
+    results.put((resident, (time.perf_counter() - started) * 1000))
+
+
+def _run(layout: str, size: int, dimension: int) -> tuple[int, float]:
+    context = multiprocessing.get_context("spawn")
+    results = context.Queue()
+    process = context.Process(target=_measure, args=(layout, size, dimension, results))
+    process.start()
+    measured = results.get()
+    process.join()
+    return measured
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", default="100000,1000000")
+    parser.add_argument("--dimension", type=int, default=384)
+    args = parser.parse_args()
+
+    print(f"{'chunks':>9} {'layout':>8} {'rss MiB':>9} {'B/chunk':>8} {'reindex ms':>11}")
+    for size in (int(value) for value in args.sizes.split(",")):
+        for layout in ("list", "columnar"):
+            resident, reindex_ms = _run(layout, size, args.dimension)
+            print(
+                f"{size:>9} {layout:>8} {resident / 2**20:>9.1f} "
+                f"{resident / size:>8.0f} {reindex_ms:>11.2f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,6 @@
 import os
+from contextlib import asynccontextmanager
+from threading import Event
 
 from fastapi import Depends, FastAPI
 from fastapi.middleware.cors import CORSMiddleware
@@ -8,9 +10,34 @@ from app.routes import course_structure
 from app.routes import healthz
 from app.routes import theories
 from app.routes import versioning
+from app.core.config import settings
 from app.services.auth_service import get_current_user
+from app.services.embedding_service import (
+    model_loader,
+    start_lesson_index_sync,
+    start_vector_rehydration,
+)
+from app.services.job_queue import start_job_threads
+
+
+@asynccontextmanager
+async def lifespan(_: FastAPI):
+    if settings.EMBEDDING_WARMUP_ON_STARTUP:
+        model_loader.start()
+    if settings.VECTOR_REHYDRATE_ON_STARTUP and settings.VECTOR_STORE_DIR is None:
+        # Persisted stores survive restarts; an in-memory one starts empty.
+        start_vector_rehydration()
+    stop_jobs = Event()
+    if settings.JOB_WORKERS_IN_PROCESS:
+        start_job_threads(stop_jobs)
+    if settings.LESSON_INDEX_SYNC_IN_PROCESS:
+        start_lesson_index_sync(stop_jobs)
+    yield
+    # Workers finish the run in progress; queued runs wait for the next start.
+    stop_jobs.set()
+
 
-app = FastAPI(title="Lernium API")
+app = FastAPI(title="Lernium API", lifespan=lifespan)
 
 cors_origins = os.getenv(
     "CORS_ORIGINS",
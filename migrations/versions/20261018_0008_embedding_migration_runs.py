@@ -0,0 +1,81 @@
+"""Add embedding model migration runs.
+
+Revision ID: 20261018_0008
+Revises: 20260731_0007
+Create Date: 2026-10-18
+"""
+
+from collections.abc import Sequence
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+revision: str = "20261018_0008"
+down_revision: str | None = "20260731_0007"
+branch_labels: str | Sequence[str] | None = None
+depends_on: str | Sequence[str] | None = None
+
+
+def _json_type() -> sa.types.TypeEngine:
+    if op.get_bind().dialect.name == "postgresql":
+        return postgresql.JSONB(astext_type=sa.Text())
+    return sa.JSON()
+
+
+def upgrade() -> None:
+    op.create_table(
+        "embedding_migration_runs",
+        sa.Column("id", sa.Integer(), nullable=False),
+        sa.Column("created_at", sa.DateTime(), nullable=False),
+        sa.Column("updated_at", sa.DateTime(), nullable=False),
+        sa.Column("is_deleted", sa.Boolean(), nullable=False),
+        sa.Column("source_model", sa.String(length=255), nullable=False),
+        sa.Column("target_model", sa.String(length=255), nullable=False),
+        sa.Column("status", sa.String(length=32), nullable=False),
+        sa.Column("courses_total", sa.Integer(), nullable=False),
+        sa.Column("courses_done", sa.Integer(), nullable=False),
+        sa.Column("chunks_processed", sa.Integer(), nullable=False),
+        sa.Column("switched_course_ids", _json_type(), nullable=False),
+        sa.Column("output", _json_type(), nullable=True),
+        sa.Column("latency_ms", sa.Integer(), nullable=True),
+        sa.Column("error", sa.Text(), nullable=True),
+        sa.CheckConstraint(
+            "status IN ('queued', 'running', 'succeeded', 'failed')",
+            name="ck_embedding_migration_runs_status",
+        ),
+        sa.CheckConstraint(
+            "courses_done >= 0 AND courses_done <= courses_total",
+            name="ck_embedding_migration_runs_progress",
+        ),
+        sa.CheckConstraint(
+            "latency_ms IS NULL OR latency_ms >= 0",
+            name="ck_embedding_migration_runs_latency_nonnegative",
+        ),
+        sa.PrimaryKeyConstraint("id"),
+    )
+    op.create_index(
+        "ix_embedding_migration_runs_id",
+        "embedding_migration_runs",
+        ["id"],
+        unique=False,
+    )
+    op.create_index(
+        "ix_embedding_migration_runs_status",
+        "embedding_migration_runs",
+        ["status"],
+        unique=False,
+    )
+
+
+def downgrade() -> None:
+    op.drop_index(
+        "ix_embedding_migration_runs_status",
+        table_name="embedding_migration_runs",
+    )
+    op.drop_index(
+        "ix_embedding_migration_runs_id",
+        table_name="embedding_migration_runs",
+    )
+    op.drop_table("embedding_migration_runs")
@@ -0,0 +1,47 @@
+"""Add near-duplicate links between document chunks.
+
+Revision ID: 20261018_0009
+Revises: 20261018_0008
+Create Date: 2026-10-18
+"""
+
+from collections.abc import Sequence
+
+from alembic import op
+import sqlalchemy as sa
+
+
+revision: str = "20261018_0009"
+down_revision: str | None = "20261018_0008"
+branch_labels: str | Sequence[str] | None = None
+depends_on: str | Sequence[str] | None = None
+
+
+def upgrade() -> None:
+    with op.batch_alter_table("document_chunks") as batch_op:
+        batch_op.add_column(sa.Column("simhash", sa.BigInteger(), nullable=True))
+        batch_op.add_column(
+            sa.Column("canonical_chunk_id", sa.Integer(), nullable=True)
+        )
+        batch_op.create_foreign_key(
+            "fk_document_chunks_canonical_chunk_id",
+            "document_chunks",
+            ["canonical_chunk_id"],
+            ["id"],
+            ondelete="SET NULL",
+        )
+        batch_op.create_index(
+            "ix_document_chunks_canonical_chunk_id",
+            ["canonical_chunk_id"],
+            unique=False,
+        )
+
+
+def downgrade() -> None:
+    with op.batch_alter_table("document_chunks") as batch_op:
+        batch_op.drop_index("ix_document_chunks_canonical_chunk_id")
+        batch_op.drop_constraint(
+            "fk_document_chunks_canonical_chunk_id", type_="foreignkey"
+        )
+        batch_op.drop_column("canonical_chunk_id")
+        batch_op.drop_column("simhash")
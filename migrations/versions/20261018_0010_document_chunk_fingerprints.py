@@ -0,0 +1,28 @@
+"""Add content fingerprints to document chunks.
+
+Revision ID: 20261018_0010
+Revises: 20261018_0009
+Create Date: 2026-10-18
+"""
+
+from collections.abc import Sequence
+
+from alembic import op
+import sqlalchemy as sa
+
+
+revision: str = "20261018_0010"
+down_revision: str | None = "20261018_0009"
+branch_labels: str | Sequence[str] | None = None
+depends_on: str | Sequence[str] | None = None
+
+
+def upgrade() -> None:
+    # Existing rows keep NULL; a reindex fingerprints them from their text.
+    with op.batch_alter_table("document_chunks") as batch_op:
+        batch_op.add_column(sa.Column("fingerprint", sa.String(64), nullable=True))
+
+
+def downgrade() -> None:
+    with op.batch_alter_table("document_chunks") as batch_op:
+        batch_op.drop_column("fingerprint")
@@ -0,0 +1,28 @@
+"""Record the chunker settings of indexed documents.
+
+Revision ID: 20261018_0011
+Revises: 20261018_0010
+Create Date: 2026-10-18
+"""
+
+from collections.abc import Sequence
+
+from alembic import op
+import sqlalchemy as sa
+
+
+revision: str = "20261018_0011"
+down_revision: str | None = "20261018_0010"
+branch_labels: str | Sequence[str] | None = None
+depends_on: str | Sequence[str] | None = None
+
+
+def upgrade() -> None:
+    # Documents indexed before have no key and are not reused until reindexed.
+    with op.batch_alter_table("documents") as batch_op:
+        batch_op.add_column(sa.Column("chunking_key", sa.String(64), nullable=True))
+
+
+def downgrade() -> None:
+    with op.batch_alter_table("documents") as batch_op:
+        batch_op.drop_column("chunking_key")
@@ -0,0 +1,30 @@
+"""Index generation runs for the job queue.
+
+Revision ID: 20261018_0012
+Revises: 20261018_0011
+Create Date: 2026-10-18
+"""
+
+from collections.abc import Sequence
+
+from alembic import op
+
+
+revision: str = "20261018_0012"
+down_revision: str | None = "20261018_0011"
+branch_labels: str | Sequence[str] | None = None
+depends_on: str | Sequence[str] | None = None
+
+
+def upgrade() -> None:
+    # Workers poll for the oldest queued run of a type.
+    op.create_index(
+        "ix_generation_runs_queue",
+        "generation_runs",
+        ["status", "run_type", "id"],
+        unique=False,
+    )
+
+
+def downgrade() -> None:
+    op.drop_index("ix_generation_runs_queue", table_name="generation_runs")
@@ -0,0 +1,30 @@
+"""Lease running generation runs to the worker executing them.
+
+Revision ID: 20261018_0013
+Revises: 20261018_0012
+Create Date: 2026-10-18
+"""
+
+from collections.abc import Sequence
+
+from alembic import op
+import sqlalchemy as sa
+
+
+revision: str = "20261018_0013"
+down_revision: str | None = "20261018_0012"
+branch_labels: str | Sequence[str] | None = None
+depends_on: str | Sequence[str] | None = None
+
+
+def upgrade() -> None:
+    # Runs already running have no lease and are never requeued.
+    with op.batch_alter_table("generation_runs") as batch_op:
+        batch_op.add_column(sa.Column("lease_owner", sa.String(64), nullable=True))
+        batch_op.add_column(sa.Column("lease_expires_at", sa.DateTime(), nullable=True))
+
+
+def downgrade() -> None:
+    with op.batch_alter_table("generation_runs") as batch_op:
+        batch_op.drop_column("lease_expires_at")
+        batch_op.drop_column("lease_owner")
@@ -13,6 +13,13 @@ sys.path.insert(0, os.path.abspath(os.path.dirname(__file__) + "/.."))
 os.environ["ENV"] = "test"
 os.environ["DATABASE_URL"] = "sqlite:///:memory:"
 os.environ["JWT_SECRET"] = "test-only-jwt-secret-at-least-32-bytes"
+# The embedding model is never downloaded in tests.
+os.environ["EMBEDDING_WARMUP_ON_STARTUP"] = "false"
+os.environ["VECTOR_REHYDRATE_ON_STARTUP"] = "false"
+# Queued runs are executed explicitly by the tests that need them.
+os.environ["JOB_WORKERS_IN_PROCESS"] = "false"
+# Tests sync lesson indexes explicitly.
+os.environ["LESSON_INDEX_SYNC_IN_PROCESS"] = "false"
 
 import pytest
 from fastapi.testclient import TestClient
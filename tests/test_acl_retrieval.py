@@ -1,3 +1,5 @@
+from itertools import count
+
 import numpy as np
 
 from main import app
@@ -5,6 +7,7 @@ from app.models.course import Course
 from app.models.document import Document, DocumentChunk
 from app.models.user import User
 from app.services.embedding_service import get_vector_store
+from app.services.lexical_index import Bm25Index, LexicalRecord, get_lexical_index
 from app.services.vector_store import (
     FaissVectorStore,
     VectorMatch,
@@ -16,6 +19,7 @@ class FakeVectorStore:
     def __init__(self, matches):
         self.matches = matches
         self.filters = None
+        self.batches = []
 
     def replace_document(self, document_id, document_version, records):
         return [record.embedding_id for record in records]
@@ -23,9 +27,13 @@ class FakeVectorStore:
     def delete_document(self, document_id):
         return None
 
-    def search(self, query, filters, limit):
+    def search(self, query, filters, limit, *, ef_search=None):
+        return self.search_many([query], filters, limit, ef_search=ef_search)[0]
+
+    def search_many(self, queries, filters, limit, *, ef_search=None):
         self.filters = filters
-        return self.matches[:limit]
+        self.batches.append(list(queries))
+        return [self.matches[:limit] for _ in queries]
 
 
 def _document(db_session, course, owner_id, filename):
@@ -78,19 +86,18 @@ def test_course_retrieval_prefilters_acl_and_returns_db_citations(
         [
             VectorMatch(
                 embedding_id=foreign_chunk.embedding_id,
-                text="untrusted foreign text",
                 score=1.0,
                 metadata={"chunk_id": foreign_chunk.id},
             ),
             VectorMatch(
                 embedding_id=owned_chunk.embedding_id,
-                text="untrusted owned text",
                 score=0.8,
                 metadata={"chunk_id": owned_chunk.id},
             ),
         ]
     )
     app.dependency_overrides[get_vector_store] = lambda: store
+    app.dependency_overrides[get_lexical_index] = Bm25Index
     try:
         response = client.get(
             f"/api/courses/{owned_course.id}/retrieval",
@@ -99,6 +106,7 @@ def test_course_retrieval_prefilters_acl_and_returns_db_citations(
         )
     finally:
         app.dependency_overrides.pop(get_vector_store, None)
+        app.dependency_overrides.pop(get_lexical_index, None)
 
     assert response.status_code == 200
     assert store.filters.owner_id == auth_user.id
@@ -114,11 +122,282 @@ def test_course_retrieval_prefilters_acl_and_returns_db_citations(
             "page": 2,
             "section": "Scope",
             "text": "Text from owned.txt",
-            "score": 0.8,
+            "score": 0.5,
+            "vector_score": 0.8,
+            "lexical_score": None,
         }
     ]
 
 
+def test_course_retrieval_fuses_vector_and_lexical_candidates(
+    client, db_session, auth_user, auth_headers
+):
+    course = Course(name="Hybrid", owner_id=auth_user.id)
+    db_session.add(course)
+    db_session.flush()
+    _, semantic_chunk = _document(db_session, course, auth_user.id, "semantic.txt")
+    _, exact_chunk = _document(db_session, course, auth_user.id, "exact.txt")
+    exact_chunk.text = "Сортировка индексов: вызовите np.argsort по оценкам"
+    db_session.commit()
+
+    store = FakeVectorStore(
+        [
+            VectorMatch(
+                embedding_id=semantic_chunk.embedding_id,
+                score=0.9,
+                metadata={"chunk_id": semantic_chunk.id},
+            ),
+            VectorMatch(
+                embedding_id=exact_chunk.embedding_id,
+                score=0.4,
+                metadata={"chunk_id": exact_chunk.id},
+            ),
+        ]
+    )
+    lexical_index = Bm25Index()
+    app.dependency_overrides[get_vector_store] = lambda: store
+    app.dependency_overrides[get_lexical_index] = lambda: lexical_index
+    try:
+        response = client.get(
+            f"/api/courses/{course.id}/retrieval",
+            params={"q": "np.argsort оценки", "limit": 5},
+            headers=auth_headers,
+        )
+    finally:
+        app.dependency_overrides.pop(get_vector_store, None)
+        app.dependency_overrides.pop(get_lexical_index, None)
+
+    assert response.status_code == 200
+    citations = response.json()["citations"]
+    assert [citation["chunk_id"] for citation in citations] == [
+        exact_chunk.id,
+        semantic_chunk.id,
+    ]
+    assert citations[0]["vector_score"] == 0.4
+    assert citations[0]["lexical_score"] > 0
+    assert citations[1]["lexical_score"] is None
+    assert lexical_index.document_version(exact_chunk.document_id) == 1
+
+
+def test_course_retrieval_reloads_lexical_chunks_replaced_in_the_same_version(
+    client, db_session, auth_user, auth_headers
+):
+    course = Course(name="Lexical resync", owner_id=auth_user.id)
+    db_session.add(course)
+    db_session.flush()
+    document, chunk = _document(db_session, course, auth_user.id, "resync.txt")
+    db_session.commit()
+    lexical_index = Bm25Index()
+    # Indexed by this process before a worker reindexed the same version.
+    lexical_index.replace_document(
+        document.id, 1, [LexicalRecord(chunk.id, auth_user.id, course.id, chunk.text)]
+    )
+    replacement = DocumentChunk(
+        document_id=document.id,
+        document_version=1,
+        text="Рекурсия и стек вызовов",
+        chunk_index=1,
+    )
+    db_session.add(replacement)
+    db_session.delete(chunk)
+    db_session.commit()
+
+    app.dependency_overrides[get_vector_store] = lambda: FakeVectorStore([])
+    app.dependency_overrides[get_lexical_index] = lambda: lexical_index
+    try:
+        response = client.get(
+            f"/api/courses/{course.id}/retrieval",
+            params={"q": "рекурсия"},
+            headers=auth_headers,
+        )
+    finally:
+        app.dependency_overrides.pop(get_vector_store, None)
+        app.dependency_overrides.pop(get_lexical_index, None)
+
+    assert response.status_code == 200
+    assert [citation["chunk_id"] for citation in response.json()["citations"]] == [
+        replacement.id
+    ]
+    assert lexical_index.document_chunk_ids(document.id) == {replacement.id}
+
+
+def test_course_retrieval_batch_answers_every_query_with_one_search(
+    client, db_session, auth_user, auth_headers
+):
+    course = Course(name="Batch", owner_id=auth_user.id)
+    db_session.add(course)
+    db_session.flush()
+    _, chunk = _document(db_session, course, auth_user.id, "batch.txt")
+    db_session.commit()
+
+    store = FakeVectorStore(
+        [
+            VectorMatch(
+                embedding_id=chunk.embedding_id,
+                score=0.7,
+                metadata={"chunk_id": chunk.id},
+            )
+        ]
+    )
+    app.dependency_overrides[get_vector_store] = lambda: store
+    app.dependency_overrides[get_lexical_index] = Bm25Index
+    try:
+        response = client.post(
+            f"/api/courses/{course.id}/retrieval/batch",
+            json={"queries": ["first", "batch"], "limit": 3},
+            headers=auth_headers,
+        )
+        too_many = client.post(
+            f"/api/courses/{course.id}/retrieval/batch",
+            json={"queries": ["q"] * 33},
+            headers=auth_headers,
+        )
+    finally:
+        app.dependency_overrides.pop(get_vector_store, None)
+        app.dependency_overrides.pop(get_lexical_index, None)
+
+    assert response.status_code == 200
+    body = response.json()
+    assert body["course_id"] == course.id
+    assert [result["query"] for result in body["results"]] == ["first", "batch"]
+    assert [
+        [citation["chunk_id"] for citation in result["citations"]]
+        for result in body["results"]
+    ] == [[chunk.id], [chunk.id]]
+    assert body["results"][1]["citations"][0]["lexical_score"] > 0
+    assert store.batches == [["first", "batch"]]
+    assert too_many.status_code == 422
+
+
+def test_course_retrieval_caches_acl_until_document_changes(
+    client, db_session, auth_user, auth_headers, monkeypatch
+):
+    from app.repositories.retrieval import RetrievalRepository
+
+    course = Course(name="Cached ACL", owner_id=auth_user.id)
+    db_session.add(course)
+    db_session.flush()
+    document, chunk = _document(db_session, course, auth_user.id, "cached.txt")
+    db_session.commit()
+
+    loads = []
+    load_acl = RetrievalRepository.accessible_chunk_ids
+
+    def counting_load(db, course_id, owner_id):
+        loads.append(course_id)
+        return load_acl(db, course_id, owner_id)
+
+    monkeypatch.setattr(RetrievalRepository, "accessible_chunk_ids", counting_load)
+    store = FakeVectorStore(
+        [
+            VectorMatch(
+                embedding_id=chunk.embedding_id,
+                score=0.7,
+                metadata={"chunk_id": chunk.id},
+            )
+        ]
+    )
+
+    def retrieve():
+        response = client.get(
+            f"/api/courses/{course.id}/retrieval",
+            params={"q": "anything"},
+            headers=auth_headers,
+        )
+        assert response.status_code == 200
+        return [citation["chunk_id"] for citation in response.json()["citations"]]
+
+    app.dependency_overrides[get_vector_store] = lambda: store
+    app.dependency_overrides[get_lexical_index] = Bm25Index
+    try:
+        first = retrieve()
+        second = retrieve()
+        document.status = "archived"
+        db_session.commit()
+        after_archive = retrieve()
+    finally:
+        app.dependency_overrides.pop(get_vector_store, None)
+        app.dependency_overrides.pop(get_lexical_index, None)
+
+    assert first == second == [chunk.id]
+    assert after_archive == []
+    assert loads == [course.id, course.id]
+
+
+def test_faiss_store_search_many_encodes_queries_once():
+    from app.services.search_cache import SearchCache
+    from app.services.vector_store import VectorSearchFilters
+
+    class CountingModel:
+        def __init__(self):
+            self.calls = []
+
+        def encode(self, texts):
+            self.calls.append(list(texts))
+            return np.asarray(
+                [[float(len(text)), 0.0] for text in texts], dtype=np.float32
+            )
+
+    model = CountingModel()
+    store = FaissVectorStore(
+        lambda: model, search_cache=SearchCache("dummy", vector_entries=8)
+    )
+    metadata = {"owner_id": 1, "course_id": 20}
+    store.replace_document(
+        10,
+        1,
+        [
+            VectorRecord("short", "ab", {**metadata, "chunk_id": 1}),
+            VectorRecord("long", "abcdef", {**metadata, "chunk_id": 2}),
+        ],
+    )
+    filters = VectorSearchFilters(
+        owner_id=1, course_id=20, allowed_chunk_ids=frozenset({1, 2})
+    )
+    model.calls.clear()
+
+    results = store.search_many(["xy", "uvwxyz", "xy ", ""], filters, 1)
+
+    assert [[match.embedding_id for match in found] for found in results] == [
+        ["short"],
+        ["long"],
+        ["short"],
+        [],
+    ]
+    assert model.calls == [["xy", "uvwxyz"]]
+
+
+def test_bm25_index_matches_word_forms_and_replaces_documents():
+    from app.services.vector_store import VectorSearchFilters
+
+    index = Bm25Index()
+    index.replace_document(
+        1,
+        1,
+        [
+            LexicalRecord(10, 1, 20, "Архитектура распределённых систем"),
+            LexicalRecord(11, 1, 20, "Вызов foo_bar() в цикле"),
+        ],
+    )
+    index.replace_document(2, 1, [LexicalRecord(12, 1, 20, "Кэширование")])
+    filters = VectorSearchFilters(
+        owner_id=1, course_id=20, allowed_chunk_ids=frozenset({10, 11, 12})
+    )
+
+    assert [match.chunk_id for match in index.search("архитектуры", filters, 5)] == [10]
+    assert [match.chunk_id for match in index.search("foo_bar", filters, 5)] == [11]
+    restricted = VectorSearchFilters(
+        owner_id=1, course_id=20, allowed_chunk_ids=frozenset({11})
+    )
+    assert index.search("архитектура", restricted, 5) == []
+
+    index.replace_document(1, 2, [LexicalRecord(13, 1, 20, "Новая версия")])
+    assert index.search("архитектура", filters, 5) == []
+    assert index.document_version(1) == 2
+    index.delete_document(2)
+    assert index.search("кэширование", filters, 5) == []
+
+
 def test_course_retrieval_hides_foreign_course(client, db_session, auth_headers):
     foreign_course = Course(name="Foreign", owner_id=None)
     db_session.add(foreign_course)
@@ -184,3 +463,780 @@ def test_faiss_store_prefilters_and_replaces_old_document_version():
     )
 
     assert [match.embedding_id for match in matches] == ["new"]
+
+
+def test_faiss_store_reloads_persisted_partitions_without_reembedding(tmp_path):
+    class CountingModel:
+        def __init__(self):
+            self.encoded = []
+
+        def encode(self, texts):
+            self.encoded.extend(texts)
+            return np.asarray(
+                [[float(len(text)), 1.0] for text in texts], dtype=np.float32
+            )
+
+    from app.services.vector_store import VectorSearchFilters
+
+    metadata = {"owner_id": 1, "course_id": 20}
+    writer = FaissVectorStore(lambda: CountingModel(), tmp_path)
+    writer.replace_document(
+        10,
+        1,
+        [
+            VectorRecord("short", "abc", {**metadata, "chunk_id": 100}),
+            VectorRecord("long", "abcdefgh", {**metadata, "chunk_id": 101}),
+        ],
+    )
+    writer.replace_document(
+        11, 1, [VectorRecord("other", "abc", {**metadata, "chunk_id": 102})]
+    )
+
+    model = CountingModel()
+    restarted = FaissVectorStore(lambda: model, tmp_path)
+    filters = VectorSearchFilters(
+        owner_id=1, course_id=20, allowed_chunk_ids=frozenset({100, 101, 102})
+    )
+    matches = restarted.search("abcdefgh", filters, 1)
+
+    assert [match.embedding_id for match in matches] == ["long"]
+    assert matches[0].metadata["document_id"] == 10
+    assert model.encoded == ["abcdefgh"]
+
+    restarted.delete_document(10)
+    reloaded = FaissVectorStore(lambda: model, tmp_path)
+    assert [
+        match.embedding_id for match in reloaded.search("abcdefgh", filters, 5)
+    ] == ["other"]
+
+
+class _LengthModel:
+    def encode(self, texts):
+        return np.asarray([[float(len(text)), 1.0] for text in texts], dtype=np.float32)
+
+
+def _write_shared_document(storage_dir, document_id):
+    store = FaissVectorStore(lambda: _LengthModel(), storage_dir)
+    store.replace_document(
+        document_id,
+        1,
+        [
+            VectorRecord(
+                f"doc-{document_id}",
+                "x" * document_id,
+                {"owner_id": 1, "course_id": 20, "chunk_id": document_id},
+            )
+        ],
+    )
+
+
+def _search_shared_store(storage_dir):
+    from app.services.vector_store import VectorSearchFilters
+
+    store = FaissVectorStore(lambda: _LengthModel(), storage_dir)
+    filters = VectorSearchFilters(owner_id=1, course_id=20, allowed_chunk_ids=None)
+    return sorted(match.embedding_id for match in store.search("x", filters, 10))
+
+
+def test_faiss_store_is_consistent_across_worker_processes(tmp_path):
+    import multiprocessing
+
+    from app.services.vector_store import VectorSearchFilters
+
+    filters = VectorSearchFilters(owner_id=1, course_id=20, allowed_chunk_ids=None)
+    reader = FaissVectorStore(lambda: _LengthModel(), tmp_path)
+    assert reader.search("x", filters, 10) == []
+
+    # Concurrent writers in separate processes must not lose each other's
+    # documents, and a store opened before the writes must see all of them.
+    with multiprocessing.get_context("spawn").Pool(2) as pool:
+        pool.starmap(_write_shared_document, [(tmp_path, item) for item in range(1, 5)])
+        assert sorted(
+            match.embedding_id for match in reader.search("x", filters, 10)
+        ) == ["doc-1", "doc-2", "doc-3", "doc-4"]
+
+        reader.delete_document(2)
+        assert pool.apply(_search_shared_store, (tmp_path,)) == [
+            "doc-1",
+            "doc-3",
+            "doc-4",
+        ]
+
+    manifests = list((tmp_path / "owner_1" / "course_20").glob("manifest_*.json"))
+    assert len(manifests) <= 1 + FaissVectorStore.retained_generations
+
+
+def test_faiss_store_evicts_cold_partitions_within_memory_budget(tmp_path):
+    from app.services.vector_store import VectorSearchFilters
+
+    def course_records(course_id):
+        return [
+            VectorRecord(
+                f"course-{course_id}-{row}",
+                "x" * (row + 1),
+                {"owner_id": 1, "course_id": course_id, "chunk_id": course_id * 100 + row},
+            )
+            for row in range(20)
+        ]
+
+    def filters(course_id):
+        return VectorSearchFilters(owner_id=1, course_id=course_id, allowed_chunk_ids=None)
+
+    # A persisted partition holds no spare capacity for appended rows.
+    probe = FaissVectorStore(lambda: _LengthModel(), tmp_path / "probe")
+    probe.replace_document(1, 1, course_records(1))
+    partition_bytes = probe.memory_stats()["resident_bytes"]
+
+    # Persisted partitions are mapped back from disk.
+    store = FaissVectorStore(
+        lambda: _LengthModel(), tmp_path / "store", max_bytes=int(partition_bytes * 1.5)
+    )
+    for course_id in (1, 2, 3):
+        store.replace_document(course_id, 1, course_records(course_id))
+
+    stats = store.memory_stats()
+    assert stats["partitions"] == 1
+    assert stats["evictions"] == 2
+    assert stats["resident_bytes"] <= partition_bytes * 1.5
+    assert store.search("x", filters(1), 1)[0].embedding_id == "course-1-0"
+    stats = store.memory_stats()
+    assert stats["reloads"] == 1
+    assert stats["reload_seconds_max"] > 0
+    assert list(store._partitions) == [(1, 1)]
+
+    # Without a storage directory the database rebuilds the partition.
+    rehydrated = []
+
+    def rehydrate(key):
+        rehydrated.append(key)
+        return [(key[1], 1, course_records(key[1]))]
+
+    memory_store = FaissVectorStore(
+        lambda: _LengthModel(), max_bytes=int(partition_bytes * 1.5), rehydrate=rehydrate
+    )
+    for course_id in (1, 2):
+        memory_store.replace_document(course_id, 1, course_records(course_id))
+    assert memory_store.search("xxx", filters(1), 1)[0].embedding_id == "course-1-2"
+    assert rehydrated == [(1, 1)]
+    assert memory_store.memory_stats()["evictions"] == 2
+
+
+def test_faiss_store_searches_other_courses_while_partition_reloads():
+    import threading
+
+    from app.services.vector_store import VectorSearchFilters
+
+    def course_records(course_id):
+        return [
+            VectorRecord(
+                f"course-{course_id}-{row}",
+                "x" * (row + 1),
+                {"owner_id": 1, "course_id": course_id, "chunk_id": course_id * 100 + row},
+            )
+            for row in range(20)
+        ]
+
+    def filters(course_id):
+        return VectorSearchFilters(
+            owner_id=1, course_id=course_id, allowed_chunk_ids=None
+        )
+
+    loading = threading.Event()
+    release = threading.Event()
+
+    def rehydrate(key):
+        loading.set()
+        assert release.wait(5)
+        return [(key[1], 1, course_records(key[1]))]
+
+    store = FaissVectorStore(lambda: _LengthModel(), max_bytes=1, rehydrate=rehydrate)
+    for course_id in (1, 2):
+        store.replace_document(course_id, 1, course_records(course_id))
+    assert list(store._partitions) == [(1, 2)]
+
+    reloaded = []
+    reload = threading.Thread(
+        target=lambda: reloaded.extend(store.search("x", filters(1), 1))
+    )
+    reload.start()
+    try:
+        assert loading.wait(5)
+        # The slow database read of course 1 does not hold the store lock.
+        assert store.search("xx", filters(2), 1)[0].embedding_id == "course-2-1"
+        assert store.memory_stats()["reloads"] == 0
+    finally:
+        release.set()
+        reload.join(5)
+    assert [match.embedding_id for match in reloaded] == ["course-1-0"]
+    assert store.memory_stats()["reloads"] == 1
+
+
+def test_rehydration_streams_chunks_in_pages_and_resumes(
+    db_session, auth_user, tmp_path
+):
+    from contextlib import nullcontext
+
+    from app.services.embedding_service import chunk_documents
+    from app.services.vector_rehydration import rehydrate_vector_store
+    from app.services.vector_store import VectorSearchFilters
+
+    courses = [Course(name=f"Rehydrate {n}", owner_id=auth_user.id) for n in (1, 2)]
+    db_session.add_all(courses)
+    db_session.flush()
+    documents = []
+    for course, filename, extra_chunks in (
+        (courses[0], "long.txt", 2),
+        (courses[0], "short.txt", 0),
+        (courses[1], "other.txt", 1),
+    ):
+        document, _ = _document(db_session, course, auth_user.id, filename)
+        for chunk_index in range(1, extra_chunks + 1):
+            db_session.add(
+                DocumentChunk(
+                    document_id=document.id,
+                    document_version=1,
+                    text=f"Part {chunk_index} of {filename}",
+                    chunk_index=chunk_index,
+                )
+            )
+        documents.append(document)
+    documents[1].status = "failed"
+    db_session.commit()
+
+    class Model(_LengthModel):
+        encoded = []
+
+        def encode(self, texts):
+            self.encoded.extend(texts)
+            return super().encode(texts)
+
+    checkpoint = tmp_path / "rehydrate.json"
+
+    def run(store):
+        return rehydrate_vector_store(
+            lambda: nullcontext(db_session),
+            store,
+            chunk_documents,
+            page_size=2,
+            checkpoint_path=checkpoint,
+        )
+
+    store = FaissVectorStore(lambda: Model())
+    report = run(store)
+    # Pages of two rows: the first document spans both pages and is loaded
+    # whole; the failed document is not indexed.
+    assert (report.chunks, report.documents, report.skipped_documents) == (5, 2, 0)
+    assert report.pages == 2
+    assert not checkpoint.exists()
+    matches = store.search(
+        "x", VectorSearchFilters(auth_user.id, courses[0].id, None), 10
+    )
+    assert sorted(match.metadata["chunk_index"] for match in matches) == [0, 1, 2]
+    assert {match.metadata["source"] for match in matches} == {"long.txt"}
+
+    # Loading again into the same store re-encodes nothing.
+    Model.encoded.clear()
+    assert run(store).skipped_documents == 2
+    assert Model.encoded == []
+
+    # A reindex in place keeps the document version; the changed chunk is
+    # loaded again all the same.
+    changed = (
+        db_session.query(DocumentChunk)
+        .filter_by(document_id=documents[2].id, chunk_index=1)
+        .one()
+    )
+    changed.text = "Part 1 of other.txt, revised"
+    db_session.commit()
+    report = run(store)
+    assert (report.documents, report.skipped_documents) == (1, 1)
+    assert Model.encoded == ["Text from other.txt", "Part 1 of other.txt, revised"]
+    Model.encoded.clear()
+
+    # A run interrupted after the first course resumes from its checkpoint.
+    checkpoint.write_text(
+        '{"after": [%d, %d, 2], "course_id": null}' % (courses[0].id, documents[0].id)
+    )
+    fresh = FaissVectorStore(lambda: Model())
+    report = run(fresh)
+    assert report.resumed_from == (courses[0].id, documents[0].id, 2)
+    assert (report.chunks, report.documents) == (2, 1)
+    assert Model.encoded == ["Text from other.txt", "Part 1 of other.txt, revised"]
+    assert fresh.search(
+        "x", VectorSearchFilters(auth_user.id, courses[0].id, None), 10
+    ) == []
+    assert not checkpoint.exists()
+
+
+def _indexed_rows(db_session):
+    from app.repositories.retrieval import RetrievalRepository
+
+    return RetrievalRepository.indexed_chunk_page(db_session, None, 1000)
+
+
+def test_embedding_migration_switches_courses_to_shadow_index(
+    db_session, auth_user, tmp_path
+):
+    from contextlib import nullcontext
+
+    from app.models.embedding_migration_run import EmbeddingMigrationRun
+    from app.services.embedding_migration import (
+        ModelIndexState,
+        VersionedVectorStore,
+        migrate_embeddings,
+        model_storage_dir,
+        read_index_state,
+    )
+    from app.services.embedding_service import chunk_documents
+    from app.services.vector_store import VectorSearchFilters
+
+    class WideModel:
+        def encode(self, texts):
+            return np.asarray(
+                [[float(len(text)), 1.0, 0.5] for text in texts], dtype=np.float32
+            )
+
+    courses = [Course(name=f"Migrate {n}", owner_id=auth_user.id) for n in (1, 2)]
+    db_session.add_all(courses)
+    db_session.flush()
+    first_document, first_chunk = _document(
+        db_session, courses[0], auth_user.id, f"course-{courses[0].id}.txt"
+    )
+    _document(db_session, courses[1], auth_user.id, f"course-{courses[1].id}.txt")
+    db_session.commit()
+
+    models = {"old": _LengthModel, "new": WideModel}
+    store = VersionedVectorStore(
+        lambda model_id: FaissVectorStore(
+            lambda: models[model_id](), model_storage_dir(tmp_path, model_id)
+        ),
+        lambda: read_index_state(db_session, "old"),
+        ModelIndexState("old"),
+        state_ttl_seconds=10,
+        # Every read sees the latest run record.
+        clock=count(step=100).__next__,
+    )
+    store.replace_documents(chunk_documents(_indexed_rows(db_session)))
+
+    def served(course):
+        matches = store.search(
+            "x", VectorSearchFilters(auth_user.id, course.id, None), 10
+        )
+        return store.state().model_for(course.id), len(matches)
+
+    observed = []
+
+    def sleep(seconds):
+        # Between the first load of a course and its switch the old index
+        # serves, and documents indexed meanwhile are written to both.
+        observed.append((served(courses[0]), served(courses[1])))
+        if len(observed) == 1:
+            late, _ = _document(db_session, courses[1], auth_user.id, "late.txt")
+            db_session.commit()
+            rows = [
+                row for row in _indexed_rows(db_session) if row.document_id == late.id
+            ]
+            for document_id, version, records in chunk_documents(rows):
+                store.replace_document(document_id, version, records)
+
+            # A worker that has not seen the run yet reindexes a document in
+            # place, keeping its version, into the source store only.
+            db_session.delete(first_chunk)
+            db_session.add(
+                DocumentChunk(
+                    document_id=first_document.id,
+                    document_version=1,
+                    text="Reindexed text",
+                    chunk_index=0,
+                )
+            )
+            db_session.commit()
+            rows = [
+                row
+                for row in _indexed_rows(db_session)
+                if row.document_id == first_document.id
+            ]
+            for document_id, version, records in chunk_documents(rows):
+                store.store("old").replace_document(document_id, version, records)
+
+    run_id = migrate_embeddings(
+        lambda: nullcontext(db_session),
+        store,
+        "new",
+        chunk_documents,
+        clock=count().__next__,
+        sleep=sleep,
+    )
+
+    assert (tmp_path / "MODEL").read_text() == "old"
+    assert (tmp_path / "models" / "new").is_dir()
+    assert observed[0] == (("old", 1), ("old", 1))
+    assert observed[1] == (("new", 1), ("old", 2))
+    run = db_session.get(EmbeddingMigrationRun, run_id)
+    assert run.status == "succeeded"
+    assert (run.source_model, run.target_model) == ("old", "new")
+    assert run.switched_course_ids == [course.id for course in courses]
+    assert (run.courses_done, run.courses_total) == (2, 2)
+    assert run.chunks_processed >= 3
+    assert run.output["chunks_per_second"] > 0
+    assert store.state() == ModelIndexState("new")
+    new_store = store.store("new")
+    matches = new_store.search(
+        "x", VectorSearchFilters(auth_user.id, courses[1].id, None), 10
+    )
+    assert {match.metadata["source"] for match in matches} == {
+        f"course-{courses[1].id}.txt",
+        "late.txt",
+    }
+    # The catch-up pass replaced the chunks of the same-version reindex.
+    reindexed = db_session.query(DocumentChunk).filter_by(
+        document_id=first_document.id
+    ).one()
+    assert [
+        match.metadata["chunk_id"]
+        for match in store.search(
+            "x", VectorSearchFilters(auth_user.id, courses[0].id, None), 10
+        )
+    ] == [reindexed.id]
+
+
+def test_faiss_store_course_index_applies_chunk_acl_and_deletes():
+    class DummyModel:
+        def encode(self, texts):
+            return np.asarray(
+                [[float(len(text)), 0.0] for text in texts], dtype=np.float32
+            )
+
+    from app.services.vector_store import VectorSearchFilters
+
+    store = FaissVectorStore(lambda: DummyModel())
+    metadata = {"owner_id": 1, "course_id": 20}
+    store.replace_document(
+        10,
+        1,
+        [
+            VectorRecord("exact", "query", {**metadata, "chunk_id": 100}),
+            VectorRecord("near", "query!", {**metadata, "chunk_id": 101}),
+        ],
+    )
+    store.replace_document(
+        11, 1, [VectorRecord("far", "a much longer text", {**metadata, "chunk_id": 102})]
+    )
+
+    def search(allowed):
+        return [
+            match.embedding_id
+            for match in store.search(
+                "query",
+                VectorSearchFilters(
+                    owner_id=1, course_id=20, allowed_chunk_ids=frozenset(allowed)
+                ),
+                5,
+            )
+        ]
+
+    assert search({100, 101, 102}) == ["exact", "near", "far"]
+    assert search({101, 102}) == ["near", "far"]
+    store.delete_document(10)
+    assert search({100, 101, 102}) == ["far"]
+    assert search({100}) == []
+
+
+def test_faiss_store_tombstones_rows_and_compacts_partition(monkeypatch):
+    class DummyModel:
+        def encode(self, texts):
+            return np.asarray(
+                [[float(len(text)), 0.0] for text in texts], dtype=np.float32
+            )
+
+    from app.services import vector_store
+    from app.services.vector_store import VectorSearchFilters
+
+    monkeypatch.setattr(vector_store._Segment, "compaction_min_rows", 2)
+    store = FaissVectorStore(lambda: DummyModel())
+    metadata = {"owner_id": 1, "course_id": 20}
+    store.replace_document(
+        10,
+        1,
+        [
+            VectorRecord(f"old-{index}", "x" * index, {**metadata, "chunk_id": index})
+            for index in range(1, 4)
+        ],
+    )
+    store.replace_document(
+        11, 1, [VectorRecord("kept", "kept", {**metadata, "chunk_id": 50})]
+    )
+    partition = store._partitions[(1, 20)]
+
+    store.replace_document(
+        10, 2, [VectorRecord("new", "new", {**metadata, "chunk_id": 4})]
+    )
+    assert (partition.row_count, len(partition)) == (2, 2)
+
+    matches = store.search(
+        "kept",
+        VectorSearchFilters(
+            owner_id=1, course_id=20, allowed_chunk_ids=frozenset({1, 2, 3, 4, 50})
+        ),
+        5,
+    )
+    assert [match.embedding_id for match in matches] == ["kept", "new"]
+
+
+def test_faiss_store_keeps_rows_in_columns_without_texts(tmp_path):
+    from app.services.vector_store import VectorSearchFilters
+
+    metadata = {"owner_id": 1, "course_id": 20, "kind": "document", "page": None}
+    writer = FaissVectorStore(lambda: _LengthModel(), tmp_path)
+    writer.replace_document(
+        10,
+        1,
+        [
+            VectorRecord(
+                f"document:10:v1:chunk:{index}",
+                f"secret chunk text {index}",
+                {**metadata, "chunk_id": index, "section": f"Глава {index % 2}"},
+            )
+            for index in range(3)
+        ],
+    )
+    partition = writer._partitions[(1, 20)]
+
+    assert partition.segments[0].strings == ["document", "Глава 0", "Глава 1"]
+    assert partition.record(1) == VectorRecord(
+        "document:10:v1:chunk:1",
+        "",
+        {
+            "owner_id": 1,
+            "course_id": 20,
+            "kind": "document",
+            "chunk_id": 1,
+            "section": "Глава 1",
+            "document_id": 10,
+            "document_version": 1,
+        },
+    )
+    assert not any(
+        b"secret" in path.read_bytes() for path in tmp_path.rglob("*") if path.is_file()
+    )
+
+    restarted = FaissVectorStore(lambda: _LengthModel(), tmp_path)
+    filters = VectorSearchFilters(owner_id=1, course_id=20, allowed_chunk_ids=None)
+    matches = restarted.search("x" * 19, filters, 5)
+    assert [match.metadata["section"] for match in matches] == [
+        "Глава 0",
+        "Глава 1",
+        "Глава 0",
+    ]
+
+    # Compaction drops the strings of deleted rows only.
+    restarted.replace_document(
+        10,
+        2,
+        [VectorRecord("new", "new text", {**metadata, "chunk_id": 5, "section": "Глава 1"})],
+    )
+    partition = restarted._partitions[(1, 20)]
+    partition.compact()
+    assert partition.segments[0].strings == ["document", "Глава 1"]
+    assert partition.record(0).metadata["section"] == "Глава 1"
+    assert partition.record(0).embedding_id == "new"
+
+
+def test_faiss_store_writes_segments_and_merges_them_in_background(
+    tmp_path, monkeypatch
+):
+    from app.services.vector_store import VectorSearchFilters
+
+    monkeypatch.setattr(FaissVectorStore, "max_segments", 2)
+    monkeypatch.setattr(FaissVectorStore, "merge_factor", 2)
+    store = FaissVectorStore(lambda: _LengthModel(), tmp_path)
+    directory = tmp_path / "owner_1" / "course_20"
+
+    def write(document_id, version):
+        store.replace_document(
+            document_id,
+            version,
+            [
+                VectorRecord(
+                    f"doc-{document_id}-v{version}",
+                    "x" * document_id,
+                    {"owner_id": 1, "course_id": 20, "chunk_id": document_id},
+                )
+            ],
+        )
+
+    write(1, 1)
+    write(2, 1)
+    first_segments = sorted(path.name for path in directory.glob("seg_*"))
+    # Replacing a document adds a segment and a tombstone, leaving the
+    # segments already written untouched.
+    write(1, 2)
+    assert (directory / "tombstones_00000003.npy").exists()
+    assert set(first_segments) <= {path.name for path in directory.glob("seg_*")}
+    assert (tmp_path / "documents.log").read_text().splitlines() == [
+        "1 1 20",
+        "2 1 20",
+        "1 1 20",
+    ]
+
+    store.wait_for_merges()
+    partition = store._partitions[(1, 20)]
+    assert len(partition.segments) <= 2
+    assert partition.row_count == len(partition) == 2
+
+    filters = VectorSearchFilters(owner_id=1, course_id=20, allowed_chunk_ids=None)
+    reopened = FaissVectorStore(lambda: _LengthModel(), tmp_path)
+    assert sorted(match.embedding_id for match in reopened.search("x", filters, 5)) == [
+        "doc-1-v2",
+        "doc-2-v1",
+    ]
+    reopened.delete_document(2)
+    reopened.merge_segments()
+    assert [
+        match.embedding_id for match in FaissVectorStore(
+            lambda: _LengthModel(), tmp_path
+        ).search("x", filters, 5)
+    ] == ["doc-1-v2"]
+    assert len(list(directory.glob("manifest_*.json"))) <= (
+        1 + FaissVectorStore.retained_generations
+    )
+
+
+def test_faiss_store_caches_queries_until_corpus_changes():
+    from app.services.search_cache import SearchCache
+    from app.services.vector_store import VectorSearchFilters
+
+    class CountingModel:
+        def __init__(self):
+            self.encoded = []
+
+        def encode(self, texts):
+            self.encoded.extend(texts)
+            return np.asarray(
+                [[float(len(text)), 0.0] for text in texts], dtype=np.float32
+            )
+
+    model = CountingModel()
+    cache = SearchCache("dummy", vector_entries=8, result_entries=8)
+    store = FaissVectorStore(lambda: model, search_cache=cache)
+    metadata = {"owner_id": 1, "course_id": 20}
+    store.replace_document(
+        10, 1, [VectorRecord("first", "a", {**metadata, "chunk_id": 100})]
+    )
+    filters = VectorSearchFilters(
+        owner_id=1, course_id=20, allowed_chunk_ids=frozenset({100, 101})
+    )
+    model.encoded.clear()
+
+    first = store.search("query ", filters, 5)
+    repeated = store.search(" query", filters, 5)
+    store.replace_document(
+        11, 1, [VectorRecord("second", "query", {**metadata, "chunk_id": 101})]
+    )
+    model.encoded.clear()
+    after_write = store.search("query", filters, 5)
+
+    assert [match.embedding_id for match in first] == ["first"]
+    assert repeated == first
+    assert [match.embedding_id for match in after_write] == ["second", "first"]
+    assert model.encoded == []
+    assert cache.results.stats()["hits"] == 1
+    assert cache.vectors.stats()["hits"] == 1
+
+
+def test_faiss_store_switches_large_partition_to_hnsw():
+    from app.services.vector_store import HnswConfig, VectorSearchFilters
+
+    vectors = np.random.default_rng(0).random((300, 8), dtype=np.float32)
+
+    class TableModel:
+        def encode(self, texts):
+            return np.asarray([vectors[int(text)] for text in texts])
+
+    store = FaissVectorStore(
+        lambda: TableModel(),
+        ann=HnswConfig(min_rows=200, m=8, exact_max_rows=10),
+    )
+    metadata = {"owner_id": 1, "course_id": 20}
+    for document_id in range(3):
+        store.replace_document(
+            document_id,
+            1,
+            [
+                VectorRecord(str(row), str(row), {**metadata, "chunk_id": row})
+                for row in range(document_id * 100, document_id * 100 + 100)
+            ],
+        )
+    partition = store._partitions[(1, 20)]
+    everything = frozenset(range(300))
+
+    matches = store.search(
+        "42",
+        VectorSearchFilters(owner_id=1, course_id=20, allowed_chunk_ids=everything),
+        3,
+        ef_search=128,
+    )
+    restricted = store.search(
+        "42",
+        VectorSearchFilters(
+            owner_id=1, course_id=20, allowed_chunk_ids=frozenset({7, 8})
+        ),
+        5,
+    )
+
+    assert partition.segments[0].is_approximate
+    assert matches[0].embedding_id == "42"
+    assert {match.embedding_id for match in restricted} == {"7", "8"}
+
+
+def test_faiss_store_quantizes_partition_and_rescores(tmp_path):
+    import faiss
+
+    from app.services.vector_store import CodecConfig, VectorSearchFilters
+
+    vectors = np.random.default_rng(0).random((300, 8), dtype=np.float32)
+
+    class TableModel:
+        def encode(self, texts):
+            return np.asarray([vectors[int(text)] for text in texts])
+
+    def open_store():
+        return FaissVectorStore(
+            lambda: TableModel(),
+            tmp_path,
+            codec=CodecConfig(
+                codec="pq", train_min_rows=256, pq_subquantizers=4, rescore=True
+            ),
+        )
+
+    store = open_store()
+    metadata = {"owner_id": 1, "course_id": 20}
+    for document_id in range(3):
+        store.replace_document(
+            document_id,
+            1,
+            [
+                VectorRecord(str(row), str(row), {**metadata, "chunk_id": row})
+                for row in range(document_id * 100, document_id * 100 + 100)
+            ],
+        )
+    everything = VectorSearchFilters(
+        owner_id=1, course_id=20, allowed_chunk_ids=frozenset(range(300))
+    )
+    restricted = VectorSearchFilters(
+        owner_id=1, course_id=20, allowed_chunk_ids=frozenset({7, 8})
+    )
+
+    # One segment per write until merged; large enough to train the codec.
+    store.merge_segments()
+    reopened = open_store()
+    for current in (store, reopened):
+        matches = current.search("42", everything, 3)
+        assert matches[0].embedding_id == "42"
+        assert matches[0].score == 1.0
+        assert {
+            match.embedding_id for match in current.search("42", restricted, 5)
+        } == {"7", "8"}
+    segment = reopened._partitions[(1, 20)].segments[0]
+    assert isinstance(segment.index, faiss.IndexPQ)
+    assert isinstance(segment.exact_vectors(), np.memmap)
@@ -1,5 +1,17 @@
+import zlib
+
+import numpy as np
+import pytest
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
 from app.models.feedback import Feedback
+from app.models.task import Task
 from app.models.theory import Theory
+from app.services.embedding_service import get_lesson_index
+from app.services.lesson_index import LessonContentIndex
+from app.services.vector_store import FaissVectorStore
+from main import app
 from tests.factories import make_course, make_lesson, make_module
 
 
@@ -38,24 +50,97 @@ def test_graph_only_exposes_owned_course(client, db_session, auth_user, auth_hea
     assert client.get("/api/graph", params={"course_id": foreign.id}, headers=auth_headers).status_code == 404
 
 
-def test_search_receives_only_owned_lesson_ids(
-    client, db_session, auth_user, auth_headers, monkeypatch
+class _WordHashModel:
+    def encode(self, texts):
+        vectors = np.zeros((len(texts), 64), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for word in text.lower().split():
+                vectors[row, zlib.crc32(word.encode()) % 64] += 1.0
+        return vectors
+
+
+@pytest.fixture
+def lesson_index():
+    index = LessonContentIndex(
+        FaissVectorStore(lambda: _WordHashModel(), partition_by_course=False),
+        sync_ttl_seconds=3600,
+    )
+    index.listen()
+    app.dependency_overrides[get_lesson_index] = lambda: index
+    yield index
+    for name, listener in (
+        ("after_flush", index._collect),
+        ("after_commit", index._apply),
+        ("after_rollback", index._discard),
+    ):
+        event.remove(Session, name, listener)
+    app.dependency_overrides.pop(get_lesson_index, None)
+
+
+def test_search_returns_only_owned_lesson_content(
+    client, db_session, auth_user, auth_headers, lesson_index
 ):
     course = make_course(db_session, owner_id=auth_user.id)
     module = make_module(db_session, course_id=course.id)
-    lesson = make_lesson(db_session, module_id=module.id)
-    captured = {}
-
-    def fake_search(query, k=5, allowed_lesson_ids=None):
-        captured["query"] = query
-        captured["lesson_ids"] = allowed_lesson_ids
-        return []
+    make_lesson(db_session, module_id=module.id, title="recursion basics")
+    foreign = make_course(db_session, owner_id=None)
+    foreign_module = make_module(db_session, course_id=foreign.id)
+    make_lesson(db_session, module_id=foreign_module.id, title="recursion secrets")
+    lesson_index.sync_pending(db_session)
 
-    monkeypatch.setattr("app.routes.search.search", fake_search)
-    response = client.get("/api/search", params={"q": "owned"}, headers=auth_headers)
+    response = client.get(
+        "/api/search", params={"q": "recursion"}, headers=auth_headers
+    )
 
     assert response.status_code == 200
-    assert captured == {"query": "owned", "lesson_ids": {lesson.id}}
+    results = response.json()["results"]
+    assert [(item["type"], item["course_id"]) for item in results] == [
+        ("lesson", course.id)
+    ]
+    assert (
+        client.get(
+            "/api/search",
+            params={"q": "recursion", "course_id": foreign.id},
+            headers=auth_headers,
+        ).status_code
+        == 404
+    )
+
+
+def test_search_reflects_content_updates_and_deletes(
+    client, db_session, auth_user, auth_headers, lesson_index
+):
+    course = make_course(db_session, owner_id=auth_user.id)
+    module = make_module(db_session, course_id=course.id)
+    lesson = make_lesson(db_session, module_id=module.id, title="sorting")
+    theory = Theory(lesson_id=lesson.id, content="bubble sort swaps neighbours")
+    task = Task(module_id=module.id, name="Task", description="merge sort arrays")
+    db_session.add_all([theory, task])
+    db_session.commit()
+
+    def search(query, **params):
+        # The sync thread is not running in tests.
+        lesson_index.sync_pending(db_session)
+        response = client.get(
+            "/api/search", params={"q": query, **params}, headers=auth_headers
+        )
+        assert response.status_code == 200
+        return response.json()["results"]
+
+    assert search("bubble sort")[0]["text"] == "bubble sort swaps neighbours"
+    assert len(search("sort", limit=2)) == 2
+
+    theory.content = "quick sort picks a pivot"
+    db_session.delete(task)
+    db_session.commit()
+    results = search("sort", limit=50)
+
+    assert {item["text"] for item in results} == {
+        "sorting\nd",
+        "quick sort picks a pivot",
+    }
+    assert {item["type"] for item in results} == {"lesson", "theory"}
+    assert results[0]["lesson_id"] == lesson.id
 
 
 def test_feedback_sets_authenticated_author(client, db_session, auth_user, auth_headers):
@@ -1,16 +1,23 @@
 from io import BytesIO
 
 import fitz
+import pytest
 from docx import Document as DocxDocument
 
-from app.services.document_processing import chunk_blocks, extract_blocks
+from app.services.document_processing import (
+    ExtractedBlock,
+    chunk_blocks,
+    extract_blocks,
+)
 
 
 def test_txt_extraction_and_chunking_preserve_section():
-    blocks = extract_blocks(
-        "# Введение\nПервый абзац.\nВторой абзац.".encode(), "text/plain"
+    blocks = list(
+        extract_blocks(
+            "# Введение\nПервый абзац.\nВторой абзац.".encode(), "text/plain"
+        )
     )
-    chunks = chunk_blocks(blocks, max_chars=40, overlap_chars=5)
+    chunks = list(chunk_blocks(blocks, max_size=40, overlap=5))
 
     assert blocks[0].section == "Введение"
     assert chunks
@@ -25,9 +32,11 @@ def test_docx_extraction_preserves_heading():
     document.add_paragraph("Содержимое раздела")
     document.save(stream)
 
-    blocks = extract_blocks(
-        stream.getvalue(),
-        "application/vnd.openxmlformats-officedocument.wordprocessingml.document",
+    blocks = list(
+        extract_blocks(
+            stream.getvalue(),
+            "application/vnd.openxmlformats-officedocument.wordprocessingml.document",
+        )
     )
 
     assert blocks[-1].text == "Содержимое раздела"
@@ -43,9 +52,11 @@ def test_docx_extraction_preserves_table_rows_and_section():
     table.cell(0, 1).text = "Описание"
     document.save(stream)
 
-    blocks = extract_blocks(
-        stream.getvalue(),
-        "application/vnd.openxmlformats-officedocument.wordprocessingml.document",
+    blocks = list(
+        extract_blocks(
+            stream.getvalue(),
+            "application/vnd.openxmlformats-officedocument.wordprocessingml.document",
+        )
     )
 
     assert blocks[-1].text == "Понятие | Описание"
@@ -59,7 +70,125 @@ def test_pdf_extraction_preserves_page_number():
     content = document.tobytes()
     document.close()
 
-    blocks = extract_blocks(content, "application/pdf")
+    blocks = list(extract_blocks(content, "application/pdf"))
 
     assert blocks[0].page == 1
     assert "PDF content" in blocks[0].text
+
+
+def test_file_extraction_streams_blocks_and_chunks(tmp_path):
+    path = tmp_path / "notes.txt"
+    path.write_text(
+        "\ufeff# Раздел\r\n" + "".join(f"Строка {index}.\r\n" for index in range(50)),
+        encoding="utf-8",
+    )
+
+    blocks = extract_blocks(path, "text/plain")
+    chunks = chunk_blocks(blocks, max_size=60, overlap=10)
+    first = next(chunks)
+
+    assert not isinstance(blocks, list)
+    assert first["chunk_index"] == 0
+    assert first["text"].startswith("# Раздел\nСтрока 0.")
+    assert list(
+        chunk_blocks(
+            extract_blocks(path.read_bytes(), "text/plain"),
+            max_size=60,
+            overlap=10,
+        )
+    ) == [first, *chunks]
+
+
+def test_pdf_extraction_from_file_path(tmp_path):
+    document = fitz.open()
+    for number in range(3):
+        document.new_page().insert_text((72, 72), f"Page {number + 1}")
+    path = tmp_path / "document.pdf"
+    document.save(path)
+    document.close()
+
+    blocks = list(extract_blocks(path, "application/pdf"))
+
+    assert [(block.page, block.text) for block in blocks] == [
+        (1, "Page 1"),
+        (2, "Page 2"),
+        (3, "Page 3"),
+    ]
+
+
+def test_unsupported_type_and_overlap_fail_before_iteration():
+    with pytest.raises(ValueError):
+        extract_blocks(b"", "image/png")
+    with pytest.raises(ValueError):
+        chunk_blocks([], max_size=10, overlap=10)
+
+
+def test_parallel_pdf_extraction_merges_pages_in_order(tmp_path):
+    document = fitz.open()
+    for number in range(9):
+        page = document.new_page()
+        page.insert_text((72, 72), f"Page {number + 1} first")
+        page.insert_text((72, 400), f"Page {number + 1} second")
+    path = tmp_path / "handbook.pdf"
+    document.save(path)
+    document.close()
+
+    sequential = list(extract_blocks(path, "application/pdf"))
+    parallel = list(
+        extract_blocks(path, "application/pdf", parallel_min_pages=4, workers=2)
+    )
+
+    assert parallel == sequential
+    assert [block.page for block in parallel] == [
+        number for number in range(1, 10) for _ in range(2)
+    ]
+
+
+def test_chunks_respect_size_and_cut_between_sentences():
+    sentences = [f"Предложение номер {index} о рекурсии." for index in range(40)]
+    blocks = [
+        ExtractedBlock(text=" ".join(sentences[start : start + 4]), section="A")
+        for start in range(0, 40, 4)
+    ]
+
+    chunks = list(chunk_blocks(blocks, max_size=120, overlap=40))
+
+    assert all(len(chunk["text"]) <= 120 for chunk in chunks)
+    for chunk in chunks:
+        for line in chunk["text"].split("\n"):
+            assert line.endswith(".")
+    # The next chunk repeats the last sentence of the previous one.
+    for previous, current in zip(chunks, chunks[1:]):
+        last = previous["text"].replace("\n", " ").split(". ")[-1]
+        assert current["text"].startswith(last.rstrip("."))
+    text = " ".join(chunk["text"].replace("\n", " ") for chunk in chunks)
+    assert all(sentence in text for sentence in sentences)
+
+
+def test_chunks_are_sized_with_pluggable_tokenizer_and_split_long_sentences():
+    words = [f"слово{index}" for index in range(100)]
+    blocks = [
+        ExtractedBlock(text="Короткое вступление.", page=1),
+        ExtractedBlock(text=" ".join(words), page=1),
+        ExtractedBlock(text="Другая страница.", page=2),
+    ]
+
+    chunks = list(
+        chunk_blocks(
+            blocks, max_size=30, overlap=5, length=lambda text: len(text.split())
+        )
+    )
+
+    assert all(len(chunk["text"].split()) <= 30 for chunk in chunks)
+    assert chunks[-1] == {
+        "text": "Другая страница.",
+        "page": 2,
+        "section": None,
+        "metadata_json": {"page": 2, "section": None},
+        "chunk_index": len(chunks) - 1,
+    }
+    first_page = " ".join(chunk["text"] for chunk in chunks[:-1]).split()
+    assert first_page[:2] == ["Короткое", "вступление."]
+    assert set(words) <= set(first_page)
+    # Overlap of a sentence longer than it repeats the last words.
+    assert chunks[1]["text"].split()[:5] == chunks[0]["text"].split()[-5:]
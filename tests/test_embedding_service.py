@@ -2,22 +2,462 @@
 import numpy as np
 import pytest
 
-from app.services import embedding_service as es
 
+def test_lesson_index_reembeds_only_changed_modules(db_session):
+    from app.models.lesson import Lesson
+    from app.services.lesson_index import LessonContentIndex
+    from app.services.vector_store import FaissVectorStore
+    from tests.factories import make_course, make_lesson, make_module
+
+    class CountingModel:
+        def __init__(self):
+            self.encoded = []
+
+        def encode(self, texts):
+            self.encoded.extend(texts)
+            return np.asarray([[float(len(text)), 1.0] for text in texts])
+
+    now = [0.0]
+    model = CountingModel()
+    index = LessonContentIndex(
+        FaissVectorStore(lambda: model, partition_by_course=False),
+        sync_ttl_seconds=30,
+        clock=lambda: now[0],
+    )
+    course = make_course(db_session, owner_id=7)
+    other = make_course(db_session, owner_id=7)
+    first = make_lesson(
+        db_session, module_id=make_module(db_session, course_id=course.id).id
+    )
+    second = make_lesson(
+        db_session, module_id=make_module(db_session, course_id=course.id).id
+    )
+    third = make_lesson(
+        db_session, module_id=make_module(db_session, course_id=other.id).id
+    )
+    search = lambda **scope: index.search("query", owner_id=7, limit=5, **scope)  # noqa: E731
+
+    # Searches serve what was synced; they never read the database.
+    assert search() == []
+    index.refresh(db_session)
+    assert {match.metadata["lesson_id"] for match in search()} == {
+        first.id,
+        second.id,
+        third.id,
+    }
+    assert {match.metadata["lesson_id"] for match in search(course_id=other.id)} == {
+        third.id
+    }
+    model.encoded.clear()
+
+    # Bulk statements bypass the session hooks; the stamp check finds them
+    # once the TTL has passed.
+    db_session.query(Lesson).filter(Lesson.id == second.id).update(
+        {Lesson.title: "Renamed"}
+    )
+    db_session.commit()
+    index.refresh(db_session)
+    assert model.encoded == []
+    now[0] = 31.0
+    index.refresh(db_session)
+    matches = search()
+    texts = list(index.texts(db_session, matches).values())
+
+    assert "Renamed\nd" in texts
+    # Queries aside, only the changed module reaches the model.
+    assert [text for text in model.encoded if text != "query"] == ["Renamed\nd"]
+    assert len(texts) == 3
+
+
+def test_lesson_index_refresh_stamps_all_courses_with_grouped_queries(db_session):
+    from sqlalchemy import event
+
+    from app.services.lesson_index import LessonContentIndex
+    from app.services.vector_store import FaissVectorStore
+    from tests.factories import make_course, make_lesson, make_module
+
+    class Model:
+        def encode(self, texts):
+            return np.asarray([[float(len(text)), 1.0] for text in texts])
+
+    now = [0.0]
+    index = LessonContentIndex(
+        FaissVectorStore(lambda: Model(), partition_by_course=False),
+        sync_ttl_seconds=30,
+        clock=lambda: now[0],
+    )
+    for owner_id in (7, 7, 8, 9):
+        course = make_course(db_session, owner_id=owner_id)
+        make_lesson(db_session, module_id=make_module(db_session, course_id=course.id).id)
+    index.refresh(db_session)
+
+    statements = []
+
+    def count(*args):
+        statements.append(args[2])
+
+    now[0] = 31.0
+    event.listen(db_session.bind, "before_cursor_execute", count)
+    try:
+        index.refresh(db_session)
+    finally:
+        event.remove(db_session.bind, "before_cursor_execute", count)
+
+    # Owners, live modules and one grouped query per content table, however
+    # many courses there are; unchanged modules read no content.
+    assert len(statements) == 6
+
+
+def test_lesson_index_thread_syncs_commits_of_this_process(db_session):
+    import time
+    from threading import Event
+
+    from sqlalchemy import event
+    from sqlalchemy.orm import Session, sessionmaker
+
+    from app.services.lesson_index import LessonContentIndex
+    from app.services.vector_store import FaissVectorStore
+    from tests.factories import make_course, make_lesson, make_module
+
+    class LengthModel:
+        def encode(self, texts):
+            return np.asarray([[float(len(text)), 1.0] for text in texts])
+
+    index = LessonContentIndex(
+        FaissVectorStore(LengthModel, partition_by_course=False),
+        sync_ttl_seconds=3600,
+    )
+    index.listen()
+    stop = Event()
+    try:
+        course = make_course(db_session, owner_id=7)
+        lesson = make_lesson(
+            db_session, module_id=make_module(db_session, course_id=course.id).id
+        )
+        thread = index.start(sessionmaker(bind=db_session.connection()), stop)
+
+        def wait_for(expected):
+            deadline = time.monotonic() + 5
+            while time.monotonic() < deadline:
+                found = {
+                    match.metadata["lesson_id"]
+                    for match in index.search("query", owner_id=7, limit=5)
+                }
+                if found == expected:
+                    return True
+                time.sleep(0.01)
+            return False
+
+        assert wait_for({lesson.id})
+        # Deleting the course wakes the thread, which drops its modules.
+        course.is_deleted = True
+        db_session.commit()
+        assert wait_for(set())
+    finally:
+        stop.set()
+        index.invalidate()
+        for name, listener in (
+            ("after_flush", index._collect),
+            ("after_commit", index._apply),
+            ("after_rollback", index._discard),
+        ):
+            event.remove(Session, name, listener)
+    thread.join(timeout=5)
+    assert not thread.is_alive()
+
+
+def test_embedding_cache_sends_only_misses_to_model(tmp_path):
+    from app.services.embedding_cache import SqliteEmbeddingCache
+    from app.services.vector_store import FaissVectorStore, VectorRecord
+
+    class CountingModel:
+        def __init__(self):
+            self.encoded = []
 
-def test_search_returns_k(monkeypatch):
-    # заменяем faiss index и модель
-    class DummyModel:
         def encode(self, texts):
-            return np.array([[1.0, 0.0, 0.0]], dtype=np.float32)
+            self.encoded.extend(texts)
+            return np.asarray([[float(len(text)), 1.0] for text in texts])
+
+    def records(*texts):
+        return [
+            VectorRecord(
+                f"chunk:{index}",
+                text,
+                {"owner_id": 1, "course_id": 2, "chunk_id": index},
+            )
+            for index, text in enumerate(texts)
+        ]
+
+    model = CountingModel()
+    cache_path = tmp_path / "embeddings.sqlite3"
+    store = FaissVectorStore(
+        lambda: model,
+        embedding_cache=SqliteEmbeddingCache(cache_path, "dummy-model"),
+    )
+    store.replace_document(1, 1, records("alpha", "beta", "alpha"))
+    store.replace_document(1, 2, records("alpha", "gamma"))
+
+    assert model.encoded == ["alpha", "beta", "gamma"]
+
+    other_model_cache = SqliteEmbeddingCache(cache_path, "other-model")
+    assert other_model_cache.get_many(["alpha"]) == [None]
+    restarted_cache = SqliteEmbeddingCache(cache_path, "dummy-model")
+    assert restarted_cache.get_many(["gamma"])[0].tolist() == [5.0, 1.0]
+
+
+def test_replace_document_encodes_only_new_texts():
+    from app.services.vector_store import (
+        CodecConfig,
+        FaissVectorStore,
+        VectorRecord,
+        VectorSearchFilters,
+    )
+
+    class CountingModel:
+        def __init__(self):
+            self.encoded = []
+
+        def encode(self, texts):
+            self.encoded.extend(texts)
+            return np.asarray([[float(len(text)), 1.0] for text in texts])
+
+    def records(*texts):
+        return [
+            VectorRecord(
+                f"chunk:{index}",
+                text,
+                {"owner_id": 1, "course_id": 2, "chunk_id": index},
+            )
+            for index, text in enumerate(texts)
+        ]
+
+    model = CountingModel()
+    store = FaissVectorStore(lambda: model)
+    store.replace_document(1, 1, records("alpha", "beta"))
+    store.replace_document(1, 1, records("gamma", "alpha"))
+    matches = store.search("beta", VectorSearchFilters(1, 2, None), 5)
+
+    assert model.encoded == ["alpha", "beta", "gamma", "beta"]
+    assert {match.embedding_id for match in matches} == {"chunk:0", "chunk:1"}
+
+    # The same file in another course reuses the vectors of its first copy.
+    copy = [
+        VectorRecord(
+            record.embedding_id, record.text, {**record.metadata, "course_id": 3}
+        )
+        for record in records("alpha", "gamma")
+    ]
+    store.replace_document(2, 1, copy, vector_source=1)
+    assert model.encoded == ["alpha", "beta", "gamma", "beta"]
+    assert len(store.search("alpha", VectorSearchFilters(1, 3, None), 5)) == 2
+
+    # Lossy codes are not reused: the model's vectors are the reference.
+    quantized_model = CountingModel()
+    quantized = FaissVectorStore(
+        lambda: quantized_model,
+        codec=CodecConfig(codec="sq8", rescore=False, train_min_rows=1),
+    )
+    quantized.replace_document(1, 1, records("alpha", "beta"))
+    quantized.replace_document(1, 1, records("alpha"))
+    assert quantized_model.encoded == ["alpha", "beta", "alpha"]
+
+
+def test_replace_document_reads_and_encodes_records_in_batches():
+    from app.services.vector_store import (
+        FaissVectorStore,
+        VectorRecord,
+        VectorSearchFilters,
+    )
+
+    class BatchModel:
+        def __init__(self):
+            self.batches = []
+
+        def encode(self, texts):
+            self.batches.append(list(texts))
+            return np.asarray([[float(len(text)), 1.0] for text in texts])
+
+    read = []
+
+    def records():
+        for index, text in enumerate(["a", "bb", "ccc", "dddd", "eeeee"]):
+            read.append(index)
+            yield VectorRecord(
+                f"chunk:{index}", text, {"owner_id": 1, "course_id": 2, "chunk_id": index}
+            )
+
+    model = BatchModel()
+    store = FaissVectorStore(lambda: model)
+    store.write_batch_size = 2
+    embedding_ids = store.replace_document(1, 1, records())
+
+    # Each batch is encoded as soon as it is read; one version is published.
+    assert model.batches == [["a", "bb"], ["ccc", "dddd"], ["eeeee"]]
+    assert read == [0, 1, 2, 3, 4]
+    assert embedding_ids == [f"chunk:{index}" for index in range(5)]
+    assert len(store.search("ccc", VectorSearchFilters(1, 2, None), 10)) == 5
+
+
+def test_micro_batch_encoder_coalesces_concurrent_queries():
+    from concurrent.futures import ThreadPoolExecutor
+    from threading import Barrier
+
+    from app.services.embedding_batcher import MicroBatchEncoder
+
+    class BatchRecordingModel:
+        def __init__(self):
+            self.batches = []
+
+        def encode(self, texts):
+            self.batches.append(list(texts))
+            return np.asarray([[float(len(text)), 0.0] for text in texts])
+
+    model = BatchRecordingModel()
+    encoder = MicroBatchEncoder(lambda: model, max_batch_size=64, max_wait_ms=200)
+    queries = [f"q{'x' * index}" for index in range(8)]
+    barrier = Barrier(len(queries))
+
+    def encode(query):
+        barrier.wait()
+        return encoder.encode([query])
+
+    with ThreadPoolExecutor(max_workers=len(queries)) as pool:
+        results = list(pool.map(encode, queries))
+
+    assert [result.tolist() for result in results] == [
+        [[float(len(query)), 0.0]] for query in queries
+    ]
+    assert len(model.batches) < len(queries)
+    stats = encoder.stats()
+    assert stats["texts"] == len(queries)
+    assert stats["batches"] == len(model.batches)
+    assert stats["queue_depth"] == 0
+
+
+def test_micro_batch_encoder_propagates_missing_model():
+    from app.services.embedding_batcher import MicroBatchEncoder
+
+    encoder = MicroBatchEncoder(lambda: None, max_wait_ms=0)
+    with pytest.raises(RuntimeError):
+        encoder.encode(["query"])
+
+
+def test_model_loader_loads_once_for_concurrent_callers():
+    from concurrent.futures import ThreadPoolExecutor
+    from threading import Event
+
+    from app.services.model_loader import ModelLoader
+
+    release = Event()
+    loads = []
+
+    class WarmedModel:
+        def __init__(self):
+            self.encoded = []
+
+        def encode(self, texts):
+            self.encoded.append(list(texts))
+
+    def factory():
+        loads.append(1)
+        release.wait(5)
+        return WarmedModel()
+
+    loader = ModelLoader(factory)
+    loader.start()
+    assert loader.status()["state"] == ModelLoader.LOADING
+
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        pending = [pool.submit(loader.get) for _ in range(4)]
+        release.set()
+        models = {id(future.result()) for future in pending}
+
+    assert len(loads) == 1
+    assert len(models) == 1
+    status = loader.status()
+    assert status["state"] == ModelLoader.READY
+    assert status["load_seconds"] is not None
+    assert loader.get().encoded == [["warm-up"]]
+
+
+def test_model_loader_reports_unavailable_model():
+    from app.services.model_loader import ModelLoader
+
+    def factory():
+        raise ImportError("no sentence_transformers")
+
+    loader = ModelLoader(factory)
+
+    assert loader.get() is None
+    assert loader.get() is None
+    assert loader.status()["state"] == ModelLoader.UNAVAILABLE
+    assert loader.status()["error"] == "no sentence_transformers"
+
+
+def test_onnx_model_mean_pools_normalizes_and_keeps_order():
+    from types import SimpleNamespace
+
+    from app.services.embedding_backends import OnnxEmbeddingModel
+
+    class FakeTokenizer:
+        def encode_batch(self, texts):
+            width = max(len(text.split()) for text in texts)
+            return [
+                SimpleNamespace(
+                    ids=[len(word) for word in text.split()]
+                    + [0] * (width - len(text.split())),
+                    attention_mask=[1] * len(text.split())
+                    + [0] * (width - len(text.split())),
+                    type_ids=[0] * width,
+                )
+                for text in texts
+            ]
+
+    class FakeSession:
+        def __init__(self):
+            self.feeds = []
+
+        def get_inputs(self):
+            return [SimpleNamespace(name="input_ids"), SimpleNamespace(name="attention_mask")]
+
+        def run(self, outputs, feeds):
+            self.feeds.append(set(feeds))
+            ids = feeds["input_ids"].astype(np.float32)
+            # Padding positions carry noise that pooling must ignore.
+            return [np.stack([ids, np.full_like(ids, 99.0)], axis=2)]
+
+    session = FakeSession()
+    model = OnnxEmbeddingModel(session, FakeTokenizer(), batch_size=2)
+    vectors = model.encode(["aaaa", "a bb", "ccc"])
+
+    expected = np.asarray([[4.0, 99.0], [1.5, 99.0], [3.0, 99.0]])
+    expected /= np.linalg.norm(expected, axis=1, keepdims=True)
+    assert np.allclose(vectors, expected)
+    assert session.feeds == [{"input_ids", "attention_mask"}] * 2
+
 
-    class DummyIndex:
-        def search(self, arr, k):
-            return np.array([[0.1, 0.2]]), np.array([[0, 1]])
+def test_onnx_backend_matches_torch_embeddings(tmp_path):
+    pytest.importorskip("onnxruntime")
+    pytest.importorskip("sentence_transformers")
+    from app.services.embedding_backends import (
+        OnnxEmbeddingModel,
+        export_onnx,
+        load_torch_model,
+    )
 
-    monkeypatch.setattr(es, "model", DummyModel())
-    monkeypatch.setattr(es, "index", DummyIndex())
-    monkeypatch.setattr(es, "metadata", ["a", "b", "c"])
+    texts = [
+        "Что такое политика информационной безопасности?",
+        "np.argsort returns the indices that would sort an array",
+        "короткий",
+    ]
+    export_onnx("all-MiniLM-L6-v2", tmp_path)
+    torch_vectors = np.asarray(load_torch_model("all-MiniLM-L6-v2").encode(texts))
 
-    out = es.search("q", k=2)
-    assert out == ["a", "b"]
+    for quantized, threshold in ((False, 0.999), (True, 0.97)):
+        vectors = OnnxEmbeddingModel.from_directory(
+            tmp_path, quantized=quantized, intra_op_threads=1
+        ).encode(texts)
+        cosine = (vectors * torch_vectors).sum(axis=1) / np.linalg.norm(
+            torch_vectors, axis=1
+        )
+        assert cosine.min() >= threshold
@@ -0,0 +1,173 @@
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from app.core.config import settings
+from app.database.db import Base
+from app.models.document import Document, DocumentChunk
+from app.models.generation_run import GenerationRun
+from app.models.user import User
+from app.repositories.pipeline import PipelineRepository
+from app.services.job_queue import claim_run, heartbeat, process_next_run
+from app.services.pipeline_service import PipelineService
+
+
+def _file_session(tmp_path):
+    engine = create_engine(f"sqlite:///{(tmp_path / 'queue.sqlite').as_posix()}")
+    Base.metadata.create_all(engine)
+    return sessionmaker(bind=engine)
+
+
+def test_reindex_is_queued_and_executed_by_a_worker(
+    client, db_session, auth_user, auth_headers, monkeypatch
+):
+    from tests.test_upload_pipeline import _course_and_document, _fake_embeddings
+
+    _, document, storage = _course_and_document(db_session, auth_user)
+    monkeypatch.setattr(
+        "app.services.pipeline_service.replace_document_embeddings",
+        _fake_embeddings,
+    )
+
+    response = client.post(
+        f"/api/documents/{document.id}/reindex", headers=auth_headers
+    )
+    again = client.post(f"/api/documents/{document.id}/reindex", headers=auth_headers)
+
+    assert response.status_code == 202
+    run_id = response.json()["id"]
+    assert response.json()["status"] == "queued"
+    assert response.headers["location"] == f"/api/generation-runs/{run_id}"
+    # A pending run is not queued twice.
+    assert again.status_code == 202
+    assert again.json()["id"] == run_id
+    assert db_session.get(Document, document.id).status == "queued"
+
+    assert process_next_run(db_session, "graph_generation", storage) is None
+    run = process_next_run(db_session, "document_index", storage)
+
+    assert run.id == run_id
+    assert process_next_run(db_session, "document_index", storage) is None
+    polled = client.get(f"/api/generation-runs/{run_id}", headers=auth_headers)
+    assert polled.status_code == 200
+    assert polled.json()["status"] == "succeeded"
+    assert polled.json()["output"]["chunk_count"] > 0
+    assert db_session.get(Document, document.id).status == "indexed"
+
+
+def test_worker_records_a_failed_run(tmp_path):
+    from tests.test_upload_pipeline import _course_and_document
+
+    # Failure handling rolls back, which the shared test transaction cannot
+    # survive; the run gets a database of its own.
+    db_session = _file_session(tmp_path)()
+    auth_user = User(email="queue@example.com", password_hash="not-used")
+    db_session.add(auth_user)
+    db_session.commit()
+    _, document, storage = _course_and_document(db_session, auth_user, b"\n\n")
+    queued = PipelineService.enqueue_reindex(
+        db_session, document_id=document.id, owner_id=auth_user.id
+    )
+
+    run = process_next_run(db_session, "document_index", storage)
+
+    assert run.id == queued.id
+    assert run.status == "failed"
+    assert "текст" in run.error
+    assert db_session.get(Document, document.id).status == "failed"
+    db_session.close()
+
+
+def test_claim_requeues_runs_whose_lease_expired(db_session, auth_user):
+    def add_run(status, lease_expires_at=None):
+        run = GenerationRun(
+            owner_id=auth_user.id,
+            run_type="document_index",
+            status=status,
+            input_docs=[],
+            lease_owner="crashed" if lease_expires_at else None,
+            lease_expires_at=lease_expires_at,
+        )
+        db_session.add(run)
+        db_session.commit()
+        return run.id
+
+    now = datetime.utcnow()
+    abandoned = add_run("running", now - timedelta(seconds=1))
+    active = add_run("running", now + timedelta(minutes=1))
+    # Executed inline, without a lease.
+    inline = add_run("running")
+    queued = add_run("queued")
+
+    claimed = claim_run(db_session, "document_index")
+    assert claimed.id == abandoned
+    assert claimed.lease_owner not in (None, "crashed")
+    assert claimed.lease_expires_at > now
+    assert claim_run(db_session, "document_index").id == queued
+    assert claim_run(db_session, "document_index") is None
+    assert db_session.get(GenerationRun, active).status == "running"
+    assert db_session.get(GenerationRun, inline).status == "running"
+    # The crashed worker can no longer renew the lease it held.
+    assert not PipelineRepository.renew_lease(
+        db_session, abandoned, "crashed", now + timedelta(minutes=1)
+    )
+    assert PipelineRepository.renew_lease(
+        db_session, abandoned, claimed.lease_owner, now + timedelta(minutes=1)
+    )
+
+
+def test_heartbeat_renews_the_lease_while_the_run_executes(tmp_path, monkeypatch):
+    session_factory = _file_session(tmp_path)
+    db = session_factory()
+    user = User(email="heartbeat@example.com", password_hash="not-used")
+    db.add(user)
+    db.commit()
+    db.add(
+        GenerationRun(
+            owner_id=user.id, run_type="graph_generation", status="queued", input_docs=[]
+        )
+    )
+    db.commit()
+    monkeypatch.setattr(settings, "JOB_LEASE_SECONDS", 0.3)
+    run = claim_run(db, "graph_generation")
+    claimed_until = run.lease_expires_at
+
+    with heartbeat(session_factory, run.id, run.lease_owner):
+        time.sleep(0.35)
+
+    db.expire_all()
+    assert db.get(GenerationRun, run.id).lease_expires_at > claimed_until
+    db.close()
+
+
+def test_worker_that_lost_its_lease_does_not_commit_results(tmp_path, monkeypatch):
+    from tests.test_upload_pipeline import _course_and_document, _fake_embeddings
+
+    db = _file_session(tmp_path)()
+    user = User(email="lease@example.com", password_hash="not-used")
+    db.add(user)
+    db.commit()
+    _, document, storage = _course_and_document(db, user)
+    queued = PipelineService.enqueue_reindex(db, document_id=document.id, owner_id=user.id)
+
+    def embed_while_reclaimed(document_id, version, chunks, vector_source=None):
+        # The lease expired meanwhile and another worker claimed the run.
+        db.query(GenerationRun).filter(GenerationRun.id == queued.id).update(
+            {GenerationRun.lease_owner: "another-worker"}
+        )
+        return _fake_embeddings(document_id, version, chunks)
+
+    monkeypatch.setattr(
+        "app.services.pipeline_service.replace_document_embeddings",
+        embed_while_reclaimed,
+    )
+
+    run = process_next_run(db, "document_index", storage)
+
+    assert run.id == queued.id
+    assert run.status == "running"
+    assert db.get(Document, document.id).status == "processing"
+    assert db.query(DocumentChunk).filter_by(document_id=document.id).count() == 0
+    db.close()
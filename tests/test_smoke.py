@@ -22,4 +22,21 @@ def test_readiness(client):
     body = r.json()
     assert body.get("ok") is True
     assert body.get("db") == "up"
-    
\ No newline at end of file
+    assert "state" in body["embedding_model"]
+
+
+def test_readiness_waits_for_model_warmup(client, monkeypatch):
+    from app.services.embedding_service import model_loader
+
+    monkeypatch.setattr(model_loader, "state", model_loader.LOADING)
+    r = client.get("/api/readiness")
+    assert r.status_code == 503
+    assert r.json()["embedding_model"]["state"] == "loading"
+
+
+def test_metrics_exposes_embedding_batcher():
+    r = client.get("/api/metrics")
+    assert r.status_code == 200
+    assert {"queue_depth", "batches", "average_batch_size"} <= set(
+        r.json()["embedding_batcher"]
+    )
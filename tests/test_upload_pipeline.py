@@ -1,3 +1,8 @@
+import weakref
+from contextlib import contextmanager
+from pathlib import Path
+from tempfile import TemporaryDirectory
+
 import pytest
 from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker
@@ -10,7 +15,10 @@ from app.models.domain_enums import CourseStatus
 from app.models.course_graph import CourseGraph
 from app.models.document import Document, DocumentChunk
 from app.models.generation_run import GenerationRun
+from app.core.config import settings
 from app.models.user import User
+from app.repositories.retrieval import RetrievalRepository
+from app.services.acl_cache import CourseAcl
 from app.services.pipeline_service import PipelineRunFailed, PipelineService
 
 
@@ -21,6 +29,13 @@ class MemoryStorage:
     def read_bytes(self, storage_key):
         return self.files[storage_key]
 
+    @contextmanager
+    def local_path(self, storage_key):
+        with TemporaryDirectory() as directory:
+            path = Path(directory) / storage_key
+            path.write_bytes(self.files[storage_key])
+            yield path
+
 
 def _course_and_document(db_session, auth_user, content=b"# Topic\nSome useful text"):
     course = Course(
@@ -61,7 +76,7 @@ def _course_and_document(db_session, auth_user, content=b"# Topic\nSome useful t
     return course, document, MemoryStorage({"document.txt": content})
 
 
-def _fake_embeddings(document_id, version, chunks):
+def _fake_embeddings(document_id, version, chunks, vector_source=None):
     return [
         f"document:{document_id}:v{version}:chunk:{chunk['chunk_index']}"
         for chunk in chunks
@@ -119,6 +134,348 @@ def test_reindex_is_idempotent_and_persists_run(
     assert document.status == "indexed"
 
 
+def _words(seed, count=200):
+    words = ["alpha", "beta", "gamma", "delta", "omega", "sigma", "kappa", "theta"]
+    return " ".join(
+        f"{words[(seed * 7 + index * 3) % 8]}{(seed * 31 + index * 17) % 97}"
+        for index in range(count)
+    )
+
+
+def test_reindex_links_near_duplicate_chunks_to_one_embedding(
+    db_session, auth_user, monkeypatch
+):
+    shared, own, other = _words(1), _words(2), _words(3)
+    course, first, storage = _course_and_document(
+        db_session, auth_user, f"# One\n{shared}\n\n# Two\n{own}".encode()
+    )
+    edited = shared.replace(shared.split()[50], "changed", 1)
+    second = Document(
+        storage_key="copy.txt",
+        owner_id=auth_user.id,
+        course_id=course.id,
+        version=1,
+        status="uploaded",
+        content_hash="def456",
+        source_type="upload",
+        original_filename="copy.txt",
+        mime_type="text/plain",
+        size_bytes=1,
+    )
+    db_session.add(second)
+    db_session.commit()
+    storage.files["copy.txt"] = f"# Copy\n{edited}\n\n# New\n{other}".encode()
+    embedded = []
+    reembedded = []
+
+    def record_embeddings(document_id, version, chunks, vector_source=None):
+        embedded.append((document_id, [chunk["chunk_id"] for chunk in chunks]))
+        return _fake_embeddings(document_id, version, chunks)
+
+    def record_reembedding(rows):
+        reembedded.append(sorted({row.document_id for row in rows}))
+        return {
+            row.id: f"document:{row.document_id}:v1:chunk:{row.chunk_index}"
+            for row in rows
+        }
+
+    monkeypatch.setattr(
+        "app.services.pipeline_service.replace_document_embeddings",
+        record_embeddings,
+    )
+    monkeypatch.setattr(
+        "app.services.pipeline_service.replace_chunk_embeddings",
+        record_reembedding,
+    )
+
+    def reindex(document):
+        return PipelineService.reindex_document(
+            db_session, document_id=document.id, owner_id=auth_user.id, storage=storage
+        )
+
+    def chunks(document):
+        return (
+            db_session.query(DocumentChunk)
+            .filter(DocumentChunk.document_id == document.id)
+            .order_by(DocumentChunk.chunk_index)
+            .all()
+        )
+
+    reindex(first)
+    run = reindex(second)
+    first_chunks, second_chunks = chunks(first), chunks(second)
+
+    assert run.output["duplicate_chunk_count"] == 1
+    assert run.output["embedding_count"] == 1
+    assert embedded[-1] == (second.id, [second_chunks[1].id])
+    assert second_chunks[0].canonical_chunk_id == first_chunks[0].id
+    assert second_chunks[0].embedding_id == first_chunks[0].embedding_id
+    assert second_chunks[1].canonical_chunk_id is None
+    acl = CourseAcl.from_rows(
+        RetrievalRepository.accessible_chunk_ids(db_session, course.id, auth_user.id)
+    )
+    assert acl.canonical_chunk_ids == {second_chunks[0].id: first_chunks[0].id}
+    vector_rows = RetrievalRepository.partition_chunks(
+        db_session, auth_user.id, course.id
+    )
+    assert {row.id for row in vector_rows} == {
+        first_chunks[0].id,
+        first_chunks[1].id,
+        second_chunks[1].id,
+    }
+
+    # Dropping the canonical chunk hands its vector to the duplicate.
+    storage.files["document.txt"] = f"# One\n{edited}\n\n# Two\n{own}".encode()
+    run = reindex(first)
+    db_session.expire_all()
+    first_chunks, second_chunks = chunks(first), chunks(second)
+
+    assert reembedded == [[second.id]]
+    assert second_chunks[0].canonical_chunk_id is None
+    assert second_chunks[0].embedding_id == f"document:{second.id}:v1:chunk:0"
+    assert first_chunks[0].canonical_chunk_id == second_chunks[0].id
+    assert first_chunks[0].embedding_id == second_chunks[0].embedding_id
+    assert run.output["duplicate_chunk_count"] == 1
+    assert run.output["deleted_chunk_count"] == 1
+    assert run.output["unchanged_chunk_count"] == 1
+
+
+def test_reindex_keeps_unchanged_chunks_and_applies_the_diff(
+    db_session, auth_user, monkeypatch
+):
+    kept, moved, dropped, added = _words(4), _words(5), _words(6), _words(7)
+    _, document, storage = _course_and_document(
+        db_session,
+        auth_user,
+        f"# Kept\n{kept}\n\n# Moved\n{moved}\n\n# Dropped\n{dropped}".encode(),
+    )
+    embedded = []
+
+    def record_embeddings(document_id, version, chunks, vector_source=None):
+        embedded.append([chunk["chunk_id"] for chunk in chunks])
+        return _fake_embeddings(document_id, version, chunks)
+
+    monkeypatch.setattr(
+        "app.services.pipeline_service.replace_document_embeddings",
+        record_embeddings,
+    )
+
+    def reindex():
+        return PipelineService.reindex_document(
+            db_session, document_id=document.id, owner_id=auth_user.id, storage=storage
+        )
+
+    def chunks():
+        db_session.expire_all()
+        return (
+            db_session.query(DocumentChunk)
+            .filter(DocumentChunk.document_id == document.id)
+            .order_by(DocumentChunk.chunk_index)
+            .all()
+        )
+
+    first = reindex()
+    before = chunks()
+    assert first.output["inserted_chunk_count"] == 3
+    assert [chunk.section for chunk in before] == ["Kept", "Moved", "Dropped"]
+
+    unchanged = reindex()
+    assert chunks() == before
+    assert {
+        key: unchanged.output[key]
+        for key in (
+            "unchanged_chunk_count",
+            "updated_chunk_count",
+            "inserted_chunk_count",
+            "deleted_chunk_count",
+        )
+    } == {
+        "unchanged_chunk_count": 3,
+        "updated_chunk_count": 0,
+        "inserted_chunk_count": 0,
+        "deleted_chunk_count": 0,
+    }
+
+    storage.files["document.txt"] = (
+        f"# Kept\n{kept}\n\n# Added\n{added}\n\n# Moved\n{moved}".encode()
+    )
+    run = reindex()
+    after = chunks()
+
+    assert run.output["unchanged_chunk_count"] == 1
+    assert run.output["updated_chunk_count"] == 1
+    assert run.output["inserted_chunk_count"] == 1
+    assert run.output["deleted_chunk_count"] == 1
+    assert [chunk.section for chunk in after] == ["Kept", "Added", "Moved"]
+    assert after[0].id == before[0].id
+    assert after[2].id == before[1].id
+    assert after[2].chunk_index == 2
+    assert after[2].metadata_json["section"] == "Moved"
+    assert after[2].embedding_id == f"document:{document.id}:v1:chunk:2"
+    assert after[1].text == f"# Added\n{added}"
+    assert after[1].fingerprint is not None
+    assert embedded[-1] == [chunk.id for chunk in after]
+
+
+def test_reindex_keeps_a_bounded_number_of_chunk_texts_in_memory(
+    db_session, auth_user, monkeypatch
+):
+    _, document, storage = _course_and_document(db_session, auth_user)
+    live = [0]
+    peak = [0]
+
+    class Text(str):
+        pass
+
+    def released():
+        live[0] -= 1
+
+    def chunk_blocks(texts):
+        for index, text in enumerate(texts):
+            tracked = Text(text)
+            weakref.finalize(tracked, released)
+            live[0] += 1
+            peak[0] = max(peak[0], live[0])
+            yield {"text": tracked, "page": 1, "section": None, "chunk_index": index}
+
+    embedded = []
+
+    def record_embeddings(document_id, version, chunks, vector_source=None):
+        # Texts are read back from the database, not handed over as a list.
+        assert not isinstance(chunks, list)
+        embedded.append(live[0])
+        return _fake_embeddings(document_id, version, chunks)
+
+    monkeypatch.setattr(settings, "DOCUMENT_INDEX_BATCH_SIZE", 4)
+    monkeypatch.setattr(
+        "app.services.pipeline_service.replace_document_embeddings",
+        record_embeddings,
+    )
+
+    def reindex(texts):
+        monkeypatch.setattr(
+            "app.services.pipeline_service.chunk_blocks",
+            lambda blocks, **sizes: chunk_blocks(texts),
+        )
+        peak[0] = 0
+        return PipelineService.reindex_document(
+            db_session, document_id=document.id, owner_id=auth_user.id, storage=storage
+        )
+
+    texts = [f"{index} {_words(index, 20)}" for index in range(40)]
+    first = reindex(texts)
+    # A new first chunk moves every kept row one position down.
+    second = reindex(["new " + _words(99, 20), *texts[:20], *texts[25:]])
+    db_session.expire_all()
+    rows = (
+        db_session.query(DocumentChunk)
+        .filter(DocumentChunk.document_id == document.id)
+        .order_by(DocumentChunk.chunk_index)
+        .all()
+    )
+
+    assert first.output["chunk_count"] == 40
+    assert second.output["inserted_chunk_count"] == 1
+    assert second.output["updated_chunk_count"] == 35
+    assert second.output["deleted_chunk_count"] == 5
+    assert [row.chunk_index for row in rows] == list(range(36))
+    assert [row.text for row in rows[1:]] == texts[:20] + texts[25:]
+    # At most the batch in flight and the one before it, never the document.
+    assert peak[0] <= 2 * 4 + 1
+    assert all(count <= 4 for count in embedded)
+
+
+def test_reindex_reuses_chunks_of_the_same_file_in_another_course(
+    db_session, auth_user, monkeypatch
+):
+    content = f"# One\n{_words(8)}\n\n# Two\n{_words(9)}".encode()
+    _, first, storage = _course_and_document(
+        db_session, auth_user, content
+    )
+    second_course, second, _ = _course_and_document(db_session, auth_user, content)
+    second.storage_key = "copy.txt"
+    db_session.commit()
+    sources = []
+
+    def record_embeddings(document_id, version, chunks, vector_source=None):
+        sources.append(vector_source)
+        return _fake_embeddings(document_id, version, chunks)
+
+    monkeypatch.setattr(
+        "app.services.pipeline_service.replace_document_embeddings",
+        record_embeddings,
+    )
+
+    def reindex(document):
+        return PipelineService.reindex_document(
+            db_session, document_id=document.id, owner_id=auth_user.id, storage=storage
+        )
+
+    def chunks(document):
+        return (
+            db_session.query(DocumentChunk)
+            .filter(DocumentChunk.document_id == document.id)
+            .order_by(DocumentChunk.chunk_index)
+            .all()
+        )
+
+    reindex(first)
+    # The copy is never read from storage: "copy.txt" does not exist.
+    run = reindex(second)
+
+    assert run.status == "succeeded"
+    assert run.output["artifact_document_id"] == first.id
+    assert sources == [None, first.id]
+    first_chunks, second_chunks = chunks(first), chunks(second)
+    assert [chunk.text for chunk in second_chunks] == [
+        chunk.text for chunk in first_chunks
+    ]
+    assert {chunk.id for chunk in second_chunks}.isdisjoint(
+        chunk.id for chunk in first_chunks
+    )
+    assert second_chunks[0].metadata_json["course_id"] == second_course.id
+    assert second.chunking_key == first.chunking_key
+
+    # Other chunk settings cut the file differently: the artifact is stale.
+    monkeypatch.setattr(
+        "app.services.pipeline_service.settings.DOCUMENT_CHUNK_CHARS", 1000
+    )
+    with pytest.raises(PipelineRunFailed):
+        reindex(second)
+
+
+def test_reindex_does_not_share_artifacts_between_owners(
+    db_session, auth_user, monkeypatch
+):
+    content = f"# Shared\n{_words(8)}".encode()
+    other_user = User(email="other-owner@example.com", password_hash="not-used")
+    db_session.add(other_user)
+    db_session.commit()
+    _, first, storage = _course_and_document(db_session, auth_user, content)
+    _, foreign, _ = _course_and_document(db_session, other_user, content)
+    sources = []
+
+    def record_embeddings(document_id, version, chunks, vector_source=None):
+        sources.append(vector_source)
+        return _fake_embeddings(document_id, version, chunks)
+
+    monkeypatch.setattr(
+        "app.services.pipeline_service.replace_document_embeddings",
+        record_embeddings,
+    )
+
+    PipelineService.reindex_document(
+        db_session, document_id=first.id, owner_id=auth_user.id, storage=storage
+    )
+    run = PipelineService.reindex_document(
+        db_session, document_id=foreign.id, owner_id=other_user.id, storage=storage
+    )
+
+    assert run.status == "succeeded"
+    assert run.output["artifact_document_id"] is None
+    assert sources == [None, None]
+
+
 def test_reindex_failure_is_persisted(tmp_path, monkeypatch):
     engine = create_engine(f"sqlite:///{(tmp_path / 'failure.sqlite').as_posix()}")
     Base.metadata.create_all(engine)